@@ -17,6 +17,7 @@ analysis. It can be used to compute the region of attraction and together with
    get_safe_sample
    smallest_boundary_value
    get_lyapunov_region
+   VerificationPool
 
 
 Approximate Dynamics Programming
@@ -53,10 +54,35 @@ multiplied, and stacked as needed.
    Saturation
    NeuralNetwork
    GaussianProcess
+   LocalGaussianProcess
+   merge_gaussian_processes
    GPRCached
+   SGPRCached
+   SparseGPRCached
+   Wendland
+   GPRConjugateGradient
+   GPRRandomFeatures
+   GPRKronecker
    sample_gp_function
 
 
+Deployment
+----------
+
+Trained GPs can be exported to lightweight predictors that only require
+numpy and scipy. Without tensorflow installed, importing the package only
+provides these predictors.
+
+.. autosummary::
+
+   :template: template.rst
+   :toctree:
+
+   GaussianProcessPredictor
+   export_predictor
+   load_predictor
+
+
 Utilities
 ---------
 
@@ -87,15 +113,24 @@ These are utilities to make working with tensorflow more pleasant.
 
 from __future__ import absolute_import
 
-# Add the configuration settings
-from .configuration import Configuration
-config = Configuration()
-del Configuration
-
-from .functions import *
-from .lyapunov import *
-from .reinforcement_learning import *
-from . import utilities
+try:
+    import tensorflow
+except ImportError:
+    # Deployment without tensorflow, only the numpy predictors are available
+    from .predictors import *
+else:
+    del tensorflow
+
+    # Add the configuration settings
+    from .configuration import Configuration
+    config = Configuration()
+    del Configuration
+
+    from .functions import *
+    from .lyapunov import *
+    from .reinforcement_learning import *
+    from .predictors import *
+    from . import utilities
 
 try:
     from pytest import main as run_tests
@@ -18,6 +18,10 @@ class Configuration(object):
         # Batch size for stability verification
         self.gp_batch_size = 10000
 
+        # Memory budget (bytes) for the kernel matrices in GP predictions,
+        # larger inputs are evaluated in chunks. None disables chunking.
+        self.gp_memory_limit = 2 ** 29
+
     @property
     def np_dtype(self):
         """Return the numpy dtype."""
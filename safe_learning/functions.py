@@ -3,11 +3,13 @@
 from __future__ import absolute_import, print_function, division
 
 from types import ModuleType
-from itertools import product as cartesian
-from functools import partial
+import copy
+from itertools import product as cartesian, permutations, chain
+from functools import partial, reduce
 
 from future.builtins import zip, range
 from scipy import spatial, sparse, linalg
+from scipy.sparse.linalg import splu
 import tensorflow as tf
 import numpy as np
 try:
@@ -22,11 +24,20 @@ from safe_learning import config
 __all__ = ['DeterministicFunction', '_Triangulation', 'Triangulation',
            'PiecewiseConstant', 'GridWorld', 'UncertainFunction',
            'FunctionStack', 'QuadraticFunction', 'GaussianProcess',
-           'GPRCached', 'sample_gp_function', 'LinearSystem', 'Saturation',
+           'LocalGaussianProcess', 'GPRCached', 'SGPRCached',
+           'SparseGPRCached', 'Wendland', 'GPRConjugateGradient',
+           'GPRRandomFeatures', 'GPRKronecker', 'merge_gaussian_processes',
+           'sample_gp_function', 'LinearSystem', 'Saturation',
            'NeuralNetwork']
 
 _EPS = np.finfo(config.np_dtype).eps
 
+# Tolerance for points that lie on the faces of simplices
+_SIMPLEX_TOLERANCE = 1e-10
+
+# Number of simplices that are searched at once in `Triangulation`
+_SIMPLEX_CHUNK_SIZE = 16
+
 
 class Function(object):
     """TensorFlow function baseclass.
@@ -290,6 +301,27 @@ class FunctionStack(UncertainFunction):
 
         return mean, error
 
+    def to_mean_function(self):
+        """Turn the stack into a deterministic 'mean' function.
+
+        Uses the mean functions of the individual Gaussian processes, so that
+        fast mean-only predictions are used where available. Other functions
+        are evaluated through their template to share variables.
+        """
+        mean_functions = []
+        for fun in self.functions:
+            if isinstance(fun, GaussianProcess):
+                mean_functions.append(fun.to_mean_function())
+            else:
+                mean_functions.append(lambda points, fun=fun: fun(points)[0])
+
+        @concatenate_inputs(start=0)
+        def mean_function(points):
+            means = [fun(points) for fun in mean_functions]
+            return tf.concat(means, axis=1, name='stacked_mean')
+
+        return mean_function
+
     def add_data_point(self, x, y):
         """Add data points to the GP model and update cholesky.
 
@@ -354,6 +386,101 @@ class Saturation(DeterministicFunction):
         return tf.minimum(tf.maximum(res, self.lower), self.upper)
 
 
+class _GrowableDataHolder(gpflow.param.DataHolder):
+    """A gpflow DataHolder for 2D data that supports appending rows.
+
+    The data is stored in a buffer whose capacity is doubled when it is
+    full, so that appending k rows costs amortized O(k). The value of the
+    DataHolder, which is fed to tensorflow, is a view on the valid rows.
+
+    Parameters
+    ----------
+    array : ndarray
+        The initial 2D data.
+
+    """
+
+    def __init__(self, array):
+        """Initialization, see `_GrowableDataHolder`."""
+        super(_GrowableDataHolder, self).__init__(array,
+                                                  on_shape_change='pass')
+        self._buffer = self._array
+
+    def set_data(self, array):
+        """Replace the data."""
+        super(_GrowableDataHolder, self).set_data(array)
+        self._buffer = self._array
+
+    def append(self, rows):
+        """Append rows to the data.
+
+        Parameters
+        ----------
+        rows : ndarray
+            A 2D array with the new rows.
+
+        """
+        rows = np.atleast_2d(rows)
+        length = len(self._array)
+        new_length = length + len(rows)
+
+        if new_length > len(self._buffer):
+            capacity = max(new_length, 2 * len(self._buffer))
+            buffer = np.empty((capacity,) + self._buffer.shape[1:],
+                              dtype=self._buffer.dtype)
+            buffer[:length] = self._array
+            self._buffer = buffer
+
+        self._buffer[length:new_length] = rows
+        self._array = self._buffer[:new_length]
+
+    def remove(self, index):
+        """Remove a row from the data.
+
+        Parameters
+        ----------
+        index : int
+            The index of the row to remove.
+
+        """
+        length = len(self._array)
+        self._buffer[index:length - 1] = self._buffer[index + 1:length]
+        self._array = self._buffer[:length - 1]
+
+
+def _cholesky_rank_one_update(cholesky, vector):
+    """Return the cholesky decomposition of L L^T + v v^T.
+
+    Parameters
+    ----------
+    cholesky : ndarray
+        The lower-triangular cholesky decomposition L.
+    vector : ndarray
+        The 1D vector v.
+
+    Returns
+    -------
+    cholesky : ndarray
+        The updated lower-triangular cholesky decomposition.
+
+    """
+    cholesky = cholesky.copy()
+    vector = vector.copy()
+
+    for k in range(len(vector)):
+        diagonal = np.hypot(cholesky[k, k], vector[k])
+        cos = diagonal / cholesky[k, k]
+        sin = vector[k] / cholesky[k, k]
+        cholesky[k, k] = diagonal
+
+        cholesky[k + 1:, k] += sin * vector[k + 1:]
+        cholesky[k + 1:, k] /= cos
+        vector[k + 1:] *= cos
+        vector[k + 1:] -= sin * cholesky[k + 1:, k]
+
+    return cholesky
+
+
 class GPRCached(gpflow.gpr.GPR):
     """gpflow.gpr.GPR class that stores cholesky decomposition for efficiency.
 
@@ -368,11 +495,23 @@ class GPRCached(gpflow.gpr.GPR):
     scale : float, optional
         An internal scaling factor used during GP prediction for improved
         numerical stability.
+    max_data : int, optional
+        The maximum number of data points. When adding data beyond this
+        limit, the least informative data points (with the smallest
+        leave-one-out variance) are removed with cholesky downdates.
+
+    Notes
+    -----
+    The posterior at a fixed set of points (e.g., the states of a
+    discretization) can be cached with `set_prediction_points`. The cached
+    mean and variance are then updated along with the cholesky
+    decomposition in `add_data_point` and can be read with
+    `predict_cached`.
 
     """
 
     def __init__(self, x, y, kern, mean_function=gpflow.mean_functions.Zero(),
-                 scale=1., name='GPRCached'):
+                 scale=1., max_data=None, name='GPRCached'):
         """Initialize GP and cholesky decomposition."""
         # Make sure gpflow is imported
         if not isinstance(gpflow, ModuleType):
@@ -381,38 +520,1754 @@ class GPRCached(gpflow.gpr.GPR):
         # self.scope_name = scope.original_name_scope
         gpflow.gpr.GPR.__init__(self, x, y, kern, mean_function, name)
 
-        # Create new dataholders for the cached data
-        # TODO zero-dim dataholders cause strange allocator errors in
-        # tensorflow with MKL
+        # Data buffers that grow without copying the data on each update
+        self.X = _GrowableDataHolder(self.X.value)
+        self.Y = _GrowableDataHolder(self.Y.value)
+
+        # Create new dataholders for the cached data
+        # TODO zero-dim dataholders cause strange allocator errors in
+        # tensorflow with MKL
+        dtype = config.np_dtype
+        self.cholesky = gpflow.param.DataHolder(np.empty((0, 0), dtype=dtype),
+                                                on_shape_change='pass')
+        self.alpha = gpflow.param.DataHolder(np.empty((0, 0), dtype=dtype),
+                                             on_shape_change='pass')
+        self.mean_weights = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+        self.prediction_points = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+        self.prediction_mean = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+        self.prediction_var = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+        self._has_prediction_points = False
+
+        self._scale = scale
+        self.max_data = max_data
+        self._inverse_diag = None
+        self._cache_state = None
+        self.update_cache()
+
+    @with_scope('compute_cache')
+    @gpflow.param.AutoFlow()
+    def _compute_cache(self):
+        """Compute cache."""
+        # Scaled kernel
+        identity = tf.eye(tf.shape(self.X)[0], dtype=config.dtype)
+        kernel = self.kern.K(self.X) + identity * self.likelihood.variance
+        kernel *= (self._scale ** 2)
+
+        # Scaled target
+        target = self._scale * (self.Y - self.mean_function(self.X))
+
+        # Cholesky decomposition
+        cholesky = tf.cholesky(kernel, name='gp_cholesky')
+        alpha = tf.matrix_triangular_solve(cholesky, target, name='gp_alpha')
+
+        # Weights for the mean prediction, K(X, X)^-1 (y - m(X))
+        mean_weights = tf.matrix_triangular_solve(cholesky, alpha,
+                                                  adjoint=True,
+                                                  name='gp_mean_weights')
+
+        return cholesky, alpha, mean_weights
+
+    def _build_cache_update(self, x, y):
+        """Build the block cholesky update for new data points.
+
+        Parameters
+        ----------
+        x : Tensor
+            The new states, one on each row.
+        y : Tensor
+            The new measurements, one on each row.
+
+        Returns
+        -------
+        cholesky : Tensor
+            The updated cholesky decomposition.
+        alpha : Tensor
+            The updated alpha.
+        mean_weights : Tensor
+            The updated weights for the mean prediction.
+        cross : Tensor
+            The off-diagonal block of the new cholesky decomposition
+            (transposed).
+        cholesky_new : Tensor
+            The cholesky decomposition of the Schur complement.
+        alpha_new : Tensor
+            The new rows of alpha.
+
+        """
+        # Scaled kernels
+        kernel_cross = (self._scale ** 2) * self.kern.K(self.X, x)
+        identity = tf.eye(tf.shape(x)[0], dtype=config.dtype)
+        kernel_new = self.kern.K(x) + identity * self.likelihood.variance
+        kernel_new *= (self._scale ** 2)
+
+        # Scaled target
+        target = self._scale * (y - self.mean_function(x))
+
+        # Off-diagonal block and cholesky of the Schur complement
+        cross = tf.matrix_triangular_solve(self.cholesky, kernel_cross,
+                                           lower=True)
+        schur = kernel_new - tf.matmul(cross, cross, transpose_a=True)
+        cholesky_new = tf.cholesky(schur, name='gp_cholesky_update')
+
+        target -= tf.matmul(cross, self.alpha, transpose_a=True)
+        alpha_new = tf.matrix_triangular_solve(cholesky_new, target,
+                                               name='gp_alpha_update')
+
+        # Assemble the lower-triangular block matrix
+        zeros = tf.zeros(tf.shape(kernel_cross), dtype=config.dtype)
+        upper = tf.concat((self.cholesky, zeros), axis=1)
+        lower = tf.concat((tf.transpose(cross), cholesky_new), axis=1)
+        cholesky = tf.concat((upper, lower), axis=0)
+        alpha = tf.concat((self.alpha, alpha_new), axis=0)
+
+        mean_weights = tf.matrix_triangular_solve(cholesky, alpha,
+                                                  adjoint=True,
+                                                  name='gp_mean_weights')
+
+        return cholesky, alpha, mean_weights, cross, cholesky_new, alpha_new
+
+    @with_scope('compute_cache_update')
+    @gpflow.param.AutoFlow((config.dtype, [None, None]),
+                           (config.dtype, [None, None]))
+    def _compute_cache_update(self, x, y):
+        """Append new data points to the cache (block cholesky update)."""
+        return self._build_cache_update(x, y)[:3]
+
+    def _build_chunked_prediction_cache(self, predict, num_data):
+        """Evaluate the prediction cache in chunks of the prediction points.
+
+        The number of prediction points in each chunk is chosen so that the
+        kernel matrices with the data respect `config.gp_memory_limit`, see
+        `GaussianProcess._build_chunked_predict`.
+
+        Parameters
+        ----------
+        predict : callable
+            A function that takes the start and end index of a chunk of the
+            prediction points and returns the mean and variance for them.
+        num_data : Tensor
+            The number of data points in the kernel matrices.
+
+        Returns
+        -------
+        mean : Tensor
+        var : Tensor
+
+        """
+        num_points = tf.shape(self.prediction_points)[0]
+        if config.gp_memory_limit is None:
+            return predict(0, num_points)
+
+        # Kernel matrix, triangular solve, and temporary copies
+        itemsize = np.dtype(config.np_dtype).itemsize
+        max_elements = config.gp_memory_limit // (3 * itemsize)
+        max_elements = min(max_elements, np.iinfo(np.int32).max)
+
+        chunk_size = tf.maximum(max_elements // tf.maximum(num_data, 1), 1)
+        num_chunks = tf.maximum((num_points + chunk_size - 1) // chunk_size,
+                                1)
+
+        def body(i, *arrays):
+            start = i * chunk_size
+            outputs = predict(start, start + chunk_size)
+            arrays = [array.write(i, output)
+                      for array, output in zip(arrays, outputs)]
+            return [i + 1] + arrays
+
+        def predict_chunks():
+            arrays = [tf.TensorArray(config.dtype, size=num_chunks,
+                                     infer_shape=False)
+                      for _ in range(2)]
+
+            arrays = tf.while_loop(lambda i, *_: i < num_chunks, body,
+                                   loop_vars=[tf.constant(0)] + arrays)[1:]
+            return tuple(array.concat() for array in arrays)
+
+        # Only loop over chunks if the points do not fit into memory at once
+        return tf.cond(num_chunks > 1, predict_chunks,
+                       lambda: tuple(predict(0, num_points)), strict=True)
+
+    @with_scope('compute_prediction_cache')
+    @gpflow.param.AutoFlow()
+    def _compute_prediction_cache(self):
+        """Compute the scaled posterior at the prediction points."""
+        def predict(start, end):
+            points = self.prediction_points[start:end]
+            kernel = (self._scale ** 2) * self.kern.K(self.X, points)
+            a = tf.matrix_triangular_solve(self.cholesky, kernel, lower=True)
+
+            mean = (tf.matmul(a, self.alpha, transpose_a=True)
+                    + self._scale * self.mean_function(points))
+            var = ((self._scale ** 2) * self.kern.Kdiag(points)
+                   - tf.reduce_sum(tf.square(a), 0))
+            return mean, var[:, None]
+
+        return self._build_chunked_prediction_cache(predict,
+                                                    tf.shape(self.X)[0])
+
+    @with_scope('compute_prediction_cache_update')
+    @gpflow.param.AutoFlow((config.dtype, [None, None]),
+                           (config.dtype, [None, None]))
+    def _compute_prediction_cache_update(self, x, y):
+        """Append new data points to the cache and the prediction cache."""
+        cholesky, alpha, mean_weights, cross, cholesky_new, alpha_new = \
+            self._build_cache_update(x, y)
+
+        weights = tf.matrix_triangular_solve(self.cholesky, cross,
+                                             lower=True, adjoint=True)
+
+        def predict(start, end):
+            # Posterior covariance between the new data and prediction
+            # points, K(x, P) - K(x, X) K(X, X)^-1 K(X, P)
+            points = self.prediction_points[start:end]
+            kernel = self.kern.K(x, points) - tf.matmul(
+                weights, self.kern.K(self.X, points), transpose_a=True)
+            kernel *= (self._scale ** 2)
+
+            # New rows of the triangular solve for the prediction points
+            a_new = tf.matrix_triangular_solve(cholesky_new, kernel,
+                                               lower=True)
+
+            mean = self.prediction_mean[start:end] + tf.matmul(
+                a_new, alpha_new, transpose_a=True)
+            var = (self.prediction_var[start:end]
+                   - tf.reduce_sum(tf.square(a_new), 0)[:, None])
+            return mean, var
+
+        num_data = tf.shape(self.X)[0] + tf.shape(x)[0]
+        mean, var = self._build_chunked_prediction_cache(predict, num_data)
+
+        return cholesky, alpha, mean_weights, mean, var
+
+    @with_scope('compute_prediction_kernel')
+    @gpflow.param.AutoFlow((config.dtype, [None, None]))
+    def _compute_prediction_kernel(self, weights):
+        """Return the scaled kernel between prediction and data points."""
+        kernel = self.kern.K(self.prediction_points, self.X)
+        return (self._scale ** 2) * tf.matmul(kernel, weights)
+
+    def update_cache(self):
+        """Update the cache after adding data points."""
+        self.cholesky, self.alpha, self.mean_weights = self._compute_cache()
+        self._cache_state = self.get_free_state().copy()
+        if self.max_data is not None:
+            # Diagonal of the inverse kernel matrix
+            cholesky = self.cholesky.value
+            inverse = linalg.solve_triangular(cholesky,
+                                              np.eye(len(cholesky)),
+                                              lower=True)
+            self._inverse_diag = np.sum(inverse ** 2, axis=0)
+        if self._has_prediction_points:
+            self.prediction_mean, self.prediction_var = \
+                self._compute_prediction_cache()
+
+    def set_prediction_points(self, points):
+        """Set the points at which the posterior is cached.
+
+        The posterior mean and variance at these points are updated
+        incrementally when adding data with `add_data_point`. This costs
+        O(n N) for n data points and N prediction points, rather than the
+        O(n^2 N) of a full prediction.
+
+        Parameters
+        ----------
+        points : ndarray
+            A 2d array with the prediction points, one on each row.
+
+        """
+        self.prediction_points = np.atleast_2d(points).astype(config.np_dtype)
+        self._has_prediction_points = True
+        self.prediction_mean, self.prediction_var = \
+            self._compute_prediction_cache()
+
+    def predict_cached(self):
+        """Return the cached posterior at the prediction points.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the prediction points.
+        var : ndarray
+            The variance at the prediction points.
+
+        """
+        if not self._has_prediction_points:
+            raise ValueError('Prediction points have not been set, see '
+                             '`set_prediction_points`.')
+
+        mean = self.prediction_mean.value / self._scale
+        var = self.prediction_var.value / (self._scale ** 2)
+        var = np.tile(var, (1, self.Y.shape[1]))
+        return mean, var
+
+    def _cache_is_valid(self):
+        """Check whether the cache matches the data and hyperparameters."""
+        if self._cache_state is None:
+            return False
+        if self.cholesky.shape[0] != self.X.shape[0]:
+            return False
+        return np.array_equal(self._cache_state, self.get_free_state())
+
+    def add_data_point(self, x, y):
+        """Add data points to the GP model and update the cache.
+
+        The cholesky decomposition is extended by the new rows in
+        O(n^2 k) for k new data points. It is only recomputed from
+        scratch if the hyperparameters changed since the last update. The
+        posterior at the prediction points is updated along with it.
+
+        Parameters
+        ----------
+        x : ndarray
+            A 2d array with the new states to add to the GP model. Each new
+            state is on a new row.
+        y : ndarray
+            A 2d array with the new measurements to add to the GP model.
+            Each measurements is on a new row.
+
+        """
+        x = np.atleast_2d(x).astype(config.np_dtype)
+        y = np.atleast_2d(y).astype(config.np_dtype)
+
+        # Zero-size cholesky matrices are not supported by all backends
+        incremental = self._cache_is_valid() and self.X.shape[0] > 0
+        if incremental and self.max_data is not None:
+            old_cholesky = self.cholesky.value
+
+        if incremental and self._has_prediction_points:
+            cholesky, alpha, mean_weights, mean, var = \
+                self._compute_prediction_cache_update(x, y)
+            self.prediction_mean, self.prediction_var = mean, var
+        elif incremental:
+            cholesky, alpha, mean_weights = self._compute_cache_update(x, y)
+
+        self.X.append(x)
+        self.Y.append(y)
+
+        if incremental:
+            self.cholesky, self.alpha = cholesky, alpha
+            self.mean_weights = mean_weights
+            if self.max_data is not None:
+                self._update_inverse_diag(old_cholesky, cholesky)
+        else:
+            self.update_cache()
+
+        if self.max_data is not None and self.X.shape[0] > self.max_data:
+            self._remove_least_informative()
+
+    def _update_inverse_diag(self, old_cholesky, cholesky):
+        """Update the diagonal of the inverse kernel matrix for new data.
+
+        Parameters
+        ----------
+        old_cholesky : ndarray
+            The cholesky decomposition before adding data.
+        cholesky : ndarray
+            The cholesky decomposition after adding data.
+
+        """
+        num_data = len(old_cholesky)
+        cross = cholesky[num_data:, :num_data].T
+        cholesky_new = cholesky[num_data:, num_data:]
+
+        # Block matrix inversion, A^-1 + A^-1 B S^-1 B^T A^-1 and S^-1
+        weights = linalg.solve_triangular(old_cholesky, cross, lower=True,
+                                          trans='T')
+        weights = linalg.solve_triangular(cholesky_new, weights.T,
+                                          lower=True)
+        inverse = linalg.solve_triangular(cholesky_new,
+                                          np.eye(len(cholesky_new)),
+                                          lower=True)
+
+        self._inverse_diag = np.concatenate(
+            (self._inverse_diag + np.sum(weights ** 2, axis=0),
+             np.sum(inverse ** 2, axis=0)))
+
+    def _remove_least_informative(self):
+        """Remove data points until there are at most `max_data` left.
+
+        The leave-one-out variance of data point i is 1 / [K^-1]_ii, so we
+        remove the data points with the largest diagonal of K^-1. The cache
+        is updated with cholesky downdates, which costs O(n^2) per removed
+        data point (plus O(n N) for N prediction points).
+        """
+        cholesky = self.cholesky.value
+        alpha = self.alpha.value
+        if self._has_prediction_points:
+            mean = self.prediction_mean.value
+            var = self.prediction_var.value
+
+        while len(cholesky) > self.max_data:
+            index = np.argmax(self._inverse_diag)
+
+            # Column of the inverse kernel matrix, K^-1 e_i
+            unit = np.zeros(len(cholesky))
+            unit[index] = 1
+            unit = linalg.solve_triangular(cholesky, unit, lower=True)
+            column = linalg.solve_triangular(cholesky, unit, lower=True,
+                                             trans='T')
+
+            # Remove the data point from the prediction cache
+            if self._has_prediction_points:
+                kernel = self._compute_prediction_kernel(column[:, None])
+                mean_weight = unit.dot(alpha)
+                mean -= kernel * mean_weight / column[index]
+                var += kernel ** 2 / column[index]
+
+            self._inverse_diag -= column ** 2 / column[index]
+            self._inverse_diag = np.delete(self._inverse_diag, index)
+
+            # Cholesky downdate, L33' L33'^T = L33 L33^T + l32 l32^T
+            if index < len(cholesky) - 1:
+                l32 = cholesky[index + 1:, index]
+                l33 = cholesky[index + 1:, index + 1:]
+                new_l33 = _cholesky_rank_one_update(l33, l32)
+
+                target = l33.dot(alpha[index + 1:])
+                target += np.outer(l32, alpha[index])
+                alpha[index + 1:] = linalg.solve_triangular(new_l33, target,
+                                                            lower=True)
+                cholesky[index + 1:, index + 1:] = new_l33
+
+            cholesky = np.delete(np.delete(cholesky, index, axis=0),
+                                 index, axis=1)
+            alpha = np.delete(alpha, index, axis=0)
+            self.X.remove(index)
+            self.Y.remove(index)
+
+        self.cholesky = cholesky
+        self.alpha = alpha
+        self.mean_weights = linalg.solve_triangular(cholesky, alpha,
+                                                    lower=True, trans='T')
+        if self._has_prediction_points:
+            self.prediction_mean, self.prediction_var = mean, var
+
+    @with_scope('build_predict')
+    def build_predict(self, Xnew, full_cov=False):
+        """Predict mean and variance of the GP at locations in Xnew.
+
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+        full_cov : bool
+            if False returns only the diagonal of the covariance matrix
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+        error_bounds : ndarray
+            Diagonal of the covariance matrix (or full matrix).
+
+        """
+        # Scaled kernel and mean
+        Kx = (self._scale ** 2) * self.kern.K(self.X, Xnew)
+        mx = self._scale * self.mean_function(Xnew)
+
+        a = tf.matrix_triangular_solve(self.cholesky, Kx, lower=True)
+        fmean = (tf.matmul(a, self.alpha, transpose_a=True) + mx)
+
+        if full_cov:
+            Knew = (self._scale ** 2) * self.kern.K(Xnew)
+            fvar = Knew - tf.matmul(a, a, transpose_a=True)
+            shape = tf.stack([1, 1, tf.shape(self.Y)[1]])
+            fvar = tf.tile(tf.expand_dims(fvar, 2), shape)
+        else:
+            Knew = (self._scale ** 2) * self.kern.Kdiag(Xnew)
+            fvar = Knew - tf.reduce_sum(tf.square(a), 0)
+            fvar = tf.tile(tf.reshape(fvar, (-1, 1)), [1, tf.shape(self.Y)[1]])
+
+        # Apply inverse-scaling to mean and variance before returning
+        fmean /= self._scale
+        fvar /= (self._scale ** 2)
+
+        return fmean, fvar
+
+    @with_scope('build_predict_mean')
+    def build_predict_mean(self, Xnew):
+        """Predict the mean of the GP at locations in Xnew.
+
+        This only requires the kernel between the data and Xnew and costs
+        O(n) per point for n data points.
+
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+
+        """
+        Kx = self.kern.K(Xnew, self.X)
+        fmean = self._scale * tf.matmul(Kx, self.mean_weights)
+        return fmean + self.mean_function(Xnew)
+
+
+class SGPRCached(gpflow.sgpr.SGPR):
+    """Sparse gpflow.sgpr.SGPR class that caches the predictive quantities.
+
+    This is an inducing point approximation with the same interface as
+    `GPRCached`. It stores the cholesky decompositions of the m x m inducing
+    point matrices, so that predictions cost O(m^2) per point and adding
+    data does not depend on the number of data points.
+
+    Parameters
+    ----------
+    x : ndarray
+        A 2d array with states to initialize the GP model. Each state is on
+        a row.
+    y : ndarray
+        A 2d array with measurements to initialize the GP model. Each
+        measurement is on a row.
+    z : ndarray
+        A 2d array with the inducing points. Each inducing point is on a
+        row.
+
+    """
+
+    def __init__(self, x, y, kern, z,
+                 mean_function=gpflow.mean_functions.Zero()):
+        """Initialize GP and cholesky decompositions."""
+        # Make sure gpflow is imported
+        if not isinstance(gpflow, ModuleType):
+            raise gpflow
+
+        gpflow.sgpr.SGPR.__init__(self, x, y, kern, z, mean_function)
+
+        # Data buffers that grow without copying the data on each update
+        self.X = _GrowableDataHolder(self.X.value)
+        self.Y = _GrowableDataHolder(self.Y.value)
+
+        # Create new dataholders for the cached data
+        dtype = config.np_dtype
+        self.cholesky_inducing = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+        self.cholesky = gpflow.param.DataHolder(np.empty((0, 0), dtype=dtype),
+                                                on_shape_change='pass')
+        self.target = gpflow.param.DataHolder(np.empty((0, 0), dtype=dtype),
+                                              on_shape_change='pass')
+        self.alpha = gpflow.param.DataHolder(np.empty((0, 0), dtype=dtype),
+                                             on_shape_change='pass')
+        self.mean_weights = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+        self._cache_state = None
+        self.update_cache()
+
+    def _build_projection(self, cholesky_inducing, x, y):
+        """Project data onto the inducing points.
+
+        Parameters
+        ----------
+        cholesky_inducing : Tensor
+            The cholesky decomposition of the kernel matrix of the inducing
+            points.
+        x : Tensor
+            The states, one on each row.
+        y : Tensor
+            The measurements, one on each row.
+
+        Returns
+        -------
+        projection : Tensor
+            The data projected onto the whitened inducing points and scaled
+            by the noise.
+        target : Tensor
+            The corresponding projection of the measurements.
+
+        """
+        noise_std = tf.sqrt(self.likelihood.variance)
+        kernel = self.kern.K(self.Z, x)
+        projection = tf.matrix_triangular_solve(cholesky_inducing, kernel,
+                                                lower=True)
+        projection /= noise_std
+        target = tf.matmul(projection, y - self.mean_function(x)) / noise_std
+        return projection, target
+
+    @staticmethod
+    def _build_mean_weights(cholesky_inducing, cholesky, alpha):
+        """Return the weights of the kernel for the mean prediction."""
+        weights = tf.matrix_triangular_solve(cholesky, alpha, adjoint=True)
+        return tf.matrix_triangular_solve(cholesky_inducing, weights,
+                                          adjoint=True,
+                                          name='gp_mean_weights')
+
+    @with_scope('compute_cache')
+    @gpflow.param.AutoFlow()
+    def _compute_cache(self):
+        """Compute cache."""
+        num_inducing = tf.shape(self.Z)[0]
+        identity = tf.eye(num_inducing, dtype=config.dtype)
+
+        jitter = gpflow.settings.numerics.jitter_level
+        kernel = self.kern.K(self.Z) + jitter * identity
+        cholesky_inducing = tf.cholesky(kernel, name='gp_cholesky_inducing')
+
+        projection, target = self._build_projection(cholesky_inducing,
+                                                    self.X, self.Y)
+
+        inner = identity + tf.matmul(projection, projection, transpose_b=True)
+        cholesky = tf.cholesky(inner, name='gp_cholesky')
+        alpha = tf.matrix_triangular_solve(cholesky, target, name='gp_alpha')
+
+        mean_weights = self._build_mean_weights(cholesky_inducing, cholesky,
+                                                alpha)
+        return cholesky_inducing, cholesky, target, alpha, mean_weights
+
+    @with_scope('compute_cache_update')
+    @gpflow.param.AutoFlow((config.dtype, [None, None]),
+                           (config.dtype, [None, None]))
+    def _compute_cache_update(self, x, y):
+        """Add the contribution of new data points to the cache."""
+        projection, target = self._build_projection(self.cholesky_inducing,
+                                                    x, y)
+
+        inner = (tf.matmul(self.cholesky, self.cholesky, transpose_b=True)
+                 + tf.matmul(projection, projection, transpose_b=True))
+        cholesky = tf.cholesky(inner, name='gp_cholesky_update')
+
+        target += self.target
+        alpha = tf.matrix_triangular_solve(cholesky, target,
+                                           name='gp_alpha_update')
+
+        mean_weights = self._build_mean_weights(self.cholesky_inducing,
+                                                cholesky, alpha)
+        return cholesky, target, alpha, mean_weights
+
+    def update_cache(self):
+        """Update the cache after adding data points."""
+        (self.cholesky_inducing, self.cholesky, self.target,
+         self.alpha, self.mean_weights) = self._compute_cache()
+        self._cache_state = self.get_free_state().copy()
+
+    def add_data_point(self, x, y):
+        """Add data points to the GP model and update the cache.
+
+        Adding k data points costs O(k m^2 + m^3) for m inducing points. The
+        cache is only recomputed from scratch if the hyperparameters or
+        inducing points changed since the last update.
+
+        Parameters
+        ----------
+        x : ndarray
+            A 2d array with the new states to add to the GP model. Each new
+            state is on a new row.
+        y : ndarray
+            A 2d array with the new measurements to add to the GP model.
+            Each measurements is on a new row.
+
+        """
+        x = np.atleast_2d(x).astype(config.np_dtype)
+        y = np.atleast_2d(y).astype(config.np_dtype)
+
+        incremental = (self._cache_state is not None
+                       and np.array_equal(self._cache_state,
+                                          self.get_free_state()))
+        if incremental:
+            (self.cholesky, self.target,
+             self.alpha, self.mean_weights) = self._compute_cache_update(x, y)
+
+        self.X.append(x)
+        self.Y.append(y)
+
+        if not incremental:
+            self.update_cache()
+
+    @with_scope('build_predict')
+    def build_predict(self, Xnew, full_cov=False):
+        """Predict mean and variance of the GP at locations in Xnew.
+
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+        full_cov : bool
+            if False returns only the diagonal of the covariance matrix
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+        error_bounds : ndarray
+            Diagonal of the covariance matrix (or full matrix).
+
+        """
+        kernel = self.kern.K(self.Z, Xnew)
+        a = tf.matrix_triangular_solve(self.cholesky_inducing, kernel,
+                                       lower=True)
+        b = tf.matrix_triangular_solve(self.cholesky, a, lower=True)
+
+        fmean = (tf.matmul(b, self.alpha, transpose_a=True)
+                 + self.mean_function(Xnew))
+
+        if full_cov:
+            fvar = (self.kern.K(Xnew)
+                    - tf.matmul(a, a, transpose_a=True)
+                    + tf.matmul(b, b, transpose_a=True))
+            shape = tf.stack([1, 1, tf.shape(self.Y)[1]])
+            fvar = tf.tile(tf.expand_dims(fvar, 2), shape)
+        else:
+            fvar = (self.kern.Kdiag(Xnew)
+                    - tf.reduce_sum(tf.square(a), 0)
+                    + tf.reduce_sum(tf.square(b), 0))
+            fvar = tf.tile(tf.reshape(fvar, (-1, 1)), [1, tf.shape(self.Y)[1]])
+
+        return fmean, fvar
+
+    @with_scope('build_predict_mean')
+    def build_predict_mean(self, Xnew):
+        """Predict the mean of the GP at locations in Xnew.
+
+        This costs O(m) per point for m inducing points.
+
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+
+        """
+        fmean = tf.matmul(self.kern.K(Xnew, self.Z), self.mean_weights)
+        return fmean + self.mean_function(Xnew)
+
+
+class Wendland(gpflow.kernels.Stationary):
+    """A compactly supported Wendland kernel.
+
+    The kernel is k(r) = variance * (1 - r)^(q + 1) * ((q + 1) r + 1) for
+    scaled distances r < 1 and zero otherwise, where q = floor(d / 2) + 2
+    ensures positive definiteness for inputs of dimension d. Kernel matrices
+    are sparse, see `SparseGPRCached`.
+
+    Parameters
+    ----------
+    input_dim : int
+        The input dimension.
+    variance : float, optional
+        The variance of the kernel.
+    lengthscales : float or ndarray, optional
+        The support radius along each dimension.
+    active_dims : list, optional
+        The input dimensions that the kernel acts on.
+    ARD : bool, optional
+        Whether to use one lengthscale per dimension.
+
+    """
+
+    def __init__(self, input_dim, variance=1.0, lengthscales=None,
+                 active_dims=None, ARD=False):
+        """Initialization, see `Wendland`."""
+        super(Wendland, self).__init__(input_dim, variance=variance,
+                                       lengthscales=lengthscales,
+                                       active_dims=active_dims, ARD=ARD)
+        self.exponent = input_dim // 2 + 3
+
+    def K(self, X, X2=None, presliced=False):
+        """Compute the kernel matrix."""
+        if not presliced:
+            X, X2 = self._slice(X, X2)
+        r = self.euclid_dist(X, X2)
+        return (self.variance * tf.nn.relu(1. - r) ** self.exponent
+                * (self.exponent * r + 1.))
+
+
+class SparseGPRCached(gpflow.gpr.GPR):
+    """GP with a compactly supported kernel and a sparse factorization.
+
+    The kernel matrix of a `Wendland` kernel is sparse. It is built with
+    neighbor queries on a KD-tree and factorized with a sparse LU
+    decomposition, so that memory scales with the number of neighboring
+    data points rather than quadratically. Predictions only touch data
+    within the support of the kernel.
+
+    New data is added with a block update: the sparse factorization of the
+    previous data is kept and the new points enter through a dense Schur
+    complement. Once more than `refactor_size` points were added this way,
+    the sparse matrix is factorized again.
+
+    Parameters
+    ----------
+    x : ndarray
+        A 2d array with states to initialize the GP model. Each state is on
+        a row.
+    y : ndarray
+        A 2d array with measurements to initialize the GP model. Each
+        measurement is on a row.
+    kern : instance of `Wendland`
+        The compactly supported kernel.
+    refactor_size : int, optional
+        The maximum number of data points that are added with the Schur
+        complement before the sparse matrix is factorized again.
+
+    Notes
+    -----
+    The hyperparameters are those of a regular gpflow.gpr.GPR, but
+    predictions are computed in numpy and do not provide gradients with
+    respect to the hyperparameters. Call `update_cache` after changing them.
+
+    """
+
+    def __init__(self, x, y, kern, mean_function=gpflow.mean_functions.Zero(),
+                 refactor_size=100, name='SparseGPRCached'):
+        """Initialize GP and the sparse factorization."""
+        # Make sure gpflow is imported
+        if not isinstance(gpflow, ModuleType):
+            raise gpflow
+
+        if not isinstance(kern, Wendland):
+            raise ValueError('SparseGPRCached requires a compactly supported '
+                             'kernel, see `Wendland`.')
+
+        gpflow.gpr.GPR.__init__(self, x, y, kern, mean_function, name)
+
+        # Data buffers that grow without copying the data on each update
+        self.X = _GrowableDataHolder(self.X.value)
+        self.Y = _GrowableDataHolder(self.Y.value)
+
+        self.refactor_size = int(refactor_size)
+
+        self._tree = None
+        self._factor = None
+        self._num_factorized = 0
+        self._cross = None
+        self._schur = None
+        self._alpha = None
+        self.update_cache()
+
+    @with_scope('compute_residual')
+    @gpflow.param.AutoFlow()
+    def _compute_residual(self):
+        """Return the data minus the mean function."""
+        return self.Y - self.mean_function(self.X)
+
+    def _scale_points(self, points):
+        """Scale the active dimensions of the points by the lengthscales."""
+        active_dims = np.arange(self.X.shape[1])[self.kern.active_dims]
+        return points[:, active_dims] / self.kern.lengthscales.value
+
+    def _sparse_kernel(self, points):
+        """Return the sparse kernel matrix between points and the data.
+
+        Parameters
+        ----------
+        points : ndarray
+            A 2d array of points, one on each row.
+
+        Returns
+        -------
+        kernel : scipy.sparse.csr_matrix
+            The kernel matrix.
+
+        """
+        points = self._scale_points(np.atleast_2d(points))
+        data = self._tree.data
+
+        neighbors = self._tree.query_ball_point(points, 1.)
+        lengths = [len(neighbor) for neighbor in neighbors]
+        rows = np.repeat(np.arange(len(points)), lengths)
+        cols = np.fromiter(chain.from_iterable(neighbors),
+                           dtype=np.int64, count=sum(lengths))
+
+        distances = np.linalg.norm(points[rows] - data[cols], axis=1)
+        values = self._kernel_values(distances)
+
+        return sparse.csr_matrix((values, (rows, cols)),
+                                 shape=(len(points), len(data)))
+
+    def _kernel_values(self, distances):
+        """Evaluate the kernel for distances scaled by the lengthscales."""
+        exponent = self.kern.exponent
+        distances = np.minimum(distances, 1.)
+        return (self.kern.variance.value
+                * (1. - distances) ** exponent
+                * (exponent * distances + 1.))
+
+    def _solve(self, rhs):
+        """Solve (K + s^2 I) x = rhs with the block factorization.
+
+        With the sparse factorization of the first block A, the cross terms
+        B and the Schur complement S = C - B^T A^-1 B, the lower part of the
+        solution is S^-1 (rhs_2 - B^T A^-1 rhs_1) and the upper part is
+        A^-1 rhs_1 minus A^-1 B times the lower part.
+        """
+        num = self._num_factorized
+        upper = self._factor.solve(rhs[:num])
+        if self._schur is None:
+            return upper
+
+        lower = linalg.cho_solve(self._schur,
+                                 rhs[num:] - self._cross.T.dot(rhs[:num]))
+        return np.vstack((upper - self._cross.dot(lower), lower))
+
+    def update_cache(self):
+        """Factorize the sparse kernel matrix of all data points."""
+        data = self.X.value
+        self._tree = spatial.cKDTree(self._scale_points(data))
+        self._num_factorized = len(data)
+        self._cross = None
+        self._schur = None
+
+        residual = self._compute_residual()
+        if len(data) == 0:
+            self._factor = None
+            self._alpha = residual
+            return
+
+        kernel = self._sparse_kernel(data)
+        kernel += self.likelihood.variance.value * sparse.identity(len(data))
+        self._factor = splu(kernel.tocsc(), permc_spec='MMD_AT_PLUS_A')
+        self._alpha = self._solve(residual)
+
+    def add_data_point(self, x, y):
+        """Add data points to the GP model with a block update.
+
+        The sparse factorization is reused and only the cross terms of the
+        new points are solved for. If more than `refactor_size` points were
+        added since the last factorization, all data is factorized again.
+
+        Parameters
+        ----------
+        x : ndarray
+            A 2d array with the new states to add to the GP model. Each new
+            state is on a new row.
+        y : ndarray
+            A 2d array with the new measurements to add to the GP model.
+            Each measurements is on a new row.
+
+        """
+        num_data = len(self.X.value)
+        self.X.append(np.atleast_2d(x).astype(config.np_dtype))
+        self.Y.append(np.atleast_2d(y).astype(config.np_dtype))
+
+        num = self._num_factorized
+        data = self.X.value
+        if self._factor is None or len(data) - num > self.refactor_size:
+            self.update_cache()
+            return
+
+        self._tree = spatial.cKDTree(self._scale_points(data))
+
+        # A^-1 B for the new columns of the cross terms
+        kernel_new = self._sparse_kernel(data[num_data:])
+        cross = self._factor.solve(kernel_new[:, :num].T.toarray())
+        if self._cross is None:
+            self._cross = cross
+        else:
+            self._cross = np.hstack((self._cross, cross))
+
+        # Schur complement of all points that are not factorized
+        kernel = self._sparse_kernel(data[num:])
+        schur = kernel[:, num:].toarray() - kernel[:, :num].dot(self._cross)
+        schur[np.diag_indices_from(schur)] += self.likelihood.variance.value
+        self._schur = linalg.cho_factor(schur, lower=True)
+
+        self._alpha = self._solve(self._compute_residual())
+
+    @make_tf_fun([config.dtype, config.dtype])
+    def _predict(self, points):
+        """Predict the (zero-mean) posterior at the points."""
+        kernel = self._sparse_kernel(points)
+        mean = kernel.dot(self._alpha)
+
+        var = np.full(len(points), self.kern.variance.value,
+                      dtype=config.np_dtype)
+        if self._factor is None:
+            return mean.astype(config.np_dtype), var
+
+        # Only points with data in their support reduce the variance
+        support = np.flatnonzero(np.diff(kernel.indptr))
+
+        # Solve for dense columns in chunks that respect the memory limit
+        if config.gp_memory_limit is None:
+            chunk_size = max(len(support), 1)
+        else:
+            itemsize = np.dtype(config.np_dtype).itemsize
+            chunk_size = config.gp_memory_limit // (2 * itemsize
+                                                    * kernel.shape[1])
+            chunk_size = max(chunk_size, 1)
+
+        for start in range(0, len(support), chunk_size):
+            rows = support[start:start + chunk_size]
+            kernel_rows = kernel[rows]
+            solved = self._solve(kernel_rows.T.toarray())
+            var[rows] -= np.asarray(
+                kernel_rows.multiply(solved.T).sum(axis=1)).ravel()
+
+        return mean.astype(config.np_dtype), var
+
+    @make_tf_fun([config.dtype, config.dtype])
+    def _predict_full_cov(self, points):
+        """Predict the (zero-mean) posterior with the full covariance."""
+        kernel = self._sparse_kernel(points)
+        mean = kernel.dot(self._alpha)
+
+        scaled_points = self._scale_points(np.atleast_2d(points))
+        cov = self._kernel_values(spatial.distance.cdist(scaled_points,
+                                                         scaled_points))
+        if self._factor is not None:
+            solved = self._solve(kernel.T.toarray())
+            cov -= kernel.dot(solved)
+
+        return mean.astype(config.np_dtype), cov.astype(config.np_dtype)
+
+    @with_scope('build_predict')
+    def build_predict(self, Xnew, full_cov=False):
+        """Predict mean and variance of the GP at locations in Xnew.
+
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+        full_cov : bool
+            Whether to return the full covariance matrix. This requires a
+            dense solve for all points.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+        error_bounds : ndarray
+            Diagonal of the covariance matrix (or full matrix).
+
+        """
+        if full_cov:
+            mean, cov = self._predict_full_cov(Xnew)
+            mean.set_shape([None, self.Y.shape[1]])
+            cov.set_shape([None, None])
+
+            fmean = mean + self.mean_function(Xnew)
+            shape = tf.stack([1, 1, tf.shape(self.Y)[1]])
+            fvar = tf.tile(tf.expand_dims(cov, 2), shape)
+            return fmean, fvar
+
+        mean, var = self._predict(Xnew)
+        mean.set_shape([None, self.Y.shape[1]])
+        var.set_shape([None])
+
+        fmean = mean + self.mean_function(Xnew)
+        fvar = tf.tile(tf.reshape(var, (-1, 1)), [1, tf.shape(self.Y)[1]])
+        return fmean, fvar
+
+
+class GPRConjugateGradient(gpflow.gpr.GPR):
+    """GP regression with matrix-free iterative linear algebra.
+
+    The kernel matrix is never stored. Instead, it is only accessed through
+    matrix-vector products that are computed in tiles of `tile_size` rows.
+    The weights of the posterior mean are computed with preconditioned
+    conjugate gradients, where the preconditioner is a low-rank pivoted
+    Cholesky decomposition of the kernel matrix. The posterior variance at
+    each test point x is computed with `lanczos_steps` iterations of the
+    same solver for the right hand side k(X, x), which is equivalent to a
+    Lanczos quadrature seeded with k(X, x). The quadratic form
+    k(x, X) (K + noise I)^-1 k(X, x) is approximated from below, so that the
+    variance is never underestimated. It becomes exact once the number of
+    steps reaches the number of data points, and the predictions are
+    deterministic. Memory scales linearly with the number of data points.
+
+    Parameters
+    ----------
+    x : ndarray
+        A 2d array with states to initialize the GP model. Each state is on
+        a row.
+    y : ndarray
+        A 2d array with measurements to initialize the GP model. Each
+        measurement is on a row.
+    kern : instance of gpflow.kernels.Kern
+        The kernel of the GP.
+    tile_size : int, optional
+        The number of kernel rows that are computed at once.
+    preconditioner_rank : int, optional
+        The rank of the pivoted Cholesky preconditioner.
+    lanczos_steps : int, optional
+        The maximum number of iterations used for the variance at each
+        test point.
+    tolerance : float, optional
+        The relative residual at which conjugate gradients terminates.
+    max_iterations : int, optional
+        The maximum number of conjugate gradient iterations. Defaults to the
+        number of data points.
+
+    Notes
+    -----
+    The hyperparameters are those of a regular gpflow.gpr.GPR, but
+    predictions are computed in numpy and do not provide gradients with
+    respect to the hyperparameters. Call `update_cache` after changing them.
+
+    """
+
+    def __init__(self, x, y, kern, mean_function=gpflow.mean_functions.Zero(),
+                 tile_size=1024, preconditioner_rank=50, lanczos_steps=100,
+                 tolerance=1e-8, max_iterations=None,
+                 name='GPRConjugateGradient'):
+        """Initialize GP and the iterative solution."""
+        # Make sure gpflow is imported
+        if not isinstance(gpflow, ModuleType):
+            raise gpflow
+
+        gpflow.gpr.GPR.__init__(self, x, y, kern, mean_function, name)
+
+        # Data buffers that grow without copying the data on each update
+        self.X = _GrowableDataHolder(self.X.value)
+        self.Y = _GrowableDataHolder(self.Y.value)
+
+        self.tile_size = int(tile_size)
+        self.preconditioner_rank = int(preconditioner_rank)
+        self.lanczos_steps = int(lanczos_steps)
+        self.tolerance = float(tolerance)
+        self.max_iterations = max_iterations
+
+        self._data = None
+        self._preconditioner = None
+        self._alpha = None
+        self.update_cache()
+
+    @with_scope('compute_residual')
+    @gpflow.param.AutoFlow()
+    def _compute_residual(self):
+        """Return the data minus the mean function."""
+        return self.Y - self.mean_function(self.X)
+
+    def _kernel_product(self, points, vectors):
+        """Compute K(points, X) vectors in tiles of rows.
+
+        Parameters
+        ----------
+        points : ndarray
+            A 2d array of points, one on each row.
+        vectors : ndarray
+            A 2d array with one row for each data point.
+
+        Returns
+        -------
+        product : ndarray
+            The matrix product, with one row for each point.
+
+        """
+        product = np.zeros((len(points), vectors.shape[1]),
+                           dtype=config.np_dtype)
+        if len(self._data) == 0:
+            return product
+
+        for start in range(0, len(points), self.tile_size):
+            tile = slice(start, start + self.tile_size)
+            kernel = self.kern.compute_K(points[tile], self._data)
+            product[tile] = kernel.dot(vectors)
+        return product
+
+    def _matrix_product(self, vectors):
+        """Multiply the vectors with the kernel matrix plus noise."""
+        noise = self.likelihood.variance.value
+        return self._kernel_product(self._data, vectors) + noise * vectors
+
+    def _compute_preconditioner(self):
+        """Compute a pivoted Cholesky decomposition of the kernel matrix.
+
+        Returns
+        -------
+        factor : ndarray
+            A 2d array such that factor.dot(factor.T) approximates the
+            kernel matrix, with one column for each pivot.
+
+        """
+        data = self._data
+        rank = min(self.preconditioner_rank, len(data))
+
+        diagonal = self.kern.compute_Kdiag(data).copy()
+        factor = np.zeros((rank, len(data)), dtype=config.np_dtype)
+
+        for i in range(rank):
+            pivot = np.argmax(diagonal)
+            if diagonal[pivot] <= _EPS * self.likelihood.variance.value:
+                factor = factor[:i]
+                break
+
+            row = self.kern.compute_K(data[[pivot]], data)[0]
+            row -= factor[:i, pivot].dot(factor[:i])
+            factor[i] = row / np.sqrt(diagonal[pivot])
+            diagonal -= factor[i] ** 2
+
+        return factor.T
+
+    def _apply_preconditioner(self, vectors):
+        """Solve with the low-rank plus noise preconditioner (Woodbury)."""
+        factor, cholesky = self._preconditioner
+        noise = self.likelihood.variance.value
+
+        projection = linalg.cho_solve((cholesky, True),
+                                      factor.T.dot(vectors))
+        return (vectors - factor.dot(projection)) / noise
+
+    def _solve(self, rhs, initial=None, max_iterations=None):
+        """Solve linear systems with preconditioned conjugate gradients.
+
+        Parameters
+        ----------
+        rhs : ndarray
+            A 2d array with one right hand side in each column.
+        initial : ndarray, optional
+            An initial guess for the solution.
+        max_iterations : int, optional
+            The maximum number of iterations. Defaults to `max_iterations`
+            of the model.
+
+        Returns
+        -------
+        solution : ndarray
+            The solutions, one in each column.
+
+        """
+        if initial is None:
+            solution = np.zeros_like(rhs)
+            residual = rhs.copy()
+        else:
+            solution = initial.copy()
+            residual = rhs - self._matrix_product(solution)
+
+        if max_iterations is None:
+            max_iterations = self.max_iterations
+        if max_iterations is None:
+            max_iterations = len(rhs)
+
+        threshold = self.tolerance * np.linalg.norm(rhs, axis=0)
+        tiny = np.finfo(config.np_dtype).tiny
+
+        preconditioned = self._apply_preconditioner(residual)
+        direction = preconditioned
+        inner = np.sum(residual * preconditioned, axis=0)
+
+        for _ in range(max_iterations):
+            if np.all(np.linalg.norm(residual, axis=0) <= threshold):
+                break
+
+            product = self._matrix_product(direction)
+            step = inner / np.maximum(np.sum(direction * product, axis=0),
+                                      tiny)
+            solution += step * direction
+            residual -= step * product
+
+            preconditioned = self._apply_preconditioner(residual)
+            new_inner = np.sum(residual * preconditioned, axis=0)
+            direction = (preconditioned
+                         + new_inner / np.maximum(inner, tiny) * direction)
+            inner = new_inner
+
+        return solution
+
+    def update_cache(self):
+        """Update the iterative solution after changing data."""
+        previous_alpha = self._alpha
+        self._data = self.X.value
+        num_data = len(self._data)
+
+        residual = self._compute_residual()
+        if num_data == 0:
+            self._alpha = residual
+            return
+
+        factor = self._compute_preconditioner()
+        noise = self.likelihood.variance.value
+        inner = noise * np.eye(factor.shape[1]) + factor.T.dot(factor)
+        self._preconditioner = (factor, linalg.cholesky(inner, lower=True))
+
+        # Warm start from the previous solution when data was appended
+        initial = None
+        if (previous_alpha is not None
+                and previous_alpha.shape[1] == residual.shape[1]
+                and len(previous_alpha) <= num_data):
+            initial = np.zeros_like(residual)
+            initial[:len(previous_alpha)] = previous_alpha
+
+        self._alpha = self._solve(residual, initial=initial)
+
+    def add_data_point(self, x, y):
+        """Add data points to the GP model and update the solution.
+
+        Parameters
+        ----------
+        x : ndarray
+            A 2d array with the new states to add to the GP model. Each new
+            state is on a new row.
+        y : ndarray
+            A 2d array with the new measurements to add to the GP model.
+            Each measurements is on a new row.
+
+        """
+        self.X.append(np.atleast_2d(x).astype(config.np_dtype))
+        self.Y.append(np.atleast_2d(y).astype(config.np_dtype))
+        self.update_cache()
+
+    @make_tf_fun([config.dtype, config.dtype])
+    def _predict(self, points):
+        """Predict the (zero-mean) posterior at the points."""
+        var = self.kern.compute_Kdiag(points).astype(config.np_dtype)
+        if len(self._data) == 0:
+            mean = np.zeros((len(points), self._alpha.shape[1]),
+                            dtype=config.np_dtype)
+            return mean, var
+
+        # Each solve is seeded with the kernel column of its test point
+        kernel = self.kern.compute_K(self._data, points)
+        solved = self._solve(kernel, max_iterations=self.lanczos_steps)
+
+        mean = kernel.T.dot(self._alpha)
+        var -= np.sum(kernel * solved, axis=0)
+        return mean, var
+
+    @make_tf_fun([config.dtype, config.dtype])
+    def _predict_full_cov(self, points):
+        """Predict the (zero-mean) posterior with the full covariance."""
+        cov = self.kern.compute_K(points, points).astype(config.np_dtype)
+        if len(self._data) == 0:
+            mean = np.zeros((len(points), self._alpha.shape[1]),
+                            dtype=config.np_dtype)
+            return mean, cov
+
+        # Solve to the tolerance, the covariance must be symmetric
+        kernel = self.kern.compute_K(self._data, points)
+        reduction = kernel.T.dot(self._solve(kernel))
+        cov -= 0.5 * (reduction + reduction.T)
+
+        mean = kernel.T.dot(self._alpha)
+        return mean, cov
+
+    @make_tf_fun(config.dtype)
+    def _predict_mean(self, points):
+        """Predict the (zero-mean) posterior mean at the points."""
+        return self._kernel_product(points, self._alpha)
+
+    @with_scope('build_predict')
+    def build_predict(self, Xnew, full_cov=False):
+        """Predict mean and variance of the GP at locations in Xnew.
+
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+        full_cov : bool
+            Whether to return the full covariance matrix. It is solved to
+            the tolerance rather than with `lanczos_steps` iterations.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+        error_bounds : ndarray
+            Diagonal of the covariance matrix (or full matrix).
+
+        """
+        if full_cov:
+            mean, cov = self._predict_full_cov(Xnew)
+            mean.set_shape([None, self.Y.shape[1]])
+            cov.set_shape([None, None])
+
+            fmean = mean + self.mean_function(Xnew)
+            shape = tf.stack([1, 1, tf.shape(self.Y)[1]])
+            fvar = tf.tile(tf.expand_dims(cov, 2), shape)
+            return fmean, fvar
+
+        mean, var = self._predict(Xnew)
+        mean.set_shape([None, self.Y.shape[1]])
+        var.set_shape([None])
+
+        fmean = mean + self.mean_function(Xnew)
+        fvar = tf.tile(tf.reshape(var, (-1, 1)), [1, tf.shape(self.Y)[1]])
+        return fmean, fvar
+
+    @with_scope('build_predict_mean')
+    def build_predict_mean(self, Xnew):
+        """Predict only the mean of the GP at locations in Xnew.
+
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+
+        """
+        mean = self._predict_mean(Xnew)
+        mean.set_shape([None, self.Y.shape[1]])
+        return mean + self.mean_function(Xnew)
+
+
+class GPRRandomFeatures(gpflow.gpr.GPR):
+    """GP regression approximated with random Fourier features.
+
+    The kernel is approximated as K(x, y) = phi(x)^T phi(y) with a fixed set
+    of random features, which turns the GP into Bayesian linear regression
+    on the features. Predicting the mean costs O(D) and the variance O(D^2)
+    per point for D features, independently of the number of data points.
+    Adding data updates the cholesky decomposition of the feature precision
+    matrix with rank-one updates.
+
+    Parameters
+    ----------
+    x : ndarray
+        A 2d array with states to initialize the GP model. Each state is on
+        a row.
+    y : ndarray
+        A 2d array with measurements to initialize the GP model. Each
+        measurement is on a row.
+    kern : instance of gpflow.kernels.Stationary
+        An RBF or Matern kernel.
+    num_features : int, optional
+        The number of random features.
+
+    Notes
+    -----
+    The features are drawn based on the hyperparameters at initialization.
+    Call `update_features` after changing the hyperparameters.
+
+    """
+
+    def __init__(self, x, y, kern, mean_function=gpflow.mean_functions.Zero(),
+                 num_features=500, name='GPRRandomFeatures'):
+        """Initialize GP and the random features."""
+        # Make sure gpflow is imported
+        if not isinstance(gpflow, ModuleType):
+            raise gpflow
+
+        gpflow.gpr.GPR.__init__(self, x, y, kern, mean_function, name)
+
+        # Data buffers that grow without copying the data on each update
+        self.X = _GrowableDataHolder(self.X.value)
+        self.Y = _GrowableDataHolder(self.Y.value)
+
+        self.num_features = int(num_features)
+
+        dtype = config.np_dtype
+        self.frequencies = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+        self.phases = gpflow.param.DataHolder(np.empty(0, dtype=dtype),
+                                              on_shape_change='pass')
+        self.cholesky = gpflow.param.DataHolder(np.empty((0, 0), dtype=dtype),
+                                                on_shape_change='pass')
+        self.mean_weights = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+
+        self._active_dims = None
+        self._feature_scale = None
+        self._target = None
+        self.update_features()
+
+    @with_scope('compute_residual')
+    @gpflow.param.AutoFlow((config.dtype, [None, None]),
+                           (config.dtype, [None, None]))
+    def _compute_residual(self, x, y):
+        """Return the measurements minus the mean function."""
+        return y - self.mean_function(x)
+
+    def _compute_features(self, x):
+        """Compute the random features in numpy."""
+        x = x[:, self._active_dims]
+        return self._feature_scale * np.cos(
+            x.dot(self.frequencies.value.T) + self.phases.value)
+
+    @with_scope('build_features')
+    def _build_features(self, x):
+        """Compute the random features in tensorflow."""
+        x = tf.gather(x, self._active_dims, axis=1)
+        return self._feature_scale * tf.cos(
+            tf.matmul(x, self.frequencies, transpose_b=True) + self.phases)
+
+    def update_features(self):
+        """Draw new random features and recompute the posterior."""
+        active_dims, frequencies, phases, scale = _random_fourier_parameters(
+            self.kern, self.X.shape[1], self.num_features)
+
+        self._active_dims = active_dims
+        self._feature_scale = scale
+        self.frequencies = frequencies.astype(config.np_dtype)
+        self.phases = phases.astype(config.np_dtype)
+        self.update_cache()
+
+    def update_cache(self):
+        """Recompute the posterior over the feature weights from the data."""
+        x = self.X.value
+        features = self._compute_features(x)
+        noise_var = self.likelihood.variance.value
+
+        precision = features.T.dot(features)
+        precision[np.diag_indices_from(precision)] += noise_var
+
+        self._target = features.T.dot(self._compute_residual(x, self.Y.value))
+        self.cholesky = linalg.cholesky(precision, lower=True)
+        self.mean_weights = linalg.cho_solve((self.cholesky.value, True),
+                                             self._target)
+
+    def add_data_point(self, x, y):
+        """Add data points to the GP model with rank-one updates.
+
+        Parameters
+        ----------
+        x : ndarray
+            A 2d array with the new states to add to the GP model. Each new
+            state is on a new row.
+        y : ndarray
+            A 2d array with the new measurements to add to the GP model.
+            Each measurements is on a new row.
+
+        """
+        x = np.atleast_2d(x).astype(config.np_dtype)
+        y = np.atleast_2d(y).astype(config.np_dtype)
+        self.X.append(x)
+        self.Y.append(y)
+
+        features = self._compute_features(x)
+        self._target += features.T.dot(self._compute_residual(x, y))
+
+        cholesky = self.cholesky.value
+        for feature in features:
+            cholesky = _cholesky_rank_one_update(cholesky, feature)
+
+        self.cholesky = cholesky
+        self.mean_weights = linalg.cho_solve((cholesky, True), self._target)
+
+    @with_scope('build_predict')
+    def build_predict(self, Xnew, full_cov=False):
+        """Predict mean and variance of the GP at locations in Xnew.
+
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+        full_cov : bool
+            Whether to return the full covariance function.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+        error_bounds : ndarray
+            Diagonal or full covariance matrix.
+
+        """
+        features = self._build_features(Xnew)
+        mean = (tf.matmul(features, self.mean_weights)
+                + self.mean_function(Xnew))
+
+        # Posterior covariance of the weights is noise_var * precision^-1
+        projection = tf.matrix_triangular_solve(self.cholesky,
+                                                tf.transpose(features))
+        projection *= tf.sqrt(self.likelihood.variance)
+
+        if full_cov:
+            var = tf.matmul(projection, projection, transpose_a=True)
+            var = tf.tile(tf.expand_dims(var, 2), [1, 1, tf.shape(self.Y)[1]])
+        else:
+            var = tf.reduce_sum(tf.square(projection), axis=0)
+            var = tf.tile(tf.reshape(var, (-1, 1)), [1, tf.shape(self.Y)[1]])
+        return mean, var
+
+    @with_scope('build_predict_mean')
+    def build_predict_mean(self, Xnew):
+        """Predict only the mean of the GP at locations in Xnew.
+
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+
+        """
+        features = self._build_features(Xnew)
+        return (tf.matmul(features, self.mean_weights)
+                + self.mean_function(Xnew))
+
+
+class GPRKronecker(gpflow.gpr.GPR):
+    """GP regression with measurements on all vertices of a `GridWorld`.
+
+    For a separable kernel, k(x, y) = prod_i k_i(x_i, y_i), the kernel
+    matrix over the grid is the Kronecker product of the kernel matrices
+    along each dimension, K = Q diag(lambda) Q^T with Q = Q_1 kron ... kron
+    Q_d. Inference only requires the eigendecompositions along each
+    dimension and Kronecker matrix-vector products, which costs
+    O(N sum_i n_i) instead of O(N^3) for N = prod_i n_i grid points.
+    Predictions cost O(N) per point, see also `predict_grid`.
+
+    Parameters
+    ----------
+    discretization : instance of `GridWorld`
+        The grid. The training inputs are `discretization.all_points`.
+    y : ndarray
+        A 2d array with one measurement for each vertex of the grid, in the
+        order of `discretization.all_points`.
+    kern : instance of gpflow.kernels.Kern
+        A separable kernel, e.g., an RBF kernel.
+
+    Notes
+    -----
+    The cached eigendecomposition depends on the hyperparameters. Call
+    `update_cache` after changing them. The data can not be extended with
+    points that are not on the grid, so `add_data_point` is not supported.
+
+    """
+
+    def __init__(self, discretization, y, kern,
+                 mean_function=gpflow.mean_functions.Zero(),
+                 name='GPRKronecker'):
+        """Initialize GP and the eigendecomposition."""
+        # Make sure gpflow is imported
+        if not isinstance(gpflow, ModuleType):
+            raise gpflow
+
+        x = discretization.all_points
+        gpflow.gpr.GPR.__init__(self, x, y, kern, mean_function, name)
+        self.discretization = discretization
+
+        # Kernel evaluations along each dimension with the other
+        # coordinates fixed at the reference point
+        reference = discretization.offset.astype(config.np_dtype)
+        self._reference = reference
+        self._grid_states = []
+        for i, points in enumerate(discretization.discrete_points):
+            states = np.tile(reference, (len(points), 1))
+            states[:, i] = points
+            self._grid_states.append(states)
+
         dtype = config.np_dtype
-        self.cholesky = gpflow.param.DataHolder(np.empty((0, 0), dtype=dtype),
-                                                on_shape_change='pass')
-        self.alpha = gpflow.param.DataHolder(np.empty((0, 0), dtype=dtype),
-                                             on_shape_change='pass')
-        self._scale = scale
+        self.eigenvectors = gpflow.param.DataHolder(
+            np.empty((0, 0, 0), dtype=dtype), on_shape_change='pass')
+        self.inverse_eigenvalues = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+        self.mean_weights = gpflow.param.DataHolder(
+            np.empty((0, 0), dtype=dtype), on_shape_change='pass')
+
+        self._eigen = None
+        self._residual = None
         self.update_cache()
 
-    @with_scope('compute_cache')
-    @gpflow.param.AutoFlow()
-    def _compute_cache(self):
-        """Compute cache."""
-        # Scaled kernel
-        identity = tf.eye(tf.shape(self.X)[0], dtype=config.dtype)
-        kernel = self.kern.K(self.X) + identity * self.likelihood.variance
-        kernel *= (self._scale ** 2)
-
-        # Scaled target
-        target = self._scale * (self.Y - self.mean_function(self.X))
+    @with_scope('compute_residual')
+    @gpflow.param.AutoFlow((config.dtype, [None, None]),
+                           (config.dtype, [None, None]))
+    def _compute_residual(self, x, y):
+        """Return the measurements minus the mean function."""
+        return y - self.mean_function(x)
 
-        # Cholesky decomposition
-        cholesky = tf.cholesky(kernel, name='gp_cholesky')
-        alpha = tf.matrix_triangular_solve(cholesky, target, name='gp_alpha')
+    def update_cache(self):
+        """Recompute the eigendecomposition and the posterior weights."""
+        indices = self.discretization.vertex_indices(self.X.value)
+        if (indices is None or len(indices) != self.discretization.nindex
+                or np.any(indices != np.arange(len(indices)))):
+            raise ValueError('The data of GPRKronecker must consist of the '
+                             'vertices of the discretization.')
+
+        factors = _kronecker_kernel_factors(self, self.discretization)
+        eigenvalues, eigenvectors = zip(*[linalg.eigh(factor)
+                                          for factor in factors])
+        eigenvalues = [np.maximum(values, 0) for values in eigenvalues]
+        self._eigen = (eigenvalues, eigenvectors)
+
+        noise_var = self.likelihood.variance.value
+        combined = reduce(np.multiply.outer, eigenvalues).ravel()
+        inverse = 1. / (combined + noise_var)
+
+        # (K + s^2 I)^-1 r = Q diag(inverse) Q^T r, stored in the eigenbasis
+        self._residual = self._compute_residual(self.X.value, self.Y.value)
+        projected = _kronecker_product_mvp([vec.T for vec in eigenvectors],
+                                           self._residual)
+
+        # Pad the eigenvectors of each dimension into one array
+        size = max(len(vec) for vec in eigenvectors)
+        padded = np.zeros((len(eigenvectors), size, size),
+                          dtype=config.np_dtype)
+        for i, vec in enumerate(eigenvectors):
+            padded[i, :len(vec), :len(vec)] = vec
+
+        self.eigenvectors = padded
+        self.inverse_eigenvalues = inverse[:, None]
+        self.mean_weights = inverse[:, None] * projected
+
+    def predict_grid(self):
+        """Predict the mean and variance at all vertices of the grid.
+
+        This only requires Kronecker matrix-vector products, which costs
+        O(N sum_i n_i) for N grid points with n_i points along dimension i.
 
-        return cholesky, alpha
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at `discretization.all_points`.
+        var : ndarray
+            The corresponding variances.
 
-    def update_cache(self):
-        """Update the cache after adding data points."""
-        self.cholesky, self.alpha = self._compute_cache()
+        """
+        eigenvalues, eigenvectors = self._eigen
+
+        # K Q = Q diag(lambda) along each dimension
+        scaled = [vec * values for vec, values in zip(eigenvectors,
+                                                      eigenvalues)]
+        mean = _kronecker_product_mvp(scaled, self.mean_weights.value)
+        mean += self.Y.value - self._residual
+
+        # diag(K) - diag(K Q diag(inverse) Q^T K)
+        prior_var = reduce(np.multiply.outer,
+                           [np.sum(vec ** 2 * values, axis=1)
+                            for vec, values in zip(eigenvectors,
+                                                   eigenvalues)]).ravel()
+        var = prior_var[:, None] - _kronecker_product_mvp(
+            [vec ** 2 for vec in scaled], self.inverse_eigenvalues.value)
+        var = np.tile(np.maximum(var, 0), (1, self.Y.shape[1]))
+        return mean, var
+
+    @with_scope('build_projection')
+    def _build_projection(self, Xnew):
+        """Return Q^T k(X, x) for each point in Xnew (one on each row)."""
+        num_points = tf.shape(Xnew)[0]
+
+        reference = tf.constant(self._reference[None, :], dtype=config.dtype)
+        scale = self.kern.K(reference)[0, 0]
+
+        projection = tf.ones((num_points, 1), dtype=config.dtype)
+        for i, grid_states in enumerate(self._grid_states):
+            size = len(grid_states)
+
+            # Evaluate the kernel along dimension i only
+            states = tf.concat(
+                [tf.tile(reference[:, :i], [num_points, 1]),
+                 Xnew[:, i:i + 1],
+                 tf.tile(reference[:, i + 1:], [num_points, 1])], axis=1)
+            kernel = self.kern.K(states, grid_states)
+            if i > 0:
+                kernel /= scale
+
+            eigenvectors = self.eigenvectors[i, :size, :size]
+            factor = tf.matmul(kernel, eigenvectors)
+
+            # Kronecker product in the same order as `all_points`
+            projection = tf.reshape(projection[:, :, None]
+                                    * factor[:, None, :],
+                                    (num_points, -1))
+        return projection
 
     @with_scope('build_predict')
     def build_predict(self, Xnew, full_cov=False):
@@ -424,38 +2279,50 @@ class GPRCached(gpflow.gpr.GPR):
             The points at which to evaluate the function. One row for each
             data points.
         full_cov : bool
-            if False returns only the diagonal of the covariance matrix
+            Whether to return the full covariance function.
 
         Returns
         -------
         mean : ndarray
             The expected function values at the points.
         error_bounds : ndarray
-            Diagonal of the covariance matrix (or full matrix).
+            Diagonal or full covariance matrix.
 
         """
-        # Scaled kernel and mean
-        Kx = (self._scale ** 2) * self.kern.K(self.X, Xnew)
-        mx = self._scale * self.mean_function(Xnew)
-
-        a = tf.matrix_triangular_solve(self.cholesky, Kx, lower=True)
-        fmean = (tf.matmul(a, self.alpha, transpose_a=True) + mx)
+        projection = self._build_projection(Xnew)
+        mean = (tf.matmul(projection, self.mean_weights)
+                + self.mean_function(Xnew))
 
+        scaled = projection * tf.transpose(self.inverse_eigenvalues)
         if full_cov:
-            Knew = (self._scale ** 2) * self.kern.K(Xnew)
-            fvar = Knew - tf.matmul(a, a, transpose_a=True)
-            shape = tf.stack([1, 1, tf.shape(self.Y)[1]])
-            fvar = tf.tile(tf.expand_dims(fvar, 2), shape)
+            var = self.kern.K(Xnew) - tf.matmul(scaled, projection,
+                                                transpose_b=True)
+            var = tf.tile(tf.expand_dims(var, 2), [1, 1, tf.shape(self.Y)[1]])
         else:
-            Knew = (self._scale ** 2) * self.kern.Kdiag(Xnew)
-            fvar = Knew - tf.reduce_sum(tf.square(a), 0)
-            fvar = tf.tile(tf.reshape(fvar, (-1, 1)), [1, tf.shape(self.Y)[1]])
+            var = (self.kern.Kdiag(Xnew)
+                   - tf.reduce_sum(scaled * projection, axis=1))
+            var = tf.tile(tf.reshape(var, (-1, 1)), [1, tf.shape(self.Y)[1]])
+        return mean, var
 
-        # Apply inverse-scaling to mean and variance before returning
-        fmean /= self._scale
-        fvar /= (self._scale ** 2)
+    @with_scope('build_predict_mean')
+    def build_predict_mean(self, Xnew):
+        """Predict only the mean of the GP at locations in Xnew.
 
-        return fmean, fvar
+        Parameters
+        ----------
+        Xnew : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+
+        """
+        projection = self._build_projection(Xnew)
+        return (tf.matmul(projection, self.mean_weights)
+                + self.mean_function(Xnew))
 
 
 class GaussianProcess(UncertainFunction):
@@ -504,12 +2371,107 @@ class GaussianProcess(UncertainFunction):
         """Observed output. One observation per row."""
         return self.gaussian_process.Y.value
 
+    def _build_chunked_predict(self, points, mean_only=False):
+        """Predict in chunks that respect `config.gp_memory_limit`.
+
+        The prediction for each point requires vectors of the size of the
+        data set, so the number of points that are evaluated at once is
+        chosen based on the current number of data points. If all points fit
+        into the memory budget, they are predicted at once without a loop.
+
+        Parameters
+        ----------
+        points : ndarray or Tensor
+            The points at which to evaluate the function. One row for each
+            data points.
+        mean_only : bool, optional
+            Whether to only predict the mean, see `build_predict_mean`.
+
+        Returns
+        -------
+        mean : Tensor
+            The expected function values at the points.
+        var : Tensor
+            The variance at the points. Only returned if mean_only is False.
+
+        """
+        gp = self.gaussian_process
+        points = tf.convert_to_tensor(points, dtype=config.dtype)
+
+        # Kernel matrix, triangular solve, and temporary copies
+        itemsize = np.dtype(config.np_dtype).itemsize
+        max_elements = config.gp_memory_limit // (3 * itemsize)
+        max_elements = min(max_elements, np.iinfo(np.int32).max)
+
+        num_data = tf.maximum(tf.shape(gp.X)[0], 1)
+        chunk_size = tf.maximum(max_elements // num_data, 1)
+
+        num_points = tf.shape(points)[0]
+        num_chunks = tf.maximum((num_points + chunk_size - 1) // chunk_size,
+                                1)
+
+        if mean_only:
+            def predict(chunk):
+                return (gp.build_predict_mean(chunk),)
+        else:
+            def predict(chunk):
+                return tuple(gp.build_predict(chunk))
+
+        def body(i, *arrays):
+            start = i * chunk_size
+            outputs = predict(points[start:start + chunk_size])
+            arrays = [array.write(i, output)
+                      for array, output in zip(arrays, outputs)]
+            return [i + 1] + arrays
+
+        def predict_chunks():
+            arrays = [tf.TensorArray(config.dtype, size=num_chunks,
+                                     infer_shape=False)
+                      for _ in range(1 if mean_only else 2)]
+
+            arrays = tf.while_loop(lambda i, *_: i < num_chunks, body,
+                                   loop_vars=[tf.constant(0)] + arrays)[1:]
+            return tuple(array.concat() for array in arrays)
+
+        # Only loop over chunks if the points do not fit into memory at once
+        outputs = tf.cond(num_chunks > 1, predict_chunks,
+                          lambda: predict(points), strict=True)
+        for output in outputs:
+            output.set_shape([None, self.output_dim])
+
+        if mean_only:
+            return outputs[0]
+        return tuple(outputs)
+
+    def to_mean_function(self):
+        """Turn the GP into a deterministic 'mean' function.
+
+        If the model supports it (e.g., `GPRCached`), this only computes the
+        mean prediction and skips the triangular solve for the variance.
+        """
+        gp = self.gaussian_process
+        if not hasattr(gp, 'build_predict_mean'):
+            return super(GaussianProcess, self).to_mean_function()
+
+        @concatenate_inputs(start=0)
+        def mean_function(points):
+            with gp.tf_mode():
+                if config.gp_memory_limit is None:
+                    return gp.build_predict_mean(points)
+                else:
+                    return self._build_chunked_predict(points, mean_only=True)
+
+        return mean_function
+
     @concatenate_inputs(start=1)
     def build_evaluation(self, points):
         """Evaluate the model, but return tensorflow tensors."""
         # Build normal prediction
         with self.gaussian_process.tf_mode():
-            mean, var = self.gaussian_process.build_predict(points)
+            if config.gp_memory_limit is None:
+                mean, var = self.gaussian_process.build_predict(points)
+            else:
+                mean, var = self._build_chunked_predict(points)
         # Construct confidence intervals
         std = self.beta * tf.sqrt(var, name='standard_deviation')
         return mean, std
@@ -538,13 +2500,288 @@ class GaussianProcess(UncertainFunction):
 
         """
         gp = self.gaussian_process
-        gp.X = np.vstack((self.X, np.atleast_2d(x)))
-        gp.Y = np.vstack((self.Y, np.atleast_2d(y)))
+        if hasattr(gp, 'add_data_point'):
+            gp.add_data_point(x, y)
+        else:
+            gp.X = np.vstack((self.X, np.atleast_2d(x)))
+            gp.Y = np.vstack((self.Y, np.atleast_2d(y)))
 
-        if hasattr(gp, 'update_cache'):
-            gp.update_cache()
+            if hasattr(gp, 'update_cache'):
+                gp.update_cache()
+        self.update_feed_dict()
+
+    def set_prediction_points(self, points):
+        """Cache the posterior at fixed points, see `GPRCached`.
+
+        Parameters
+        ----------
+        points : ndarray
+            A 2d array with the prediction points, one on each row.
+
+        """
+        self.gaussian_process.set_prediction_points(points)
         self.update_feed_dict()
 
+    def predict_cached(self):
+        """Return the cached mean and confidence at the prediction points.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the prediction points.
+        std : ndarray
+            The scaled standard deviation (see `beta`).
+
+        """
+        mean, var = self.gaussian_process.predict_cached()
+        return mean, self.beta * np.sqrt(var)
+
+
+class LocalGaussianProcess(UncertainFunction):
+    """A mixture of local Gaussian process experts on a coarse grid.
+
+    Each rectangle of the partition has an independent GP model that is
+    trained on the data within the rectangle, enlarged by `overlap`.
+    Predictions at a point use the expert of the rectangle that contains the
+    point, and adding data only updates the experts of the corresponding
+    rectangles. Thus the cost of exact GP inference only grows with the
+    amount of local data.
+
+    Parameters
+    ----------
+    partition : instance of `GridWorld`
+        A coarse discretization of the input space of the GP, with one
+        expert for each rectangle.
+    create_gp : callable
+        A function that takes the inputs and outputs of the local data set
+        as 2d arrays and returns a gpflow model, e.g., `GPRCached`. The data
+        may be empty.
+    x : ndarray
+        A 2d array with states to initialize the GP models. Each state is on
+        a row.
+    y : ndarray
+        A 2d array with measurements to initialize the GP models. Each
+        measurement is on a row.
+    overlap : float, optional
+        The fraction of the size of a rectangle by which the region of each
+        expert is enlarged on each side. This reduces discontinuities in the
+        predictions at the boundaries of rectangles.
+    beta : float
+        The scaling factor for the standard deviation to create
+        confidence intervals.
+
+    """
+
+    def __init__(self, partition, create_gp, x, y, overlap=0.25, beta=2.,
+                 name='local_gaussian_process'):
+        """Initialization, see `LocalGaussianProcess`."""
+        super(LocalGaussianProcess, self).__init__(name=name)
+
+        self.partition = partition
+        self.overlap = float(overlap)
+        self.beta = float(beta)
+
+        x = np.atleast_2d(x).astype(config.np_dtype)
+        y = np.atleast_2d(y).astype(config.np_dtype)
+        self.input_dim = x.shape[1]
+        self.output_dim = y.shape[1]
+
+        if self.input_dim != partition.ndim:
+            raise DimensionError('The partition must have the same dimension '
+                                 'as the inputs of the GP.')
+
+        # Lower-left and upper-right corners of the expert regions
+        margin = self.overlap * partition.unit_maxes
+        rectangles = np.arange(partition.nrectangles)
+        self._lower = partition.rectangle_to_state(rectangles) - margin
+        self._upper = self._lower + partition.unit_maxes + 2 * margin
+
+        with tf.variable_scope(self.scope_name):
+            self.experts = []
+            for rectangle, mask in enumerate(self._data_to_experts(x)):
+                gp = create_gp(x[mask], y[mask])
+                expert = GaussianProcess(gp, beta=beta,
+                                         name='expert_{}'.format(rectangle))
+                self.experts.append(expert)
+
+    def _data_to_experts(self, x):
+        """Return for each expert a mask of the data in its region.
+
+        Parameters
+        ----------
+        x : ndarray
+            A 2d array with states, one on each row.
+
+        Returns
+        -------
+        masks : ndarray
+            A 2d boolean array with one row for each expert.
+
+        """
+        masks = np.all((x >= self._lower[:, None, :])
+                       & (x <= self._upper[:, None, :]), axis=2)
+
+        # Points outside of the partition belong to the closest rectangle
+        rectangles = self.partition.state_to_rectangle(x)
+        masks[rectangles, np.arange(len(x))] = True
+        return masks
+
+    @make_tf_fun(tf.int32, stateful=False)
+    def _points_to_experts(self, points):
+        """Return the index of the expert for each point."""
+        return self.partition.state_to_rectangle(points).astype(np.int32)
+
+    def _build_local_evaluation(self, points, functions):
+        """Evaluate each function on the points of the corresponding expert.
+
+        Parameters
+        ----------
+        points : ndarray or Tensor
+            The points at which to evaluate the function. One row for each
+            data points.
+        functions : list
+            One function for each expert, which returns a list of Tensors.
+
+        Returns
+        -------
+        outputs : list
+            The outputs of the functions, stitched in the order of the
+            points.
+
+        """
+        points = tf.convert_to_tensor(points, dtype=config.dtype)
+        num_experts = len(self.experts)
+
+        experts = self._points_to_experts(points)
+        experts.set_shape(points.get_shape()[:1])
+
+        local_points = tf.dynamic_partition(points, experts, num_experts)
+        local_indices = tf.dynamic_partition(tf.range(tf.shape(points)[0]),
+                                             experts, num_experts)
+
+        # The experts are independent and can be evaluated in parallel
+        local_outputs = [function(local)
+                         for function, local in zip(functions, local_points)]
+
+        outputs = []
+        for output in zip(*local_outputs):
+            output = tf.dynamic_stitch(local_indices, output)
+            output.set_shape([None, self.output_dim])
+            outputs.append(output)
+        return outputs
+
+    def to_mean_function(self):
+        """Turn the experts into a deterministic 'mean' function."""
+        def as_tuple(function):
+            return lambda points: (function(points),)
+
+        functions = [as_tuple(expert.to_mean_function())
+                     for expert in self.experts]
+
+        @concatenate_inputs(start=0)
+        def mean_function(points):
+            return self._build_local_evaluation(points, functions)[0]
+
+        return mean_function
+
+    @concatenate_inputs(start=1)
+    def build_evaluation(self, points):
+        """Evaluate the model, but return tensorflow tensors."""
+        mean, std = self._build_local_evaluation(points, self.experts)
+        return mean, std
+
+    def add_data_point(self, x, y):
+        """Add data points to the experts whose regions contain them.
+
+        Parameters
+        ----------
+        x : ndarray
+            A 2d array with the new states to add to the GP model. Each new
+            state is on a new row.
+        y : ndarray
+            A 2d array with the new measurements to add to the GP model.
+            Each measurements is on a new row.
+
+        """
+        x = np.atleast_2d(x)
+        y = np.atleast_2d(y)
+        for expert, mask in zip(self.experts, self._data_to_experts(x)):
+            if np.any(mask):
+                expert.add_data_point(x[mask], y[mask])
+
+
+def merge_gaussian_processes(functions, name='gaussian_process'):
+    """Merge single-output GPs with shared inputs into one multi-output GP.
+
+    A `FunctionStack` of one `GaussianProcess` per output dimension
+    computes and updates a separate kernel matrix and cholesky decomposition
+    for each output. If all GPs are trained on the same inputs with the
+    same kernel, these are identical and the resulting multi-output
+    `GPRCached` model shares them across all outputs.
+
+    Parameters
+    ----------
+    functions : list or instance of `FunctionStack`
+        The instances of `GaussianProcess`, one for each output.
+    name : str, optional
+        The name of the new `GaussianProcess`.
+
+    Returns
+    -------
+    gaussian_process : instance of `GaussianProcess`
+        A GP with one output for each output of the functions. It uses
+        copies of the kernel and mean function of the first GP.
+
+    """
+    if isinstance(functions, FunctionStack):
+        functions = functions.functions
+
+    if not all(isinstance(fun, GaussianProcess) for fun in functions):
+        raise ValueError('Only instances of GaussianProcess can be merged.')
+
+    models = [fun.gaussian_process for fun in functions]
+    reference = models[0]
+    x = reference.X.value
+
+    for gp in models[1:]:
+        if not np.array_equal(gp.X.value, x):
+            raise ValueError('The GPs must be trained on the same inputs.')
+
+        same_kernel = (
+            type(gp.kern) is type(reference.kern)
+            and np.array_equal(gp.kern.get_free_state(),
+                               reference.kern.get_free_state())
+            and np.allclose(gp.kern.compute_K_symm(x[:10]),
+                            reference.kern.compute_K_symm(x[:10])))
+        if not same_kernel:
+            raise ValueError('The GPs must have the same kernel.')
+
+        if not (gp.likelihood.variance.value
+                == reference.likelihood.variance.value):
+            raise ValueError('The GPs must have the same noise variance.')
+
+        if getattr(gp, '_scale', 1.) != getattr(reference, '_scale', 1.):
+            raise ValueError('The GPs must have the same scale.')
+
+    # Mean functions are shared, so they must be the same for all outputs
+    if all(isinstance(gp.mean_function, gpflow.mean_functions.Zero)
+           for gp in models):
+        mean_function = gpflow.mean_functions.Zero()
+    elif all(gp.mean_function is reference.mean_function for gp in models):
+        mean_function = copy.deepcopy(reference.mean_function)
+    else:
+        raise ValueError('The GPs must have the same mean function.')
+
+    y = np.hstack([gp.Y.value for gp in models])
+    gp = GPRCached(x, y, copy.deepcopy(reference.kern),
+                   mean_function=mean_function,
+                   scale=getattr(reference, '_scale', 1.),
+                   max_data=getattr(reference, 'max_data', None))
+    gp.likelihood = copy.deepcopy(reference.likelihood)
+    gp.update_cache()
+
+    return GaussianProcess(gp, beta=functions[0].beta, name=name)
+
 
 class ScipyDelaunay(spatial.Delaunay):
     """
@@ -730,6 +2967,42 @@ class GridWorld(object):
         ijk_index = ijk_index.astype(config.np_dtype)
         return ijk_index * self.unit_maxes + self.offset
 
+    def boundary_indices(self, chunk_size=None):
+        """Enumerate the indices of the points on the boundary of the grid.
+
+        Each boundary point is generated exactly once, as part of the face
+        of the first dimension along which it lies on the boundary.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            The maximum number of indices in each chunk. By default, each
+            face is returned as one chunk.
+
+        Yields
+        ------
+        indices : ndarray (int)
+            The indices of boundary points.
+
+        """
+        num_points = self.num_points
+        for dim in range(self.ndim):
+            # Restrict previous dimensions to the interior to avoid duplicates
+            ranges = [np.arange(1, n - 1) for n in num_points[:dim]]
+            ranges.append(np.array([0, num_points[dim] - 1]))
+            ranges.extend(np.arange(n) for n in num_points[dim + 1:])
+
+            face_shape = [len(values) for values in ranges]
+            face_size = int(np.prod(face_shape))
+            step = face_size if chunk_size is None else chunk_size
+
+            for start in range(0, face_size, max(step, 1)):
+                face_indices = np.arange(start, min(start + step, face_size))
+                ijk_index = [values[index] for values, index in
+                             zip(ranges, np.unravel_index(face_indices,
+                                                          face_shape))]
+                yield np.ravel_multi_index(ijk_index, num_points)
+
     def state_to_index(self, states):
         """Convert physical states to indices.
 
@@ -751,6 +3024,40 @@ class GridWorld(object):
         ijk_index = np.rint(states).astype(np.int32)
         return np.ravel_multi_index(ijk_index.T, self.num_points)
 
+    def vertex_indices(self, states):
+        """Return the indices of states that lie on the grid vertices.
+
+        Parameters
+        ----------
+        states : ndarray
+            Physical states.
+
+        Returns
+        -------
+        indices : ndarray (int) or None
+            The indices that correspond to the states. Is None if any of the
+            states does not coincide with a vertex of the discretization.
+
+        """
+        if states is self._all_points:
+            return np.arange(self.nindex)
+
+        states = np.atleast_2d(states)
+        if states.ndim != 2 or states.shape[1] != self.ndim:
+            return None
+
+        states = (states - self.offset) * (1. / self.unit_maxes)
+        ijk_index = np.rint(states)
+
+        on_grid = np.all(np.abs(states - ijk_index) < 1e-8)
+        on_grid &= np.all(ijk_index >= 0)
+        on_grid &= np.all(ijk_index <= self.num_points - 1)
+        if not on_grid:
+            return None
+
+        return np.ravel_multi_index(ijk_index.astype(np.int64).T,
+                                    self.num_points)
+
     def state_to_rectangle(self, states):
         """Convert physical states to its closest rectangle index.
 
@@ -942,20 +3249,84 @@ class _Delaunay1D(object):
 
     """
 
-    def __init__(self, points):
-        """Initialization, see `_Delaunay1D`."""
-        if points.shape[1] > 1:
-            raise AttributeError('This only works for 1D inputs.')
-        if points.shape[0] > 2:
-            raise AttributeError('This only works for two points')
+    def __init__(self, points):
+        """Initialization, see `_Delaunay1D`."""
+        if points.shape[1] > 1:
+            raise AttributeError('This only works for 1D inputs.')
+        if points.shape[0] > 2:
+            raise AttributeError('This only works for two points')
+
+        self.points = points
+        self.nsimplex = len(points) - 1
+
+        self._min = np.min(points)
+        self._max = np.max(points)
+
+        self.simplices = np.array([[0, 1]])
+
+    def find_simplex(self, points):
+        """Find the simplices containing the given points.
+
+        Parameters
+        ----------
+        points : ndarray
+            2D array of coordinates of points for which to find simplices.
+
+        Returns
+        -------
+        indices : ndarray
+            Indices of simplices containing each point. Points outside the
+            triangulation get the value -1.
+
+        """
+        points = points.squeeze()
+        out_of_bounds = points > self._max
+        out_of_bounds |= points < self._min
+        return np.where(out_of_bounds, -1, 0)
+
+
+class _KuhnTriangulation(object):
+    """A sort-based triangulation of a single hyperrectangle.
+
+    This class behaves like scipy.spatial.Delaunay for the corners of a
+    hyperrectangle, but uses the Kuhn (Freudenthal) triangulation instead.
+    There is one simplex for each ordering of the axes, and a point lies
+    in the simplex that corresponds to the descending order of its
+    normalized coordinates. Point location thus only requires a sort and
+    does not depend on qhull, which makes it usable in higher dimensions.
+
+    Parameters
+    ----------
+    unit_maxes : 1d array-like
+        The side lengths of the hyperrectangle.
+
+    """
+
+    def __init__(self, unit_maxes):
+        """Initialization, see `_KuhnTriangulation`."""
+        super(_KuhnTriangulation, self).__init__()
+        self.unit_maxes = np.asarray(unit_maxes, dtype=config.np_dtype)
+        ndim = len(self.unit_maxes)
 
-        self.points = points
-        self.nsimplex = len(points) - 1
+        # Corners in the same order as `cartesian` over the unit_maxes
+        corners = np.array(list(cartesian((0, 1), repeat=ndim)))
+        self.points = corners * self.unit_maxes
 
-        self._min = np.min(points)
-        self._max = np.max(points)
+        # One simplex per permutation (in lexicographic order). Starting from
+        # the origin, the k-th vertex adds the unit vector along `perm[k-1]`.
+        axes_order = np.array(list(permutations(range(ndim))))
+        self.nsimplex = len(axes_order)
 
-        self.simplices = np.array([[0, 1]])
+        corner_strides = 2 ** np.arange(ndim - 1, -1, -1)
+        self.simplices = np.zeros((self.nsimplex, ndim + 1), dtype=int)
+        np.cumsum(corner_strides[axes_order], axis=1,
+                  out=self.simplices[:, 1:])
+
+        # Weights for the lexicographic rank of a permutation (Lehmer code)
+        factorials = np.cumprod(np.arange(1, ndim + 1))[::-1]
+        self._rank_weights = np.append(factorials[1:], 1)
+        self._upper_triangle = np.triu(np.ones((ndim, ndim), dtype=bool),
+                                       k=1)
 
     def find_simplex(self, points):
         """Find the simplices containing the given points.
@@ -972,10 +3343,19 @@ class _Delaunay1D(object):
             triangulation get the value -1.
 
         """
-        points = points.squeeze()
-        out_of_bounds = points > self._max
-        out_of_bounds |= points < self._min
-        return np.where(out_of_bounds, -1, 0)
+        points = np.atleast_2d(points) / self.unit_maxes
+
+        # Sort the coordinates in descending order
+        order = np.argsort(-points, axis=1, kind='mergesort')
+
+        # Lexicographic rank of the permutation: for each position, count
+        # the smaller elements that come after it
+        smaller = order[:, None, :] < order[:, :, None]
+        smaller &= self._upper_triangle
+        simplex_ids = np.sum(smaller, axis=2).dot(self._rank_weights)
+
+        out_of_bounds = np.any((points < 0) | (points > 1), axis=1)
+        return np.where(out_of_bounds, -1, simplex_ids)
 
 
 class _Triangulation(DeterministicFunction):
@@ -996,15 +3376,25 @@ class _Triangulation(DeterministicFunction):
         A 2D array with the values at the vertices of the grid on each row.
     project: bool, optional
         Whether to project points onto the limits.
+    method : {'delaunay', 'kuhn'}, optional
+        How to triangulate each hyperrectangle. 'delaunay' uses qhull, while
+        'kuhn' uses the sort-based Kuhn triangulation, which has d!
+        simplices per hyperrectangle but scales to higher dimensions.
 
     """
 
-    def __init__(self, discretization, vertex_values=None, project=False):
+    def __init__(self, discretization, vertex_values=None, project=False,
+                 method='delaunay'):
         """Initialization."""
         super(_Triangulation, self).__init__()
 
+        if method not in ('delaunay', 'kuhn'):
+            raise ValueError('Unknown triangulation method {}.'
+                             .format(method))
+
         self.discretization = discretization
         self.input_dim = discretization.ndim
+        self.method = method
 
         self._parameters = None
         self.parameters = vertex_values
@@ -1015,6 +3405,8 @@ class _Triangulation(DeterministicFunction):
         if len(disc.limits) == 1:
             corners = np.array([[0], disc.unit_maxes])
             self.triangulation = _Delaunay1D(corners)
+        elif method == 'kuhn':
+            self.triangulation = _KuhnTriangulation(disc.unit_maxes)
         else:
             product = cartesian(*np.diag(disc.unit_maxes))
             hyperrectangle_corners = np.array(list(product),
@@ -1076,29 +3468,88 @@ class _Triangulation(DeterministicFunction):
         """
         disc = self.discretization
         simplices = self.triangulation.simplices
-        new_simplices = np.empty_like(simplices)
 
         # Convert the points to out indices
         index_mapping = disc.state_to_index(self.triangulation.points +
                                             disc.offset)
 
         # Replace each index with out new_index in index_mapping
-        for i, new_index in enumerate(index_mapping):
-            new_simplices[simplices == i] = new_index
-        return new_simplices
+        return index_mapping[simplices]
 
     def _update_hyperplanes(self):
         """Compute the simplex hyperplane parameters on the triangulation."""
-        self.hyperplanes = np.empty((self.triangulation.nsimplex,
-                                     self.input_dim, self.input_dim),
-                                    dtype=config.np_dtype)
-
         # Use that the bottom-left rectangle has the index zero, so that the
         # index numbers of scipy correspond to ours.
-        for i, simplex in enumerate(self.unit_simplices):
-            simplex_points = self.discretization.index_to_state(simplex)
-            self.hyperplanes[i] = np.linalg.inv(simplex_points[1:] -
-                                                simplex_points[:1])
+        simplex_points = self.discretization.index_to_state(
+            self.unit_simplices.ravel())
+        simplex_points = simplex_points.reshape(self.triangulation.nsimplex,
+                                                self.input_dim + 1,
+                                                self.input_dim)
+        self.hyperplanes = np.linalg.inv(simplex_points[:, 1:] -
+                                         simplex_points[:, :1])
+
+        # Origins of the simplices within the basic hyperrectangle
+        self.unit_origins = (simplex_points[:, 0]
+                             - self.discretization.offset)
+
+    def _find_unit_simplex(self, unit_coordinates):
+        """Find the simplices within the basic hyperrectangle.
+
+        Parameters
+        ----------
+        unit_coordinates : ndarray
+            2D array of points within the basic hyperrectangle.
+
+        Returns
+        -------
+        simplices : ndarray (int)
+            The indices of the simplices in the basic hyperrectangle.
+
+        Notes
+        -----
+        For the Delaunay triangulation, qhull locates the points. Points on
+        the faces are contained in several simplices, for these we pick the
+        first simplex that contains the point (up to a small tolerance), so
+        that they are assigned consistently with `Triangulation`.
+
+        """
+        if self.method == 'kuhn':
+            # Round-off may push points on the upper faces outside the
+            # basic hyperrectangle, where Kuhn would return -1
+            unit_coordinates = np.clip(unit_coordinates, 0,
+                                       self.triangulation.unit_maxes)
+            return self.triangulation.find_simplex(unit_coordinates)
+
+        simplex_ids = self.triangulation.find_simplex(unit_coordinates)
+        simplex_ids = np.atleast_1d(simplex_ids)
+
+        # Barycentric coordinates with respect to the qhull simplices
+        offset = unit_coordinates - self.unit_origins[simplex_ids]
+        weights = np.einsum('ij,ijk->ik', offset,
+                            self.hyperplanes[simplex_ids])
+        min_weights = np.minimum(np.min(weights, axis=1),
+                                 1 - np.sum(weights, axis=1))
+
+        # Points close to a face, or not found due to round-off
+        ambiguous = (simplex_ids < 0)
+        ambiguous |= min_weights < np.sqrt(_SIMPLEX_TOLERANCE)
+        ambiguous = np.nonzero(ambiguous)[0]
+
+        # Compare to all simplices, in batches to bound the memory
+        nsimplex = self.triangulation.nsimplex
+        batch_size = max(config.gp_batch_size // nsimplex, 1)
+        for start in range(0, len(ambiguous), batch_size):
+            batch = ambiguous[start:start + batch_size]
+            offset = unit_coordinates[batch, None, :] - self.unit_origins
+            weights = np.einsum('ijk,jkl->ijl', offset, self.hyperplanes)
+            min_weights = np.minimum(np.min(weights, axis=2),
+                                     1 - np.sum(weights, axis=2))
+
+            # argmax returns the first simplex within the tolerance
+            min_weights = np.minimum(min_weights, -_SIMPLEX_TOLERANCE)
+            simplex_ids[batch] = np.argmax(min_weights, axis=1)
+
+        return simplex_ids
 
     def find_simplex(self, points):
         """Find the simplices corresponding to points.
@@ -1114,14 +3565,20 @@ class _Triangulation(DeterministicFunction):
 
         """
         disc = self.discretization
-        rectangles = disc.state_to_rectangle(points)
 
         # Convert to unit coordinates
         points = disc._center_states(points, clip=True)
 
-        # Convert to basic hyperrectangle coordinates and find simplex
-        unit_coordinates = points % disc.unit_maxes
-        simplex_ids = self.triangulation.find_simplex(unit_coordinates)
+        # Find the hyperrectangle and the coordinates within it
+        ijk_index = np.floor(points * (1. / disc.unit_maxes))
+        np.clip(ijk_index, 0, disc.num_points - 2, out=ijk_index)
+        unit_coordinates = points - ijk_index * disc.unit_maxes
+
+        rectangles = np.ravel_multi_index(ijk_index.astype(np.int64).T,
+                                          disc.num_points - 1)
+
+        # Find the simplex within the basic hyperrectangle
+        simplex_ids = self._find_unit_simplex(unit_coordinates)
         simplex_ids = np.atleast_1d(simplex_ids)
 
         # Adjust for the hyperrectangle index
@@ -1201,14 +3658,17 @@ class _Triangulation(DeterministicFunction):
 
         return weights, simplices
 
-    def build_evaluation(self, points):
+    def build_evaluation(self, points=None, indices=None):
         """Return the function values.
 
         Parameters
         ----------
-        points : ndarray
+        points : ndarray, optional
             The points at which to evaluate the function. One row for each
             data points.
+        indices : ndarray, optional
+            The indices of the vertices at which to evaluate the function.
+            Ignored if points are provided.
 
         Returns
         -------
@@ -1216,7 +3676,17 @@ class _Triangulation(DeterministicFunction):
             The function values at the points.
 
         """
+        if points is None:
+            if indices is None:
+                raise ValueError('Need to provide points or indices.')
+            return self.parameters[indices]
+
+        # Points on the vertices do not require interpolation
         points = np.atleast_2d(points)
+        indices = self.discretization.vertex_indices(points)
+        if indices is not None:
+            return self.parameters[indices]
+
         weights, simplices = self._get_weights(points)
 
         # Return function values
@@ -1245,18 +3715,27 @@ class _Triangulation(DeterministicFunction):
 
         """
         points = np.atleast_2d(points)
+        npoints = len(points)
+        nindex = self.discretization.nindex
+
+        # Points on the vertices only depend on a single vertex value
+        indices = self.discretization.vertex_indices(points)
+        if indices is not None:
+            weights = np.ones(npoints, dtype=config.np_dtype)
+            return sparse.coo_matrix((weights, (np.arange(npoints), indices)),
+                                     shape=(npoints, nindex))
+
         weights, simplices = self._get_weights(points)
         # Construct sparse matrix for optimization
 
         nsimp = self.input_dim + 1
-        npoints = len(simplices)
         # Indices of constraints (nsimp points per simplex, so we have nsimp
         # values in each row; one for each simplex)
         rows = np.repeat(np.arange(len(points)), nsimp)
         cols = simplices.ravel()
 
         return sparse.coo_matrix((weights.ravel(), (rows, cols)),
-                                 shape=(npoints, self.discretization.nindex))
+                                 shape=(npoints, nindex))
 
     def _get_weights_gradient(self, points=None, indices=None):
         """Return the linear gradient weights associated with points.
@@ -1372,7 +3851,9 @@ class _Triangulation(DeterministicFunction):
 class Triangulation(DeterministicFunction):
     """Efficient Delaunay triangulation on regular grid.
 
-    This is a tensorflow wrapper around a numpy implementation.
+    This is a tensorflow implementation of `_Triangulation`. The numpy class
+    is only used to set up the triangulation of the basic hyperrectangle,
+    the simplex lookup and all evaluations are native tensorflow operations.
 
     This class is a wrapper around scipy.spatial.Delaunay for regular grids. It
     splits the space into regular hyperrectangles and then computes a Delaunay
@@ -1391,17 +3872,20 @@ class Triangulation(DeterministicFunction):
         Whether to project points onto the limits.
     name : string
         The tensorflow scope for all methods.
+    method : {'delaunay', 'kuhn'}, optional
+        How to triangulate each hyperrectangle, see `_Triangulation`.
 
     """
 
     def __init__(self, discretization, vertex_values, project=False,
-                 name='triangulation'):
+                 name='triangulation', method='delaunay'):
         """Initialization."""
         super(Triangulation, self).__init__(name=name)
 
         with tf.variable_scope(self.scope_name):
             self.tri = _Triangulation(discretization,
-                                      project=project)
+                                      project=project,
+                                      method=method)
 
             # Make sure the variable has the correct size
             if not isinstance(vertex_values, tf.Variable):
@@ -1439,39 +3923,153 @@ class Triangulation(DeterministicFunction):
         """Return the number of parameters."""
         return self.tri.nindex
 
-    @make_tf_fun([config.dtype, config.dtype, tf.int64], stateful=False)
+    def _find_unit_simplex(self, unit_coordinates):
+        """Find the simplices within the basic hyperrectangle.
+
+        See `_Triangulation._find_unit_simplex` for details.
+
+        Parameters
+        ----------
+        unit_coordinates : Tensor
+            2D array of points within the basic hyperrectangle.
+
+        Returns
+        -------
+        simplices : Tensor (int64)
+            The indices of the simplices in the basic hyperrectangle.
+
+        """
+        tri = self.tri
+        if tri.method == 'kuhn' and self.input_dim > 1:
+            kuhn = tri.triangulation
+
+            # Sort the coordinates in descending order (ties keep the order)
+            scaled = tf.clip_by_value(unit_coordinates / kuhn.unit_maxes,
+                                      0, 1)
+            _, order = tf.nn.top_k(scaled, k=self.input_dim)
+
+            # Lexicographic rank of the permutation
+            smaller = tf.less(order[:, None, :], order[:, :, None])
+            smaller = tf.logical_and(smaller, kuhn._upper_triangle)
+            counts = tf.reduce_sum(tf.cast(smaller, tf.int64), axis=2)
+            rank_weights = kuhn._rank_weights.astype(np.int64)
+            return tf.reduce_sum(counts * rank_weights, axis=1)
+
+        # Barycentric coordinates with respect to chunks of the simplices, so
+        # that the memory does not grow with the number of simplices
+        simplex_ids = None
+        for start in range(0, tri.triangulation.nsimplex, _SIMPLEX_CHUNK_SIZE):
+            chunk = slice(start, start + _SIMPLEX_CHUNK_SIZE)
+            offset = unit_coordinates[:, None, :] - tri.unit_origins[chunk]
+            weights = tf.matmul(tf.transpose(offset, [1, 0, 2]),
+                                tri.hyperplanes[chunk])
+            weights = tf.transpose(weights, [1, 0, 2])
+            min_weights = tf.minimum(tf.reduce_min(weights, axis=2),
+                                     1 - tf.reduce_sum(weights, axis=2))
+
+            # argmax returns the first simplex within the tolerance
+            min_weights = tf.minimum(min_weights, -_SIMPLEX_TOLERANCE)
+            chunk_weights = tf.reduce_max(min_weights, axis=1)
+            chunk_ids = tf.argmax(min_weights, axis=1) + start
+
+            if simplex_ids is None:
+                max_weights, simplex_ids = chunk_weights, chunk_ids
+            else:
+                # Keep the earlier simplex unless the new one is better
+                better = tf.greater(chunk_weights, max_weights)
+                max_weights = tf.maximum(chunk_weights, max_weights)
+                simplex_ids = tf.where(better, chunk_ids, simplex_ids)
+
+        return simplex_ids
+
+    @with_scope('find_simplex')
     def _get_hyperplanes(self, points):
         """Return the linear weights associated with points.
 
         Parameters
         ----------
-        points : 2d array
+        points : 2d array or Tensor
             Each row represents one point
 
         Returns
         -------
-        weights : ndarray
-            An array that contains the linear weights for each point.
-        hyperplanes : ndarray
+        origins : Tensor
+            The origins of the simplices associated with each point.
+        hyperplanes : Tensor
             The corresponding hyperplane objects.
-        simplices : ndarray
+        simplices : Tensor
             The indices of the simplices associated with each points
 
         """
-        simplex_ids = self.tri.find_simplex(points)
-
-        simplices = self.tri.simplices(simplex_ids).astype(np.int64)
-        origins = self.tri.discretization.index_to_state(simplices[:, 0])
+        disc = self.discretization
+        tri = self.tri
+        dtype = config.np_dtype
 
-        # Get hyperplane equations
-        simplex_ids %= self.tri.triangulation.nsimplex
-        hyperplanes = self.tri.hyperplanes[simplex_ids]
+        # Convert to unit coordinates, see `GridWorld._center_states`
+        points = tf.convert_to_tensor(points, dtype=config.dtype)
+        states = points - disc.offset
+        states = tf.minimum(tf.maximum(states,
+                                       disc.offset_limits[:, 0] + 2 * _EPS),
+                            disc.offset_limits[:, 1] - 2 * _EPS)
+
+        # Find the hyperrectangle and the coordinates within it
+        ijk_index = tf.floor(states * (1. / disc.unit_maxes))
+        ijk_index = tf.minimum(tf.maximum(ijk_index, 0.),
+                               (disc.num_points - 2).astype(dtype))
+        unit_coordinates = states - ijk_index * disc.unit_maxes
+        ijk_index = tf.cast(ijk_index, tf.int64)
+
+        # Index of the bottom-left corner of the hyperrectangle
+        strides = np.cumprod(disc.num_points[:0:-1])[::-1]
+        strides = np.append(strides, 1).astype(np.int64)
+        corners = tf.reduce_sum(ijk_index * strides, axis=1, keepdims=True)
+
+        # Find the simplex within the basic hyperrectangle
+        simplex_ids = self._find_unit_simplex(unit_coordinates)
+
+        simplices = tf.gather(tri.unit_simplices.astype(np.int64),
+                              simplex_ids) + corners
+        hyperplanes = tf.gather(tri.hyperplanes, simplex_ids)
+        origins = (tf.gather(tri.unit_origins, simplex_ids)
+                   + tf.cast(ijk_index, config.dtype) * disc.unit_maxes
+                   + disc.offset)
 
-        # Pre-multiply each hyperplane by (point - origin)
         return origins, hyperplanes, simplices
 
-    def build_evaluation(self, points):
-        """Evaluate using tensorflow."""
+    def build_evaluation(self, points=None, indices=None):
+        """Evaluate using tensorflow.
+
+        Parameters
+        ----------
+        points : ndarray or Tensor, optional
+            The points at which to evaluate the function. One row for each
+            data points.
+        indices : ndarray or Tensor, optional
+            The indices of the vertices at which to evaluate the function.
+            Ignored if points are provided.
+
+        Returns
+        -------
+        values : Tensor
+            The function values at the points.
+
+        """
+        if points is None:
+            if indices is None:
+                raise ValueError('Need to provide points or indices.')
+            return tf.gather(self.parameters[0], indices)
+
+        # Points that are known to lie on the vertices only require a lookup
+        if isinstance(points, (tf.Tensor, tf.Variable)):
+            static_points = tf.contrib.util.constant_value(points)
+        else:
+            static_points = points
+
+        if static_points is not None:
+            indices = self.discretization.vertex_indices(static_points)
+            if indices is not None:
+                return tf.gather(self.parameters[0], indices)
+
         # Get the appropriate hyperplane
         origins, hyperplanes, simplices = self._get_hyperplanes(points)
 
@@ -1498,16 +4096,39 @@ class Triangulation(DeterministicFunction):
         # Compute the values
         return tf.reduce_sum(weights[:, :, None] * parameter_vector, axis=1)
 
-    @make_tf_fun([config.dtype], stateful=False)
-    def _get_gradients(self, points, parameters):
-        self.tri.parameters = parameters
-        return self.tri.gradient(points)
-
     @use_parent_scope
     @with_scope('derivative')
     def gradient(self, points):
-        """Compute derivatives using tensorflow."""
-        return self._get_gradients(points, self.parameters[0])[0]
+        """Compute derivatives using tensorflow.
+
+        Parameters
+        ----------
+        points : ndarray or Tensor
+            The points at which to evaluate the gradient. One row for each
+            data points.
+
+        Returns
+        -------
+        gradient : Tensor
+            The gradients, see `_Triangulation.gradient`.
+
+        """
+        _, hyperplanes, simplices = self._get_hyperplanes(points)
+
+        # Weights of the vertex values for the gradient along each dimension
+        w0 = -tf.reduce_sum(hyperplanes, axis=2, keepdims=True)
+        weights = tf.concat((w0, hyperplanes), axis=2)
+
+        # Collect the value on the vertices
+        parameter_vector = tf.gather(self.parameters[0],
+                                     indices=simplices,
+                                     validate_indices=False)
+
+        gradient = tf.matmul(parameter_vector, weights,
+                             transpose_a=True, transpose_b=True)
+        if self.output_dim == 1:
+            gradient = tf.squeeze(gradient, axis=1)
+        return gradient
 
 
 class QuadraticFunction(DeterministicFunction):
@@ -1583,8 +4204,343 @@ class LinearSystem(DeterministicFunction):
         return tf.matmul(points, self.matrix.T, transpose_b=False)
 
 
+def _random_fourier_parameters(kernel, input_dim, num_features):
+    """Draw the parameters of random Fourier features.
+
+    The features are scale * cos(x[:, active_dims] frequencies^T + phases).
+
+    Parameters
+    ----------
+    kernel : instance of gpflow.kernels.Stationary
+        An RBF or Matern kernel.
+    input_dim : int
+        The input dimension of the GP.
+    num_features : int
+        The number of random features.
+
+    Returns
+    -------
+    active_dims : ndarray
+        The input dimensions that the kernel acts on.
+    frequencies : ndarray
+        A 2d array with one frequency on each row.
+    phases : ndarray
+        A 1d array with the phase of each feature.
+    scale : float
+        The scaling factor of the features.
+
+    """
+    kernels = gpflow.kernels
+    active_dims = np.arange(input_dim)[kernel.active_dims]
+    frequencies = np.random.randn(num_features, len(active_dims))
+
+    # Spectral densities are normal (RBF) or multivariate t (Matern)
+    if isinstance(kernel, kernels.RBF):
+        pass
+    elif isinstance(kernel, (kernels.Matern12, kernels.Matern32,
+                             kernels.Matern52)):
+        if isinstance(kernel, kernels.Matern12):
+            nu = 0.5
+        elif isinstance(kernel, kernels.Matern32):
+            nu = 1.5
+        else:
+            nu = 2.5
+        chi2 = np.random.chisquare(2 * nu, size=(num_features, 1))
+        frequencies *= np.sqrt(2 * nu / chi2)
+    else:
+        raise ValueError('Random features are only implemented for RBF and '
+                         'Matern kernels.')
+
+    frequencies /= kernel.lengthscales.value
+    phases = np.random.uniform(0, 2 * np.pi, size=num_features)
+    scale = np.sqrt(2 * kernel.variance.value / num_features)
+
+    return active_dims, frequencies, phases, scale
+
+
+def _random_fourier_features(kernel, input_dim, num_features):
+    """Draw random Fourier features for a stationary kernel.
+
+    Parameters
+    ----------
+    kernel : instance of gpflow.kernels.Stationary
+        An RBF or Matern kernel.
+    input_dim : int
+        The input dimension of the GP.
+    num_features : int
+        The number of random features.
+
+    Returns
+    -------
+    features : callable
+        A function that maps a tensor of states to the tensor of features,
+        such that features(x) features(y)^T approximates K(x, y).
+
+    """
+    active_dims, frequencies, phases, scale = _random_fourier_parameters(
+        kernel, input_dim, num_features)
+
+    def features(x):
+        x = tf.gather(x, active_dims, axis=1)
+        return scale * tf.cos(tf.matmul(x, frequencies.T) + phases)
+
+    return features
+
+
+def _sample_gp_function_rff(discretization, gpfun, number, return_function,
+                            num_features):
+    """Sample GP functions with random features, see `sample_gp_function`.
+
+    Prior samples are represented with random Fourier features and are
+    conditioned on the data with Matheron's rule,
+    f(x) = f_prior(x) + K(x, X) (K(X, X) + s^2 I)^-1 (y - f_prior(X) - e).
+    """
+    gp = gpfun.gaussian_process
+    data_x = gp.X.value
+    data_y = gp.Y.value
+    input_dim = data_x.shape[1]
+
+    features = []
+    weights = []
+    for _ in range(number):
+        features.append(_random_fourier_features(gp.kern, input_dim,
+                                                 num_features))
+        weights.append(np.random.randn(num_features, 1))
+
+    # Prior samples and kernel matrix at the data points
+    with gp.tf_mode():
+        kernel = gp.kern.K(gp.X)
+        residual = gp.Y - gp.mean_function(gp.X)
+        noise_var = gp.likelihood.variance
+    prior = [tf.matmul(feature(data_x), weight)
+             for feature, weight in zip(features, weights)]
+
+    sess = tf.get_default_session()
+    kernel, residual, noise_var, prior = sess.run(
+        [kernel, residual, noise_var, prior], feed_dict=gpfun.feed_dict)
+
+    # Weights for the pathwise update, one column per sample
+    noise = np.sqrt(noise_var) * np.random.randn(len(data_y), number)
+    targets = residual - np.hstack(prior) - noise
+    if len(data_y):
+        kernel[np.diag_indices_from(kernel)] += noise_var
+        cho_factor = linalg.cho_factor(kernel, lower=True)
+        update_weights = linalg.cho_solve(cho_factor, targets)
+    else:
+        update_weights = targets
+
+    @concatenate_inputs(start=3)
+    def gp_sample(feature, weight, update_weight, x, noise=True):
+        with gp.tf_mode():
+            y = (gp.mean_function(x) + tf.matmul(feature(x), weight)
+                 + tf.matmul(gp.kern.K(x, data_x), update_weight))
+            if noise:
+                y += (tf.sqrt(gp.likelihood.variance)
+                      * tf.random_normal(tf.shape(y), dtype=tf.float64))
+        return y
+
+    functions = []
+    for i in range(number):
+        fun = partial(gp_sample, features[i], weights[i],
+                      update_weights[:, [i]])
+
+        # Attach the feed_dict for ease of use
+        fun.feed_dict = gpfun.feed_dict
+
+        functions.append(fun)
+
+    if return_function:
+        return functions
+
+    values = [fun(discretization, noise=False) for fun in functions]
+    values = sess.run(values, feed_dict=gpfun.feed_dict)
+    return np.hstack(values).T
+
+
+def _kronecker_product_mvp(matrices, vectors):
+    """Multiply a Kronecker product of matrices with vectors.
+
+    Parameters
+    ----------
+    matrices : list of ndarray
+        The square matrices A_1, ..., A_d.
+    vectors : ndarray
+        A 2D array with one vector on each column. The number of rows must
+        be the product of the sizes of the matrices.
+
+    Returns
+    -------
+    result : ndarray
+        The product (A_1 kron ... kron A_d) vectors without forming the
+        Kronecker product.
+
+    """
+    num_vectors = vectors.shape[1]
+    shape = [len(matrix) for matrix in matrices]
+    result = vectors.reshape(shape + [num_vectors])
+    for i, matrix in enumerate(matrices):
+        result = np.tensordot(matrix, result, axes=(1, i))
+        result = np.moveaxis(result, 0, i)
+    return result.reshape(-1, num_vectors)
+
+
+def _kronecker_kernel_factors(gp, discretization):
+    """Decompose the kernel matrix on a grid into a Kronecker product.
+
+    This requires a separable kernel, k(x, y) = prod_i k_i(x_i, y_i), such
+    as an RBF kernel or products of one-dimensional kernels.
+
+    Parameters
+    ----------
+    gp : instance of gpflow.models.GPModel
+        The Gaussian process model.
+    discretization : instance of `GridWorld`
+        The grid.
+
+    Returns
+    -------
+    factors : list of ndarray
+        The kernel matrices along each dimension, such that their Kronecker
+        product is the kernel matrix over `discretization.all_points`.
+
+    """
+    reference = discretization.offset
+    scale = gp.kern.compute_K_symm(reference[None, :])[0, 0]
+
+    factors = []
+    for i, points in enumerate(discretization.discrete_points):
+        states = np.tile(reference, (len(points), 1))
+        states[:, i] = points
+        factors.append(gp.kern.compute_K_symm(states) / scale)
+    factors[0] *= scale
+
+    # Make sure that the kernel is separable on a few random pairs
+    indices = np.random.randint(discretization.nindex, size=(2, 10))
+    states = discretization.index_to_state(indices.ravel())
+    kernel = gp.kern.compute_K(states[:10], states[10:])
+
+    multi_indices = np.unravel_index(indices, discretization.num_points)
+    kronecker = np.ones((10, 10))
+    for factor, (rows, cols) in zip(factors, multi_indices):
+        kronecker *= factor[rows[:, None], cols[None, :]]
+
+    if not np.allclose(kernel, kronecker):
+        raise ValueError('The kernel is not separable over the dimensions '
+                         'of the discretization.')
+
+    return factors
+
+
+def _gp_sample_functions(gpfun, discretization, alphas):
+    """Return sample functions that interpolate with the kernel.
+
+    Parameters
+    ----------
+    gpfun : instance of safe_learning.GaussianProcess
+        The GP from which the samples were drawn.
+    discretization : ndarray
+        The points at which the samples were drawn.
+    alphas : ndarray
+        The weights of the kernel, one column for each sample.
+
+    Returns
+    -------
+    functions : list of functions
+        See `sample_gp_function`.
+
+    """
+    gp = gpfun.gaussian_process
+
+    @concatenate_inputs(start=1)
+    def gp_sample(alpha, x, noise=True):
+        with gp.tf_mode():
+            k = gp.kern.K(x, discretization)
+            y = gp.mean_function(x) + tf.matmul(k, alpha)
+            if noise:
+                y += (tf.sqrt(gp.likelihood.variance)
+                      * tf.random_normal(tf.shape(y), dtype=tf.float64))
+        return y
+
+    # Now let's plug in the alpha to generate samples
+    functions = []
+    for i in range(alphas.shape[1]):
+        fun = partial(gp_sample, alphas[:, [i]])
+
+        # Attach the feed_dict for ease of use
+        fun.feed_dict = gpfun.feed_dict
+
+        functions.append(fun)
+
+    return functions
+
+
+def _sample_gp_function_kronecker(grid, gpfun, number, return_function):
+    """Sample GP functions on a grid, see `sample_gp_function`.
+
+    The prior covariance on the grid is a Kronecker product, so prior
+    samples only require eigendecompositions along each dimension. They are
+    conditioned on the data (which must lie on the grid) with Matheron's
+    rule, f = f_prior + K(., X) (K(X, X) + s^2 I)^-1 (y - f_prior(X) - e).
+    """
+    gp = gpfun.gaussian_process
+    points = grid.all_points
+
+    data_indices = grid.vertex_indices(gp.X.value)
+    if data_indices is None:
+        raise ValueError("method='kronecker' requires the data to lie on the "
+                         "vertices of the discretization.")
+
+    # Eigendecomposition of the kernel matrices along each dimension
+    factors = _kronecker_kernel_factors(gp, grid)
+    eigenvalues, eigenvectors = zip(*[linalg.eigh(factor)
+                                      for factor in factors])
+    eigenvalues = reduce(np.multiply.outer, eigenvalues).ravel()
+    eigenvalues = np.maximum(eigenvalues, 0)
+
+    # Prior samples on the grid
+    noise = np.random.randn(grid.nindex, number)
+    prior = _kronecker_product_mvp(eigenvectors,
+                                   np.sqrt(eigenvalues)[:, None] * noise)
+
+    with gp.tf_mode():
+        kernel = gp.kern.K(gp.X)
+        residual = gp.Y - gp.mean_function(gp.X)
+        noise_var = gp.likelihood.variance
+        mean = gp.mean_function(points)
+
+    sess = tf.get_default_session()
+    kernel, residual, noise_var, mean = sess.run(
+        [kernel, residual, noise_var, mean], feed_dict=gpfun.feed_dict)
+
+    # Condition the prior samples on the data
+    output = prior
+    if len(data_indices):
+        noise = np.sqrt(noise_var) * np.random.randn(len(residual), number)
+        targets = residual - prior[data_indices] - noise
+        kernel[np.diag_indices_from(kernel)] += noise_var
+        weights = linalg.cho_solve(linalg.cho_factor(kernel, lower=True),
+                                   targets)
+
+        # K(grid, X) weights = K(grid, grid) E weights for one-hot E
+        grid_weights = np.zeros((grid.nindex, number))
+        np.add.at(grid_weights, data_indices, weights)
+        output = output + _kronecker_product_mvp(factors, grid_weights)
+
+    if not return_function:
+        return (mean + output).T
+
+    # Weights for the kernel interpolation, K(grid, grid)^-1 f
+    projected = _kronecker_product_mvp([vec.T for vec in eigenvectors],
+                                       output)
+    projected /= (eigenvalues + 1E-8)[:, None]
+    alphas = _kronecker_product_mvp(eigenvectors, projected)
+
+    return _gp_sample_functions(gpfun, points, alphas)
+
+
 @with_scope('sample_gp_function')
-def sample_gp_function(discretization, gpfun, number=1, return_function=True):
+def sample_gp_function(discretization, gpfun, number=1, return_function=True,
+                       method='cholesky', num_features=1000):
     """
     Sample a function from a gp with corresponding kernel within its bounds.
 
@@ -1599,6 +4555,19 @@ def sample_gp_function(discretization, gpfun, number=1, return_function=True):
         The number of functions to sample.
     return_function : bool, optional
         Whether to return a function or the sampled data only.
+    method : {'cholesky', 'rff', 'kronecker'}, optional
+        How to draw the samples. 'cholesky' factorizes the predictive
+        covariance over the discretization, which scales cubically with the
+        number of points. 'rff' approximates the prior with random Fourier
+        features (RBF and Matern kernels only) and conditions the sample on
+        the data, which scales linearly with the number of points.
+        'kronecker' samples exactly on a `GridWorld` by exploiting the
+        Kronecker structure of separable kernels (e.g., RBF). It scales
+        with the number of points times the sum of the number of points
+        along each dimension, but requires the data to lie on the grid.
+        For inference with data on all vertices, see `GPRKronecker`.
+    num_features : int, optional
+        The number of random features for method='rff'.
 
     Returns
     -------
@@ -1610,9 +4579,21 @@ def sample_gp_function(discretization, gpfun, number=1, return_function=True):
         plotting).
 
     """
+    if method == 'kronecker':
+        if not isinstance(discretization, GridWorld):
+            raise ValueError("method='kronecker' requires a GridWorld.")
+        return _sample_gp_function_kronecker(discretization, gpfun, number,
+                                             return_function)
+
     if isinstance(discretization, GridWorld):
         discretization = discretization.all_points
 
+    if method == 'rff':
+        return _sample_gp_function_rff(discretization, gpfun, number,
+                                       return_function, num_features)
+    elif method != 'cholesky':
+        raise ValueError('Unknown sampling method {}.'.format(method))
+
     gp = gpfun.gaussian_process
 
     with gp.tf_mode():
@@ -1627,39 +4608,17 @@ def sample_gp_function(discretization, gpfun, number=1, return_function=True):
     cov = cov.squeeze(-1)
 
     # Make sure the covariance is positive definite
-    cov += np.eye(len(cov)) * 1E-8
+    cov[np.diag_indices_from(cov)] += 1E-8
 
-    # Draw a sample
-    output = np.random.multivariate_normal(mean, cov, size=number)
+    # Draw a sample, reusing the cholesky decomposition below
+    cholesky = linalg.cholesky(cov, lower=True)
+    output = mean + np.random.randn(number, len(mean)).dot(cholesky.T)
 
     if not return_function:
         return output
 
-    # cholesky
-    cho_factor = linalg.cho_factor(cov, lower=True)
-
-    @concatenate_inputs(start=1)
-    def gp_sample(alpha, x, noise=True):
-        with gp.tf_mode():
-            k = gp.kern.K(x, discretization)
-            y = gp.mean_function(x) + tf.matmul(k, alpha)
-            if noise:
-                y += (tf.sqrt(gp.likelihood.variance)
-                      * tf.random_normal(tf.shape(y), dtype=tf.float64))
-        return y
-
-    # Now let's plug in the alpha to generate samples
-    functions = []
-    for i in range(number):
-        alpha = linalg.cho_solve(cho_factor, output[[i], :].T)
-        fun = partial(gp_sample, alpha)
-
-        # Attach the feed_dict for ease of use
-        fun.feed_dict = gpfun.feed_dict
-
-        functions.append(fun)
-
-    return functions
+    alphas = linalg.cho_solve((cholesky, True), output.T)
+    return _gp_sample_functions(gpfun, discretization, alphas)
 
 
 class NeuralNetwork(DeterministicFunction):
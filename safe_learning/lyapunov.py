@@ -3,25 +3,44 @@
 from __future__ import absolute_import, division, print_function
 
 from collections import Sequence
-from heapq import heappush, heappop
+from heapq import heapify, heappop, heappush
 import itertools
-from future.builtins import zip, range
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import warnings
+import weakref
 
 import numpy as np
+from scipy import ndimage
 import tensorflow as tf
 
-from .utilities import (batchify, get_storage, set_storage, with_scope,
-                        get_feed_dict, unique_rows)
+from .functions import Triangulation, GaussianProcess
+from .utilities import (get_storage, set_storage, with_scope, get_feed_dict,
+                        unique_rows)
 from safe_learning import config
 
 __all__ = ['Lyapunov', 'smallest_boundary_value', 'get_lyapunov_region',
-           'get_safe_sample']
+           'get_safe_sample', 'VerificationPool']
+
+
+_STORAGE = {}
+
+# Names of the tensors of `smallest_boundary_value` for each graph and
+# function. Only the names are stored, so that the graphs and functions are
+# not kept alive.
+_BOUNDARY_STORAGE = weakref.WeakKeyDictionary()
+
+# The Lyapunov instance and session of a `VerificationPool` worker process
+_WORKER = {}
 
 
 def smallest_boundary_value(fun, discretization):
     """Determine the smallest value of a function on its boundary.
 
+    The boundary points are evaluated in batches of `config.gp_batch_size`
+    through a placeholder, so that the graph is only built once for each
+    function.
+
     Parameters
     ----------
     fun : callable
@@ -36,69 +55,162 @@ def smallest_boundary_value(fun, discretization):
         The smallest value on the boundary.
 
     """
-    min_value = np.inf
-    feed_dict = get_feed_dict(tf.get_default_graph())
+    graph = tf.get_default_graph()
+    storage = _BOUNDARY_STORAGE.setdefault(graph,
+                                           weakref.WeakKeyDictionary())
 
-    # Check boundaries for each axis
-    for i in range(discretization.ndim):
-        # Use boundary values only for the ith element
-        tmp = list(discretization.discrete_points)
-        tmp[i] = discretization.discrete_points[i][[0, -1]]
+    if fun in storage:
+        tf_points, tf_min_value = map(graph.get_tensor_by_name, storage[fun])
+    else:
+        tf_points = tf.placeholder(config.dtype,
+                                   shape=[None, discretization.ndim])
+        tf_min_value = tf.reduce_min(fun(tf_points))
+
+        try:
+            storage[fun] = (tf_points.name, tf_min_value.name)
+        except TypeError:
+            # Functions without weak references are not cached
+            pass
 
-        # Generate all points
-        columns = (x.ravel() for x in np.meshgrid(*tmp, indexing='ij'))
-        all_points = np.column_stack(columns)
+    feed_dict = get_feed_dict(graph).copy()
+    min_value = np.inf
 
-        # Update the minimum value
-        smallest = tf.reduce_min(fun(all_points))
-        min_value = min(min_value, smallest.eval(feed_dict=feed_dict))
+    for indices in discretization.boundary_indices(config.gp_batch_size):
+        feed_dict[tf_points] = discretization.index_to_state(indices)
+        min_value = min(min_value, tf_min_value.eval(feed_dict=feed_dict))
 
     return min_value
 
 
-def get_lyapunov_region(lyapunov, discretization, init_node):
-    """Get the region within which a function is a Lyapunov function.
+def _count_regional_minima(values, region, structure):
+    """Count the regional minima of an array within a region.
+
+    A regional minimum is a connected set of nodes with equal values, whose
+    neighbors all have larger values.
 
     Parameters
     ----------
-    lyapunov : callable
-        A tensorflow function.
-    discretization : instance of `GridWorld`
-        The discretization on which to check the increasing property.
-    init_node : tuple
-        The node at which to start the verification.
+    values : ndarray
+        The function values on a grid.
+    region : ndarray
+        A boolean array of the same shape that masks the region of interest.
+    structure : ndarray
+        The connectivity of neighboring nodes, see `scipy.ndimage.label`.
 
     Returns
     -------
-    region : ndarray
-        A boolean array that contains all the states for which lyapunov is a
-        Lyapunov function that can be used for stability verification.
+    num_minima : int
 
     """
-    # Turn values into a multi-dim array
-    feed_dict = lyapunov.feed_dict
+    masked = np.where(region, values, np.inf)
+    neighbor_min = ndimage.minimum_filter(masked, footprint=structure,
+                                          mode='constant', cval=np.inf)
+    local_min = region & (masked <= neighbor_min)
 
-    values = lyapunov(discretization.all_points).eval(feed_dict=feed_dict)
-    lyapunov_values = values.reshape(discretization.num_points)
+    # Local minima with an equal-valued neighbor that is not a local minimum
+    # lie on a plateau that has a lower exit
+    other = np.where(region & ~local_min, values, np.inf)
+    other_min = ndimage.minimum_filter(other, footprint=structure,
+                                       mode='constant', cval=np.inf)
+    on_slope = local_min & (other_min <= values)
 
-    # Starting point for the verification
-    init_value = lyapunov_values[init_node]
+    labels, num_minima = ndimage.label(local_min, structure=structure)
+    return num_minima - len(np.unique(labels[on_slope]))
 
-    ndim = discretization.ndim
-    num_points = discretization.num_points
 
-    # Indices for generating neighbors
+def _queue_order(nodes, rank, neighbor_indices):
+    """Return the order in which the flood fill queues nodes.
+
+    Parameters
+    ----------
+    nodes : ndarray
+        The indices of the nodes, one row for each node.
+    rank : ndarray
+        The order in which the flood expands the nodes of the grid. Negative
+        for nodes that it has not expanded.
+    neighbor_indices : ndarray
+        The offsets of the neighbors, in the order in which they are queued.
+
+    Returns
+    -------
+    order : ndarray
+        The nodes are queued in the order of increasing values. Nodes without
+        expanded neighbors get the largest integer.
+
+    """
+    num_points = np.array(rank.shape)
+    order = np.full(len(nodes), np.iinfo(np.int64).max, dtype=np.int64)
+
+    # Each node is queued by the first of its neighbors that is expanded
+    for i, neighbor_index in enumerate(neighbor_indices):
+        parents = nodes - neighbor_index
+        inside = np.all((parents >= 0) & (parents < num_points), axis=1)
+        parent_rank = rank[tuple(parents[inside].T)]
+        inside[inside] = parent_rank >= 0
+        parent_rank = parent_rank[parent_rank >= 0]
+
+        order[inside] = np.minimum(order[inside],
+                                   parent_rank * len(neighbor_indices) + i)
+    return order
+
+
+def _flood_region(values, region, init_node):
+    """Continue the flood fill of `get_lyapunov_region` node by node.
+
+    Parameters
+    ----------
+    values : ndarray
+        The function values on the grid.
+    region : ndarray
+        A boolean array with the nodes that the flood has already visited.
+        These nodes must have been visited in the order of their values and
+        must not touch the boundary of the grid. If empty, the flood starts
+        at `init_node`.
+    init_node : tuple
+        The node at which the flood starts.
+
+    Returns
+    -------
+    visited : ndarray
+        A boolean array with the nodes that the flood visits.
+
+    """
+    ndim = values.ndim
+    num_points = np.array(values.shape)
+
+    # Indices for generating neighbors, in the order in which they are queued
     index_generator = itertools.product(*[(0, -1, 1) for _ in range(ndim)])
-    neighbor_indeces = np.array(tuple(index_generator)[1:])
+    neighbor_indices = np.array(tuple(index_generator)[1:])
 
     # Array keeping track of visited nodes
-    visited = np.zeros(discretization.num_points, dtype=np.bool)
-    visited[init_node] = True
-
-    # Create priority queue
+    visited = region.copy()
     tiebreaker = itertools.count()
-    last_value = init_value
-    priority_queue = [(init_value, tiebreaker.next(), init_node)]
+
+    if not np.any(region):
+        visited[init_node] = True
+        last_value = values[init_node]
+        priority_queue = [(last_value, next(tiebreaker),
+                           np.array(init_node))]
+    else:
+        # The region was expanded in the order of its values. Ties are
+        # assumed to be expanded in the order of their indices.
+        nodes = np.argwhere(region)
+        expansion_order = np.argsort(values[region], kind='mergesort')
+        rank = np.full(values.shape, -1, dtype=np.int64)
+        rank[tuple(nodes[expansion_order].T)] = np.arange(len(nodes))
+        last_value = np.max(values[region])
+
+        # The neighbors of the region are in the queue
+        structure = ndimage.generate_binary_structure(ndim, ndim)
+        frontier = ndimage.binary_dilation(region, structure=structure)
+        frontier = np.argwhere(frontier & ~region)
+        queue_order = _queue_order(frontier, rank, neighbor_indices)
+
+        frontier = frontier[np.argsort(queue_order)]
+        visited[tuple(frontier.T)] = True
+        priority_queue = [(values[tuple(node)], next(tiebreaker), node)
+                          for node in frontier]
+        heapify(priority_queue)
 
     while priority_queue:
         value, _, next_node = heappop(priority_queue)
@@ -115,21 +227,18 @@ def get_lyapunov_region(lyapunov, discretization, init_node):
         last_value = value
 
         # Get all neighbors
-        neighbors = next_node + neighbor_indeces
+        neighbors = next_node + neighbor_indices
 
         # Remove neighbors that are already part of the visited set
-        is_new = ~visited[np.split(neighbors.T, ndim)]
-        neighbors = neighbors[is_new[0]]
+        neighbors = neighbors[~visited[tuple(neighbors.T)]]
 
         if neighbors.size:
-            indices = np.split(neighbors.T, ndim)
+            indices = tuple(neighbors.T)
             # add to visited set
             visited[indices] = True
-            # get values
-            values = lyapunov_values[indices][0]
 
             # add to priority queue
-            for value, neighbor in zip(values, neighbors):
+            for value, neighbor in zip(values[indices], neighbors):
                 heappush(priority_queue, (value, next(tiebreaker), neighbor))
 
     # Prune nodes that were neighbors, but haven't been visited
@@ -139,6 +248,280 @@ def get_lyapunov_region(lyapunov, discretization, init_node):
     return visited
 
 
+def get_lyapunov_region(lyapunov, discretization, init_node):
+    """Get the region within which a function is a Lyapunov function.
+
+    Starting from `init_node`, the nodes of the grid are flooded in the order
+    of increasing function values. The flood stops when it reaches the
+    boundary of the discretization, or when the function decreases, that is
+    when the flood reaches another basin of the function.
+
+    Until its last level, the flood visits complete sublevel sets of the
+    function. These are found with a binary search over the function values,
+    where each step labels the connected components of a sublevel set on the
+    grid. Only the nodes at the last level are flooded one by one. Within the
+    sublevel sets, nodes with equal values are assumed to be visited in the
+    order of their indices, which can change the order of the ties at the
+    last level.
+
+    Parameters
+    ----------
+    lyapunov : callable
+        A tensorflow function.
+    discretization : instance of `GridWorld`
+        The discretization on which to check the increasing property.
+    init_node : tuple
+        The node at which to start the verification.
+
+    Returns
+    -------
+    region : ndarray
+        A boolean array that contains all the states for which lyapunov is a
+        Lyapunov function that can be used for stability verification.
+
+    """
+    # Turn values into a multi-dim array
+    feed_dict = get_feed_dict(tf.get_default_graph())
+
+    values = lyapunov(discretization.all_points).eval(feed_dict=feed_dict)
+    lyapunov_values = values.reshape(discretization.num_points)
+
+    init_node = tuple(init_node)
+    init_value = lyapunov_values[init_node]
+    ndim = discretization.ndim
+
+    # Neighbors include diagonals
+    structure = ndimage.generate_binary_structure(ndim, ndim)
+
+    interior = np.zeros(discretization.num_points, dtype=bool)
+    interior[(slice(1, -1),) * ndim] = True
+
+    def component(level):
+        """Return the connected sublevel set that contains init_node."""
+        labels, _ = ndimage.label(lyapunov_values <= level,
+                                  structure=structure)
+        return labels == labels[init_node]
+
+    def is_flooded(region):
+        """Check whether the flood visits the region in increasing order."""
+        if np.any(region & ~interior):
+            return False
+        if np.min(lyapunov_values[region]) < init_value:
+            return False
+        return _count_regional_minima(lyapunov_values, region,
+                                      structure) == 1
+
+    # Sublevel sets grow with the level, so the condition is monotone
+    levels = np.unique(lyapunov_values)
+    levels = levels[levels >= init_value]
+
+    low, high = 0, len(levels)
+    while low < high:
+        middle = (low + high) // 2
+        if is_flooded(component(levels[middle])):
+            low = middle + 1
+        else:
+            high = middle
+
+    if low == 0:
+        region = np.zeros(discretization.num_points, dtype=bool)
+    else:
+        region = component(levels[low - 1])
+
+    return _flood_region(lyapunov_values, region, init_node)
+
+
+def _verification_inputs(tf_states, tf_negative):
+    """Return the placeholders and variables that the verification uses.
+
+    Parameters
+    ----------
+    tf_states : tf.placeholder
+        The placeholder for the states, which is excluded.
+    tf_negative : Tensor
+        Whether the decrease condition holds for each state.
+
+    Returns
+    -------
+    placeholders : list of tf.placeholder
+        The placeholders in the order in which they were created.
+    variables : list of tf.Variable
+        The variables in the order in which they were created.
+
+    """
+    graph = tf_negative.graph
+
+    # All operations that the decrease condition depends on
+    operations = set()
+    stack = [tf_negative.op]
+    while stack:
+        operation = stack.pop()
+        if operation not in operations:
+            operations.add(operation)
+            stack.extend(tensor.op for tensor in operation.inputs)
+            stack.extend(operation.control_inputs)
+    operations.discard(tf_states.op)
+
+    variables = {variable.op: variable for variable in
+                 graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)}
+    ordered = [operation for operation in graph.get_operations()
+               if operation in operations]
+
+    placeholders = [operation.outputs[0] for operation in ordered
+                    if operation.type == 'Placeholder']
+    variables = [variables[operation] for operation in ordered
+                 if operation in variables]
+    return placeholders, variables
+
+
+def _load_verification_state(state):
+    """Load the state of the main process into a worker of the pool."""
+    placeholders, variables = _WORKER['inputs']
+    feeds, values = state
+    if len(feeds) != len(placeholders) or len(values) != len(variables):
+        raise ValueError('The model of the VerificationPool factory does '
+                         'not match the model that is verified.')
+
+    feed_dict = _WORKER['lyapunov'].feed_dict
+    for placeholder, feed in zip(placeholders, feeds):
+        if feed is not None:
+            feed_dict[placeholder] = feed
+    for variable, value in zip(variables, values):
+        variable.load(value, _WORKER['session'])
+
+
+def _initialize_worker(factory, update):
+    """Build the Lyapunov instance in a worker process of the pool."""
+    graph = tf.Graph()
+    session = tf.Session(graph=graph)
+    with graph.as_default(), session.as_default():
+        lyapunov = factory()
+        storage = lyapunov._verification_graph()
+        tf_states, tf_negative = list(storage.values())[:2]
+        inputs = _verification_inputs(tf_states, tf_negative)
+
+    _WORKER.update(graph=graph, session=session, lyapunov=lyapunov,
+                   states=tf_states, negative=tf_negative, inputs=inputs,
+                   update=update, version=None)
+
+
+def _worker_verify(args):
+    """Evaluate the decrease condition in a worker process of the pool."""
+    version, state, states = args
+    lyapunov = _WORKER['lyapunov']
+
+    with _WORKER['graph'].as_default(), _WORKER['session'].as_default():
+        if version != _WORKER['version']:
+            if _WORKER['update'] is None:
+                _load_verification_state(state)
+            else:
+                _WORKER['update'](lyapunov, state)
+            _WORKER['version'] = version
+
+        feed_dict = lyapunov.feed_dict
+        feed_dict[_WORKER['states']] = states
+        return _WORKER['negative'].eval(feed_dict)
+
+
+class VerificationPool(object):
+    """Worker processes that verify the decrease condition in parallel.
+
+    Each worker builds its own copy of the Lyapunov instance in a separate
+    graph and session. Pass the pool to `Lyapunov.update_safe_set`, which
+    evaluates one batch of states in each worker at a time and merges the
+    results in value order.
+
+    By default, `Lyapunov.update_safe_set` sends the current values of all
+    placeholders (e.g., the data and hyperparameters of a GP) and variables
+    (e.g., the parameters of a policy) that the verification depends on to
+    the workers. They are matched in the order in which they were created,
+    so the factory must build the same model as the one that is verified.
+    Otherwise, a ValueError is raised.
+
+    Parameters
+    ----------
+    factory : callable
+        A function without arguments that returns a new instance of
+        `Lyapunov`. It is called once in each worker, within a new default
+        graph and session, and is responsible for initializing variables.
+        It must be picklable, e.g., a function defined at the module level.
+    processes : int, optional
+        The number of worker processes. Defaults to the number of CPUs.
+    update : callable, optional
+        A picklable function update(lyapunov, state), which is called in a
+        worker before verification if the state was changed with
+        `set_state`. If provided, it replaces the default synchronization,
+        e.g., for models that keep state outside of the graph.
+
+    Notes
+    -----
+    Workers are started with the 'spawn' method where available, since
+    tensorflow is not safe to use after forking.
+
+    """
+
+    def __init__(self, factory, processes=None, update=None):
+        """Initialization, see `VerificationPool`."""
+        super(VerificationPool, self).__init__()
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+
+        try:
+            context = multiprocessing.get_context('spawn')
+        except AttributeError:
+            context = multiprocessing
+
+        self.update = update
+        self._pool = context.Pool(processes, initializer=_initialize_worker,
+                                  initargs=(factory, update))
+        self._version = 0
+        self._state = None
+
+    def set_state(self, state):
+        """Set the state that is passed to `update` in the workers.
+
+        Parameters
+        ----------
+        state : object
+            A picklable object, which is sent along with each batch.
+
+        """
+        self._state = state
+        self._version += 1
+
+    def verify(self, states):
+        """Evaluate the decrease condition for several batches of states.
+
+        Parameters
+        ----------
+        states : list of ndarray
+            The batches of states.
+
+        Returns
+        -------
+        negative : list of ndarray
+            For each batch, a boolean array that indicates where the
+            decrease condition holds.
+
+        """
+        tasks = [(self._version, self._state, batch) for batch in states]
+        return self._pool.map(_worker_verify, tasks, chunksize=1)
+
+    def close(self):
+        """Terminate the worker processes."""
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        """Use the pool as a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Terminate the worker processes."""
+        self.close()
+
+
 class Lyapunov(object):
     """A class for general Lyapunov functions.
 
@@ -204,8 +587,9 @@ class Lyapunov(object):
         self._storage = dict()
         self.feed_dict = get_feed_dict(tf.get_default_graph())
 
-        # Lyapunov values
+        # Lyapunov values and their lazily sorted order, see `_value_order`
         self.values = None
+        self._order = None
 
         self.c_max = tf.placeholder(config.dtype, shape=())
         self.feed_dict[self.c_max] = 0.
@@ -217,6 +601,10 @@ class Lyapunov(object):
 
         self.adaptive = adaptive
 
+        # Whether the dynamics are cached on the discretization, see
+        # `cache_dynamics`
+        self._cached_dynamics = False
+
         # Keep track of the refinement `N(x)` used around each state `x` in
         # the adaptive discretization; `N(x) = 0` by convention if `x` is
         # unsafe
@@ -308,18 +696,65 @@ class Lyapunov(object):
         # TensorFlow graph
         storage = get_storage(self._storage)
         if storage is None:
-            tf_points = tf.placeholder(config.dtype,
-                                       shape=[None, self.discretization.ndim],
-                                       name='discretization_points')
-            tf_values = self.lyapunov_function(tf_points)
+            fun = self.lyapunov_function
+            if (isinstance(fun, Triangulation)
+                    and fun.discretization is self.discretization):
+                # The values on the vertices are the parameters themselves
+                tf_points = None
+                indices = tf.range(self.discretization.nindex)
+                tf_values = fun(indices=indices)
+            else:
+                tf_points = tf.placeholder(
+                    config.dtype,
+                    shape=[None, self.discretization.ndim],
+                    name='discretization_points')
+                tf_values = fun(tf_points)
             storage = [('points', tf_points), ('values', tf_values)]
             set_storage(self._storage, storage)
         else:
             tf_points, tf_values = storage.values()
 
         feed_dict = self.feed_dict
-        feed_dict[tf_points] = self.discretization.all_points
+        if tf_points is not None:
+            feed_dict[tf_points] = self.discretization.all_points
         self.values = tf_values.eval(feed_dict).squeeze()
+        self._order = None
+
+    def cache_dynamics(self):
+        """Cache the dynamics on the discretization for `update_safe_set`.
+
+        The dynamics must be a `GaussianProcess` whose model supports
+        `set_prediction_points` (e.g., `GPRCached`). The posterior at the
+        states of the discretization and the corresponding actions of the
+        policy is then updated incrementally when data is added to the GP,
+        and `update_safe_set` reads the next states from this cache instead
+        of evaluating the GP for each batch. Call this method again after
+        the policy changes.
+        """
+        dynamics = self.dynamics
+        if not (isinstance(dynamics, GaussianProcess) and
+                hasattr(dynamics.gaussian_process, 'set_prediction_points')):
+            raise ValueError('Only the dynamics of a GaussianProcess with a '
+                             'GPRCached model can be cached.')
+
+        storage = get_storage(self._storage)
+        if storage is None:
+            tf_states = tf.placeholder(config.dtype,
+                                       shape=[None, self.discretization.ndim],
+                                       name='discretization_points')
+            tf_actions = self.policy(tf_states)
+            storage = [('states', tf_states), ('actions', tf_actions)]
+            set_storage(self._storage, storage)
+        else:
+            tf_states, tf_actions = storage.values()
+
+        states = self.discretization.all_points
+        feed_dict = self.feed_dict
+        feed_dict[tf_states] = states
+        actions = tf_actions.eval(feed_dict)
+
+        dynamics.set_prediction_points(np.column_stack((states, actions)))
+        self._cached_dynamics = True
 
     def v_decrease_confidence(self, states, next_states):
         """Compute confidence intervals for the decrease along Lyapunov function.
@@ -404,43 +839,48 @@ class Lyapunov(object):
 
         return v_dot_negative
 
-    @with_scope('update_safe_set')
-    def update_safe_set(self, can_shrink=True, max_refinement=1,
-                        safety_factor=1., parallel_iterations=1):
-        """Compute and update the safe set.
+    def _verification_graph(self, safety_factor=1., cached=False):
+        """Build the graph for safety verification, see `update_safe_set`.
 
         Parameters
         ----------
-        can_shrink : bool, optional
-            A boolean determining whether previously safe states other than the
-            initial safe set must be verified again (i.e., can the safe set
-            shrink in volume?)
-        max_refinement : int, optional
-            The maximum integer divisor used for adaptive discretization.
         safety_factor : float, optional
-            A multiplicative factor greater than 1 used to conservatively
-            estimate the required adaptive discretization.
-        parallel_iterations : int, optional
-            The number of parallel iterations to use for safety verification in
-            the adaptive case. Passed to `tf.map_fn`.
+            See `update_safe_set`.
+        cached : bool, optional
+            If True, the next states are fed from the cache of the dynamics
+            through placeholders, see `cache_dynamics`.
+
+        Returns
+        -------
+        storage : OrderedDict
+            The placeholder for states and the tensors for verification.
 
         """
-        safety_factor = np.maximum(safety_factor, 1.)
-        storage = get_storage(self._storage)
+        storage = get_storage(self._storage, index=cached)
 
         if storage is None:
             # Placeholder for states to evaluate for safety
+            ndim = self.discretization.ndim
             tf_states = tf.placeholder(config.dtype,
-                                       shape=[None, self.discretization.ndim],
+                                       shape=[None, ndim],
                                        name='verification_states')
-            actions = self.policy(tf_states)
-            next_states = self.dynamics(tf_states, actions)
+            if cached:
+                tf_mean = tf.placeholder(config.dtype, shape=[None, ndim],
+                                         name='next_states_mean')
+                tf_error = tf.placeholder(config.dtype, shape=[None, ndim],
+                                          name='next_states_error')
+                next_states = (tf_mean, tf_error)
+            else:
+                actions = self.policy(tf_states)
+                next_states = self.dynamics(tf_states, actions)
 
             decrease = self.v_decrease_bound(tf_states, next_states)
             threshold = self.threshold(tf_states, self.tau)
             tf_negative = tf.squeeze(tf.less(decrease, threshold), axis=1)
 
             storage = [('states', tf_states), ('negative', tf_negative)]
+            if cached:
+                storage += [('next_mean', tf_mean), ('next_error', tf_error)]
 
             if self.adaptive:
                 # Compute an integer n such that dv < threshold for tau / n
@@ -453,50 +893,333 @@ class Lyapunov(object):
                 # If dv < 0, also clip to n = 0
                 tf_n_req = tf.ceil(tf.maximum(tf_n_req, 0))
 
+                # Verify the decrease condition on a local grid of points
+                # around each state, see `_refined_safety_check`
                 dim = int(self.discretization.ndim)
-                lengths = self.discretization.unit_maxes.reshape((-1, 1))
-
-                def refined_safety_check(data):
-                    """Verify decrease condition in a locally refined grid."""
-                    center = tf.reshape(data[:-1], [1, dim])
-                    n_req = tf.cast(data[-1], tf.int32)
-
-                    start = tf.constant(-1., dtype=config.dtype)
-                    spacing = tf.reshape(tf.linspace(start, 1., n_req),
-                                         [1, -1])
-                    border = (0.5 * (1 - 1 / n_req) * lengths *
-                              tf.tile(spacing, [dim, 1]))
-                    mesh = tf.meshgrid(*tf.unstack(border), indexing='ij')
-                    points = tf.stack([tf.reshape(col, [-1]) for col in mesh],
-                                      axis=1)
-                    points += center
-
-                    refined_threshold = self.threshold(center,
-                                                       self.tau / n_req)
-                    negative = tf.less(decrease, refined_threshold)
-                    refined_negative = tf.reduce_all(negative)
-                    return refined_negative
-
-                tf_refinement = tf.placeholder(tf.int32, [None, 1],
-                                               'refinement')
-                data = tf.concat([tf_states, tf.cast(tf_refinement,
-                                                     config.dtype)], axis=1)
-                tf_refined_negative = tf.map_fn(refined_safety_check, data,
-                                                tf.bool, parallel_iterations)
-                storage += [('n_req', tf_n_req), ('refinement', tf_refinement),
+                tf_stencil = tf.placeholder(config.dtype, [None, dim],
+                                            'stencil')
+                tf_refinement = tf.placeholder(config.dtype, shape=(),
+                                               name='refinement')
+
+                points = tf.expand_dims(tf_states, 1) + tf_stencil
+                points = tf.reshape(points, [-1, dim])
+                refined_actions = self.policy(points)
+                refined_next_states = self.dynamics(points, refined_actions)
+                refined_decrease = self.v_decrease_bound(points,
+                                                         refined_next_states)
+                refined_decrease = tf.reshape(refined_decrease,
+                                              [-1, tf.shape(tf_stencil)[0]])
+
+                refined_threshold = self.threshold(tf_states,
+                                                   self.tau / tf_refinement)
+                tf_refined_negative = tf.reduce_all(
+                    tf.less(refined_decrease, refined_threshold), axis=1)
+
+                storage += [('n_req', tf_n_req), ('stencil', tf_stencil),
+                            ('refinement', tf_refinement),
                             ('refined_negative', tf_refined_negative)]
 
+            set_storage(self._storage, storage, index=cached)
+
+        return storage
+
+    def _refined_safety_check(self, states, refinement, cached=False):
+        """Verify the decrease condition in locally refined grids.
+
+        The cell around each state is discretized with `n ** ndim` points,
+        where `n` is the refinement of the state. States with the same
+        refinement share the same stencil of points and are evaluated
+        together, in batches of at most `config.gp_batch_size` points.
+
+        Parameters
+        ----------
+        states : ndarray
+            The states at the centers of the cells.
+        refinement : ndarray
+            The refinement `n` for each state.
+        cached : bool, optional
+            Whether to use the verification graph for cached dynamics.
+
+        Returns
+        -------
+        refined_negative : ndarray
+            A boolean array that indicates where the decrease condition holds
+            for all points of the refined grid.
+
+        """
+        storage = self._verification_graph(cached=cached)
+        tf_states = storage['states']
+        tf_stencil = storage['stencil']
+        tf_refinement = storage['refinement']
+        tf_refined_negative = storage['refined_negative']
+
+        feed_dict = self.feed_dict.copy()
+        lengths = self.discretization.unit_maxes
+        refined_negative = np.zeros(len(states), dtype=bool)
+
+        for n in np.unique(refinement):
+            # Offsets of the refined grid points from the center of the cell
+            spacing = np.linspace(-1., 1., n)
+            border = 0.5 * (1 - 1 / n) * lengths[:, None] * spacing
+            mesh = np.meshgrid(*border, indexing='ij')
+            stencil = np.column_stack([col.ravel() for col in mesh])
+
+            feed_dict[tf_stencil] = stencil
+            feed_dict[tf_refinement] = float(n)
+
+            indices = np.nonzero(refinement == n)[0]
+            batch_size = max(config.gp_batch_size // len(stencil), 1)
+            for i in range(0, len(indices), batch_size):
+                batch = indices[i:i + batch_size]
+                feed_dict[tf_states] = states[batch]
+                refined_negative[batch] = tf_refined_negative.eval(feed_dict)
+
+        return refined_negative
+
+    def _value_order(self, stop):
+        """Return the indices of the `stop` smallest values in sorted order.
+
+        The order is computed lazily: each call only sorts the values that
+        are not yet sorted and needed, in buckets that are selected with
+        `np.argpartition`. The result is cached until `update_values`.
+
+        Parameters
+        ----------
+        stop : int
+            The number of indices to return.
+
+        Returns
+        -------
+        order : ndarray
+            The indices of the discretization that correspond to the `stop`
+            smallest values, in order of increasing values.
+
+        """
+        if self._order is None:
+            self._order = (np.empty(0, dtype=np.intp),
+                           np.arange(len(self.values)))
+        order, rest = self._order
+
+        if stop > len(order) and len(rest) > 0:
+            # Grow the sorted prefix at least geometrically, so that the cost
+            # of the partitions is amortized
+            size = min(max(stop - len(order), len(order)), len(rest))
+            if size < len(rest):
+                partition = np.argpartition(self.values[rest], size - 1)
+                bucket = rest[partition[:size]]
+                rest = rest[partition[size:]]
+            else:
+                bucket, rest = rest, rest[:0]
+
+            bucket = bucket[np.argsort(self.values[bucket])]
+            order = np.concatenate((order, bucket))
+            self._order = (order, rest)
+
+        return order[:stop]
+
+    def _verification_state(self):
+        """Return the state that a `VerificationPool` sends to the workers.
+
+        Returns
+        -------
+        feeds : list
+            The fed values of the placeholders that the verification depends
+            on, None for placeholders that are not fed.
+        values : list of ndarray
+            The values of the variables that the verification depends on.
+
+        """
+        storage = get_storage(self._storage)
+        if storage is None:
+            tf_states, tf_negative = list(
+                self._verification_graph().values())[:2]
+            placeholders, variables = _verification_inputs(tf_states,
+                                                           tf_negative)
+            storage = [('placeholders', placeholders),
+                       ('variables', variables)]
             set_storage(self._storage, storage)
         else:
-            if self.adaptive:
-                (tf_states, tf_negative, tf_n_req, tf_refinement,
-                 tf_refined_negative) = storage.values()
-            else:
-                tf_states, tf_negative = storage.values()
+            placeholders, variables = storage.values()
+
+        feeds = [self.feed_dict.get(placeholder)
+                 for placeholder in placeholders]
+        values = tf.get_default_session().run(variables)
+        return feeds, values
+
+    def _ordered_batches(self, start, batch_size, *arrays):
+        """Generate batches of indices in order of increasing values.
+
+        Parameters
+        ----------
+        start : int
+            The position in the value order of the first index.
+        batch_size : int
+            The number of indices in each batch.
+        arrays : ndarray
+            Additional arrays that are indexed with each batch of indices.
+
+        Yields
+        ------
+        i : int
+            The position in the value order of the first index of the batch.
+        batches : list
+            The batch of indices and copies of the corresponding elements in
+            `arrays`.
+
+        """
+        for i in range(start, len(self.values), batch_size):
+            indices = self._value_order(i + batch_size)[i:]
+            yield i, [indices] + [array[indices] for array in arrays]
+
+    def _verify_batches(self, batch_generator, tf_states, tf_negative,
+                        pool=None, feed=None):
+        """Evaluate the decrease condition on batches in value order.
+
+        Parameters
+        ----------
+        batch_generator : generator
+            The batches of indices (and additional arrays), see
+            `_ordered_batches`.
+        tf_states : tf.placeholder
+            The placeholder for the states.
+        tf_negative : Tensor
+            Whether the decrease condition holds for each state.
+        pool : instance of `VerificationPool`, optional
+            The worker processes to evaluate batches in parallel.
+        feed : callable, optional
+            A function that returns additional feeds for a batch of indices.
+
+        Yields
+        ------
+        i : int
+            The index of the first element of the batch.
+        batches : list
+            The batches from `batch_generator`.
+        states : ndarray
+            The states that correspond to the indices in the batch.
+        negative : ndarray
+            A boolean array that indicates where the decrease condition holds.
+
+        """
+        index_to_state = self.discretization.index_to_state
+
+        if pool is None:
+            # The default session is thread-local
+            session = tf.get_default_session()
+            feed_dict = self.feed_dict
+
+            def evaluate(batch):
+                i, batches = batch
+                states = index_to_state(batches[0])
+                batch_feed_dict = feed_dict.copy()
+                batch_feed_dict[tf_states] = states
+                if feed is not None:
+                    batch_feed_dict.update(feed(batches[0]))
+                negative = session.run(tf_negative, batch_feed_dict)
+                return i, batches, states, negative
+
+            # Evaluate the next batch in the background while the result of
+            # the current batch is processed
+            prefetch = ThreadPool(1)
+
+            def submit():
+                batch = next(batch_generator, None)
+                if batch is not None:
+                    return prefetch.apply_async(evaluate, (batch,))
+
+            try:
+                pending = submit()
+                while pending is not None:
+                    result = pending.get()
+                    pending = submit()
+                    yield result
+            finally:
+                prefetch.terminate()
+            return
+
+        # Evaluate one batch per worker at a time. At most one round of
+        # batches beyond the first unsafe state is wasted.
+        while True:
+            batch_round = list(itertools.islice(batch_generator,
+                                                pool.processes))
+            if not batch_round:
+                break
+
+            states = [index_to_state(batches[0]) for _, batches in batch_round]
+            negatives = pool.verify(states)
+
+            for (i, batches), batch_states, negative in zip(batch_round,
+                                                            states,
+                                                            negatives):
+                yield i, batches, batch_states, negative
+
+    @with_scope('update_safe_set')
+    def update_safe_set(self, can_shrink=True, max_refinement=1,
+                        safety_factor=1., parallel_iterations=None,
+                        pool=None):
+        """Compute and update the safe set.
+
+        Parameters
+        ----------
+        can_shrink : bool, optional
+            A boolean determining whether previously safe states other than the
+            initial safe set must be verified again (i.e., can the safe set
+            shrink in volume?) If False, the verification resumes from the
+            last level set `c_max` and only states with larger values are
+            evaluated.
+        max_refinement : int, optional
+            The maximum integer divisor used for adaptive discretization.
+            The refined safety checks are evaluated in batches of states
+            with the same refinement, see `_refined_safety_check`.
+        safety_factor : float, optional
+            A multiplicative factor greater than 1 used to conservatively
+            estimate the required adaptive discretization.
+        parallel_iterations : int, optional
+            Deprecated and ignored. The refined safety checks are evaluated
+            in batches of states with the same refinement.
+        pool : instance of `VerificationPool`, optional
+            If provided, the decrease condition is evaluated for several
+            batches at once in the worker processes of the pool. The result
+            is the same as without a pool. Unless the pool has a custom
+            `update` function, the current model is sent to the workers, see
+            `VerificationPool`. The workers do not use the cache of
+            `cache_dynamics`.
+
+        Notes
+        -----
+        After `cache_dynamics`, the next states are read from the posterior
+        of the GP dynamics that is cached on the discretization, rather than
+        predicted by the GP for each batch.
+
+        """
+        if parallel_iterations is not None:
+            warnings.warn('parallel_iterations is deprecated and ignored.',
+                          DeprecationWarning)
+
+        safety_factor = np.maximum(safety_factor, 1.)
+        cached = self._cached_dynamics and pool is None
+        storage = self._verification_graph(safety_factor, cached=cached)
+        tf_states, tf_negative = list(storage.values())[:2]
+        if self.adaptive:
+            tf_n_req = storage['n_req']
 
         # Get relevant properties
         feed_dict = self.feed_dict
 
+        if pool is not None and pool.update is None:
+            pool.set_state(self._verification_state())
+
+        if cached:
+            next_mean, next_error = self.dynamics.predict_cached()
+            tf_mean, tf_error = storage['next_mean'], storage['next_error']
+
+            def feed(indices):
+                """Return the cached next states for the indices."""
+                return {tf_mean: next_mean[indices],
+                        tf_error: next_error[indices]}
+        else:
+            feed = None
+
         if can_shrink:
             # Reset the safe set and adaptive discretization
             safe_set = np.zeros_like(self.safe_set, dtype=bool)
@@ -509,24 +1232,31 @@ class Lyapunov(object):
             safe_set = self.safe_set
             refinement = self._refinement
 
-        value_order = np.argsort(self.values)
-        safe_set = safe_set[value_order]
-        refinement = refinement[value_order]
+        start = 0
+        if not can_shrink:
+            # Resume from the last level set, the states with lower values
+            # are known to be safe
+            start = np.count_nonzero(self.values <= feed_dict[self.c_max])
+            known_safe = safe_set[self._value_order(start)]
+            if not np.all(known_safe):
+                start = np.argmin(known_safe)
 
         # Verify safety in batches
         batch_size = config.gp_batch_size
-        batch_generator = batchify((value_order, safe_set, refinement),
-                                   batch_size)
-        index_to_state = self.discretization.index_to_state
+        batch_generator = self._ordered_batches(start, batch_size,
+                                                safe_set, refinement)
+        batch_results = self._verify_batches(batch_generator, tf_states,
+                                             tf_negative, pool=pool,
+                                             feed=feed)
+        verified = []
 
         #######################################################################
 
-        for i, (indices, safe_batch, refine_batch) in batch_generator:
-            states = index_to_state(indices)
-            feed_dict[tf_states] = states
+        for i, batches, states, negative in batch_results:
+            indices, safe_batch, refine_batch = batches
+            verified.append(batches)
 
             # Update the safety with the safe_batch result
-            negative = tf_negative.eval(feed_dict)
             safe_batch |= negative
             refine_batch[negative] = 1
 
@@ -540,13 +1270,14 @@ class Lyapunov(object):
                 if self.adaptive and max_refinement > 1:
                     # Compute required adaptive refinement
                     feed_dict[tf_states] = states[bound:]
+                    if feed is not None:
+                        feed_dict.update(feed(indices[bound:]))
                     refine_batch[bound:] = tf_n_req.eval(feed_dict).ravel()
 
                     # We do not need to refine cells that correspond to known
                     # safe states
-                    idx_safe = np.logical_or(negative,
-                                             self.initial_safe_set[indices])
-                    refine_batch[idx_safe] = 1
+                    known_safe = safe_batch[bound:]
+                    refine_batch[bound:][known_safe] = 1
 
                     # Identify cells to refine
                     states_to_check = np.logical_and(refine_batch >= 1,
@@ -560,11 +1291,12 @@ class Lyapunov(object):
                         stop = np.argmin(states_to_check)
 
                     if stop > 0:
-                        feed_dict[tf_states] = states[bound:bound + stop]
-                        feed_dict[tf_refinement] = refine_batch[bound:
-                                                                bound + stop,
-                                                                None]
-                        refined_safe = tf_refined_negative.eval(feed_dict)
+                        refined_safe = known_safe[:stop].copy()
+                        check = ~refined_safe
+                        refined_safe[check] = self._refined_safety_check(
+                            states[bound:bound + stop][check],
+                            refine_batch[bound:bound + stop][check],
+                            cached=cached)
 
                         # Determine which states are safe under the refined
                         # discretization
@@ -585,6 +1317,9 @@ class Lyapunov(object):
                     safe_batch[bound:] = False
                     refine_batch[bound:] = 0
                     break
+        else:
+            # All remaining states are safe
+            i, bound, refine_bound = len(self.values), 0, 0
 
         # The largest index of a safe value
         max_index = i + bound + refine_bound - 1
@@ -592,13 +1327,18 @@ class Lyapunov(object):
         #######################################################################
 
         # Set placeholder for c_max to the corresponding value
-        feed_dict[self.c_max] = self.values[value_order[max_index]]
+        if max_index >= 0:
+            c_max = self.values[self._value_order(max_index + 1)[max_index]]
+        else:
+            c_max = -np.inf
+        feed_dict[self.c_max] = c_max
 
-        # Restore the order of the safe set and adaptive refinement
-        safe_nodes = value_order[safe_set]
-        self.safe_set[:] = False
-        self.safe_set[safe_nodes] = True
-        self._refinement[value_order] = refinement
+        # Store the verified batches, the states before `start` remain safe
+        for indices, safe_batch, refine_batch in verified:
+            safe_set[indices] = safe_batch
+            refinement[indices] = refine_batch
+        self.safe_set[:] = safe_set
+        self._refinement[:] = refinement
 
         # Ensure the initial safe set is kept
         if self.initial_safe_set is not None:
@@ -651,9 +1391,6 @@ def perturb_actions(states, actions, perturbations, limits=None):
     return state_actions
 
 
-_STORAGE = {}
-
-
 @with_scope('get_safe_sample')
 def get_safe_sample(lyapunov, perturbations=None, limits=None, positive=False,
                     num_samples=None, actions=None):
@@ -0,0 +1,325 @@
+"""
+Lightweight Gaussian process predictors that only depend on numpy and scipy.
+
+A `GaussianProcess` trained with gpflow and tensorflow can be exported with
+`export_predictor` and loaded with `load_predictor`. The resulting
+`GaussianProcessPredictor` computes the same mean and confidence intervals
+without building a tensorflow graph or starting a session.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import scipy.linalg
+
+__all__ = ['GaussianProcessPredictor', 'export_predictor', 'load_predictor']
+
+
+def _rbf(r):
+    """Squared exponential correlation."""
+    return np.exp(-0.5 * r ** 2)
+
+
+def _exponential(r):
+    """Exponential correlation as in gpflow."""
+    return np.exp(-0.5 * r)
+
+
+def _matern12(r):
+    """Matern 1/2 correlation."""
+    return np.exp(-r)
+
+
+def _matern32(r):
+    """Matern 3/2 correlation."""
+    sqrt3_r = np.sqrt(3.) * r
+    return (1. + sqrt3_r) * np.exp(-sqrt3_r)
+
+
+def _matern52(r):
+    """Matern 5/2 correlation."""
+    sqrt5_r = np.sqrt(5.) * r
+    return (1. + sqrt5_r + sqrt5_r ** 2 / 3.) * np.exp(-sqrt5_r)
+
+
+def _wendland(r, input_dim):
+    """Wendland correlation, see `safe_learning.Wendland`."""
+    exponent = input_dim // 2 + 3
+    return np.maximum(1. - r, 0.) ** exponent * (exponent * r + 1.)
+
+
+# Correlation functions of the scaled distance, named after gpflow kernels
+_KERNELS = {'RBF': _rbf,
+            'Exponential': _exponential,
+            'Matern12': _matern12,
+            'Matern32': _matern32,
+            'Matern52': _matern52,
+            'Wendland': _wendland}
+
+# gpflow models that compute the exact GP posterior
+_EXACT_MODELS = ('GPR', 'GPRCached', 'SparseGPRCached')
+
+
+class GaussianProcessPredictor(object):
+    """Exact GP predictions with a stationary kernel in numpy.
+
+    The cholesky decomposition and the weights of the mean prediction are
+    computed once at initialization, unless they are provided (e.g., by
+    `load_predictor`).
+
+    Parameters
+    ----------
+    x : ndarray
+        A 2d array with the training inputs, one on each row.
+    y : ndarray
+        A 2d array with the training outputs, one on each row.
+    kernel : str
+        The name of the stationary kernel, one of 'RBF', 'Exponential',
+        'Matern12', 'Matern32', 'Matern52', or 'Wendland'.
+    variance : float
+        The variance of the kernel.
+    lengthscales : float or ndarray
+        The lengthscales of the kernel.
+    noise_variance : float
+        The variance of the measurement noise.
+    active_dims : ndarray, optional
+        The input dimensions that the kernel acts on. Defaults to all.
+    mean_matrix : ndarray, optional
+        The linear mean function m(x) = x A + b. Defaults to zero.
+    mean_offset : ndarray, optional
+        The offset of the linear mean function. Defaults to zero.
+    beta : float
+        The scaling factor for the standard deviation to create
+        confidence intervals.
+    cholesky : ndarray, optional
+        The lower-triangular cholesky decomposition of the kernel matrix
+        plus noise. Computed if not provided.
+    mean_weights : ndarray, optional
+        The weights of the mean prediction, K^-1 (y - m(x)). Computed if not
+        provided.
+
+    """
+
+    def __init__(self, x, y, kernel, variance, lengthscales, noise_variance,
+                 active_dims=None, mean_matrix=None, mean_offset=None,
+                 beta=2., cholesky=None, mean_weights=None):
+        """Initialization, see `GaussianProcessPredictor`."""
+        super(GaussianProcessPredictor, self).__init__()
+        if kernel not in _KERNELS:
+            raise ValueError('Unsupported kernel {}, use one of {}.'
+                             .format(kernel, sorted(_KERNELS)))
+
+        self.x = np.atleast_2d(x).astype(np.float64)
+        self.y = np.atleast_2d(y).astype(np.float64)
+        self.input_dim = self.x.shape[1]
+        self.output_dim = self.y.shape[1]
+
+        self.kernel = kernel
+        self.variance = float(variance)
+        self.lengthscales = np.asarray(lengthscales, dtype=np.float64)
+        self.noise_variance = float(noise_variance)
+        self.beta = float(beta)
+
+        if active_dims is None:
+            active_dims = np.arange(self.input_dim)
+        self.active_dims = np.asarray(active_dims, dtype=np.int64)
+
+        if mean_matrix is None:
+            mean_matrix = np.zeros((self.input_dim, self.output_dim))
+        if mean_offset is None:
+            mean_offset = np.zeros(self.output_dim)
+        self.mean_matrix = np.asarray(mean_matrix, dtype=np.float64)
+        self.mean_offset = np.asarray(mean_offset, dtype=np.float64)
+
+        # Cache the cholesky decomposition and the mean weights
+        if cholesky is None:
+            kernel_matrix = self.kernel_matrix(self.x, self.x)
+            kernel_matrix += self.noise_variance * np.eye(len(self.x))
+            cholesky = scipy.linalg.cholesky(kernel_matrix, lower=True)
+        self.cholesky = np.asarray(cholesky, dtype=np.float64)
+
+        if mean_weights is None:
+            mean_weights = scipy.linalg.cho_solve(
+                (self.cholesky, True), self.y - self.mean(self.x))
+        self.mean_weights = np.asarray(mean_weights, dtype=np.float64)
+
+    def mean(self, points):
+        """Evaluate the prior mean function."""
+        return points.dot(self.mean_matrix) + self.mean_offset
+
+    def kernel_matrix(self, points1, points2):
+        """Compute the kernel matrix between two sets of points.
+
+        Parameters
+        ----------
+        points1 : ndarray
+        points2 : ndarray
+
+        Returns
+        -------
+        kernel : ndarray
+            The kernel matrix with one row for each point in points1 and one
+            column for each point in points2.
+
+        """
+        points1 = points1[:, self.active_dims] / self.lengthscales
+        points2 = points2[:, self.active_dims] / self.lengthscales
+
+        squared_distance = (np.sum(points1 ** 2, axis=1)[:, None]
+                            + np.sum(points2 ** 2, axis=1)[None, :]
+                            - 2 * points1.dot(points2.T))
+        distance = np.sqrt(np.maximum(squared_distance, 0.))
+
+        correlation = _KERNELS[self.kernel]
+        if self.kernel == 'Wendland':
+            return self.variance * correlation(distance, len(self.active_dims))
+        return self.variance * correlation(distance)
+
+    def predict(self, points):
+        """Predict the mean and variance of the GP.
+
+        Parameters
+        ----------
+        points : ndarray
+            The points at which to evaluate the function. One row for each
+            data points.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+        var : ndarray
+            The variance at the points, one column for each output.
+
+        """
+        points = np.atleast_2d(points).astype(np.float64)
+        kernel = self.kernel_matrix(points, self.x)
+
+        mean = kernel.dot(self.mean_weights) + self.mean(points)
+
+        projection = scipy.linalg.solve_triangular(self.cholesky, kernel.T,
+                                                   lower=True)
+        var = self.variance - np.sum(projection ** 2, axis=0)
+        var = np.tile(np.maximum(var, 0.)[:, None], (1, self.output_dim))
+        return mean, var
+
+    def __call__(self, *points):
+        """Evaluate the model, see `GaussianProcess`.
+
+        Parameters
+        ----------
+        points : ndarray
+            The points at which to evaluate the function. Multiple arrays
+            are concatenated along the second axis.
+
+        Returns
+        -------
+        mean : ndarray
+            The expected function values at the points.
+        std : ndarray
+            The scaled standard deviation (see `beta`).
+
+        """
+        points = np.column_stack(points)
+        mean, var = self.predict(points)
+        return mean, self.beta * np.sqrt(var)
+
+    def save(self, file):
+        """Save the predictor to a file, see `load_predictor`.
+
+        Parameters
+        ----------
+        file : str or file
+            The file name or an open file, as in `numpy.savez`.
+
+        """
+        np.savez(file, x=self.x, y=self.y, kernel=self.kernel,
+                 variance=self.variance, lengthscales=self.lengthscales,
+                 noise_variance=self.noise_variance,
+                 active_dims=self.active_dims, mean_matrix=self.mean_matrix,
+                 mean_offset=self.mean_offset, beta=self.beta,
+                 cholesky=self.cholesky, mean_weights=self.mean_weights)
+
+
+def load_predictor(file):
+    """Load a predictor that was saved with `GaussianProcessPredictor.save`.
+
+    The stored cholesky decomposition and mean weights are reused, so the
+    kernel matrix is not factorized again.
+
+    Parameters
+    ----------
+    file : str or file
+        The file name or an open file, as in `numpy.load`.
+
+    Returns
+    -------
+    predictor : instance of `GaussianProcessPredictor`
+
+    """
+    with np.load(file) as data:
+        kwargs = {key: data[key] for key in data.files}
+    kwargs['kernel'] = str(kwargs['kernel'])
+    return GaussianProcessPredictor(**kwargs)
+
+
+def export_predictor(gaussian_process, file=None):
+    """Export a trained `GaussianProcess` to a numpy predictor.
+
+    Parameters
+    ----------
+    gaussian_process : instance of `safe_learning.GaussianProcess`
+        A GP whose gpflow model is an exact GP regression model (`GPR`,
+        `GPRCached`, or `SparseGPRCached`) with a stationary kernel (see
+        `GaussianProcessPredictor`) and a zero, constant, or linear mean
+        function.
+    file : str or file, optional
+        If provided, the predictor is also saved to this file.
+
+    Returns
+    -------
+    predictor : instance of `GaussianProcessPredictor`
+
+    """
+    gp = gaussian_process.gaussian_process
+    model = type(gp).__name__
+    if model not in _EXACT_MODELS:
+        raise ValueError('Unsupported model {}, use one of {}.'
+                         .format(model, sorted(_EXACT_MODELS)))
+
+    x = gp.X.value
+    y = gp.Y.value
+
+    kern = gp.kern
+    kernel = type(kern).__name__
+    if kernel not in _KERNELS:
+        raise ValueError('Unsupported kernel {}.'.format(kernel))
+    active_dims = np.arange(x.shape[1])[kern.active_dims]
+
+    mean_function = gp.mean_function
+    mean_type = type(mean_function).__name__
+    mean_matrix = np.zeros((x.shape[1], y.shape[1]))
+    mean_offset = np.zeros(y.shape[1])
+    if mean_type == 'Constant':
+        mean_offset += mean_function.c.value
+    elif mean_type == 'Linear':
+        mean_matrix += mean_function.A.value
+        mean_offset += mean_function.b.value
+    elif mean_type != 'Zero':
+        raise ValueError('Unsupported mean function {}.'.format(mean_type))
+
+    # GPRCached multiplies the noise variance by `_scale ** 2` along with
+    # the kernel, so the scale cancels in the predictions
+    predictor = GaussianProcessPredictor(
+        x, y, kernel,
+        variance=kern.variance.value,
+        lengthscales=kern.lengthscales.value,
+        noise_variance=gp.likelihood.variance.value,
+        active_dims=active_dims,
+        mean_matrix=mean_matrix,
+        mean_offset=mean_offset,
+        beta=gaussian_process.beta)
+
+    if file is not None:
+        predictor.save(file)
+    return predictor
@@ -11,6 +11,7 @@ try:
 except ImportError as exception:
     cvxpy = exception
 
+from .functions import GaussianProcess, FunctionStack
 from .utilities import (make_tf_fun, with_scope, get_storage, set_storage,
                         get_feed_dict)
 
@@ -91,10 +92,16 @@ class PolicyIteration(object):
                 policy = self.policy
             actions = policy(states)
 
-        next_states = self.dynamics(states, actions)
+        # Only use the mean dynamics, the variance is only needed for the
+        # Lyapunov constraint
+        mean_dynamics = isinstance(self.dynamics,
+                                   (GaussianProcess, FunctionStack))
+        if lyapunov is None and mean_dynamics:
+            next_states = self.dynamics.to_mean_function()(states, actions)
+        else:
+            next_states = self.dynamics(states, actions)
         rewards = self.reward_function(states, actions)
 
-        # Only use the mean dynamics
         if isinstance(next_states, tuple):
             next_states, var = next_states
 
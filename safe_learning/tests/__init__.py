@@ -0,0 +1 @@
+"""Unit tests for the safe_learning package."""
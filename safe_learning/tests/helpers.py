@@ -0,0 +1,35 @@
+"""Helper functions for the unit tests.
+
+Functions that are passed to worker processes (e.g., the factory of a
+`VerificationPool`) have to be importable, so they are defined here.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+import tensorflow as tf
+
+from safe_learning.functions import LinearSystem, GridWorld
+from safe_learning.lyapunov import Lyapunov
+from safe_learning import config
+
+
+def lyapunov_factory():
+    """Create a Lyapunov instance with a variable policy gain.
+
+    The gain is initialized in the default session and stored in the `gain`
+    attribute of the returned instance.
+    """
+    discretization = GridWorld([[-1, 1]], 51)
+    lyap_fun = lambda x: tf.reduce_sum(tf.square(x), axis=1, keep_dims=True)
+
+    gain = tf.Variable(-.1, dtype=config.dtype, name='gain')
+    tf.get_default_session().run(gain.initializer)
+
+    # Stable for |x| < 1 / sqrt(3)
+    policy = lambda x: gain * x + .3 * x ** 3
+    dynamics = LinearSystem(np.array([[1, 1.]]))
+    lyapunov = Lyapunov(discretization, lyap_fun, dynamics, 0.4, 0.3, 1e-6,
+                        policy, initial_set=[25])
+    lyapunov.gain = gain
+    return lyapunov
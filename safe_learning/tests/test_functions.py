@@ -11,9 +11,16 @@ from safe_learning.functions import (_Triangulation, Triangulation,
                                      ScipyDelaunay, GridWorld,
                                      PiecewiseConstant, DeterministicFunction,
                                      UncertainFunction, QuadraticFunction,
-                                     DimensionError, GPRCached,
-                                     GaussianProcess, NeuralNetwork)
+                                     DimensionError, GPRCached, SGPRCached,
+                                     SparseGPRCached, Wendland,
+                                     GPRConjugateGradient, GPRRandomFeatures,
+                                     GPRKronecker,
+                                     GaussianProcess, LocalGaussianProcess,
+                                     merge_gaussian_processes, FunctionStack,
+                                     NeuralNetwork,
+                                     sample_gp_function)
 from safe_learning.utilities import concatenate_inputs
+from safe_learning import config
 
 try:
     import gpflow
@@ -146,6 +153,26 @@ class TestUncertainFunction(object):
         fd = f.to_mean_function()
         assert(fd(None) == 1)
 
+    def test_stack_mean_function(self):
+        """Test that the mean function of a stack shares variables."""
+        class B(UncertainFunction):
+            def __init__(self):
+                super(B, self).__init__()
+                self.input_dim = 1
+                self.output_dim = 1
+
+            def build_evaluation(self, points):
+                weight = tf.get_variable('weight', shape=(),
+                                         dtype=config.dtype)
+                return weight * points, points
+
+        with tf.Graph().as_default():
+            stack = FunctionStack([B()])
+            points = tf.placeholder(config.dtype, [None, 1])
+            stack(points)
+            stack.to_mean_function()(points)
+            assert len(tf.global_variables()) == 1
+
 
 @pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
 class TestGPRCached(object):
@@ -187,6 +214,124 @@ class TestGPRCached(object):
         assert_allclose(m1, m2)
         assert_allclose(v1, v2)
 
+    def test_incremental_cache(self):
+        """Test the block cholesky update against a full recomputation."""
+        x = np.array([[1, 0], [0, 1]], dtype=float)
+        y = np.array([[0], [1]], dtype=float)
+        gp = GPRCached(x, y, gpflow.kernels.RBF(2), scale=2.)
+
+        x_new = np.array([[1.2, 2.3], [0.5, -0.1]])
+        y_new = np.array([[2.4], [-0.3]])
+
+        gp.add_data_point(x_new[[0]], y_new[[0]])
+        gp.add_data_point(x_new[[1]], y_new[[1]])
+        cholesky, alpha = gp.cholesky.value, gp.alpha.value
+
+        assert_allclose(gp.X.value, np.vstack((x, x_new)))
+        assert_allclose(gp.Y.value, np.vstack((y, y_new)))
+
+        gp.update_cache()
+        assert_allclose(cholesky, gp.cholesky.value)
+        assert_allclose(alpha, gp.alpha.value)
+
+        # Changing hyperparameters triggers a full update
+        gp.kern.lengthscales = 0.5
+        gp.add_data_point(x_new[[0]] + 1, y_new[[0]])
+        cholesky = gp.cholesky.value
+        gp.update_cache()
+        assert_allclose(cholesky, gp.cholesky.value)
+
+    def test_data_buffer(self):
+        """Test that data is appended to preallocated buffers."""
+        x = np.array([[1, 0], [0, 1]], dtype=float)
+        y = np.array([[0], [1]], dtype=float)
+        gp = GPRCached(x, y, gpflow.kernels.RBF(2))
+
+        new_x = np.random.randn(5, 2)
+        new_y = np.random.randn(5, 1)
+        for xi, yi in zip(new_x, new_y):
+            gp.add_data_point(xi, yi)
+
+        assert_allclose(gp.X.value, np.vstack((x, new_x)))
+        assert_allclose(gp.Y.value, np.vstack((y, new_y)))
+        assert len(gp.X._buffer) == 8
+
+        # Replacing the data resets the buffer
+        gp.X = x
+        assert_allclose(gp.X.value, x)
+        gp.X.append(new_x[0])
+        assert_allclose(gp.X.value, np.vstack((x, new_x[[0]])))
+
+    def test_max_data(self):
+        """Test removing the least informative data points."""
+        x = np.array([[1, 0], [0, 1]], dtype=float)
+        y = np.array([[0], [1]], dtype=float)
+        gp = GPRCached(x, y, gpflow.kernels.RBF(2), scale=2., max_data=3)
+
+        test_points = np.array([[0.9, 0.1], [3., 2], [0.4, 0.3]])
+        gp.set_prediction_points(test_points)
+
+        # A duplicate data point is the least informative
+        gp.add_data_point(np.array([[3., 3.]]), np.array([[0.5]]))
+        gp.add_data_point(np.array([[1., 0.]]), np.array([[0.]]))
+
+        data = gp.X.value
+        assert_equal(len(data), 3)
+        assert_equal(np.sum(np.all(data == [1., 0.], axis=1)), 1)
+        assert np.any(np.all(data == [3., 3.], axis=1))
+
+        cholesky, alpha = gp.cholesky.value, gp.alpha.value
+        mean, var = gp.predict_cached()
+        gp.update_cache()
+        assert_allclose(cholesky, gp.cholesky.value)
+        assert_allclose(alpha, gp.alpha.value)
+        assert_allclose(mean, gp.predict_f(test_points)[0])
+        assert_allclose(var, gp.predict_f(test_points)[1])
+
+    @pytest.mark.parametrize('memory_limit', [None, 2 * 3 * 8])
+    def test_prediction_points(self, memory_limit):
+        """Test the incremental posterior at the prediction points."""
+        x = np.array([[1, 0], [0, 1]], dtype=float)
+        y = np.array([[0], [1]], dtype=float)
+        gp = GPRCached(x, y, gpflow.kernels.RBF(2), scale=2.)
+
+        # A small memory limit evaluates one prediction point at a time
+        old_limit = config.gp_memory_limit
+        config.gp_memory_limit = memory_limit
+        try:
+            test_points = np.array([[0.9, 0.1], [3., 2], [0.4, 0.3]])
+            gp.set_prediction_points(test_points)
+            assert_allclose(gp.predict_cached(), gp.predict_f(test_points))
+
+            gp.add_data_point(np.array([[1.2, 2.3]]), np.array([[2.4]]))
+            gp.add_data_point(np.array([[0.5, 0.2]]), np.array([[-0.3]]))
+        finally:
+            config.gp_memory_limit = old_limit
+
+        mean, var = gp.predict_cached()
+        true_mean, true_var = gp.predict_f(test_points)
+        assert_allclose(mean, true_mean)
+        assert_allclose(var, true_var)
+
+    def test_mean_function(self):
+        """Test the mean-only prediction."""
+        x = np.array([[1, 0], [0, 1]], dtype=float)
+        y = np.array([[0], [1]], dtype=float)
+        gp = GPRCached(x, y, gpflow.kernels.RBF(2), scale=2.)
+        gp.add_data_point(np.array([[1.2, 2.3]]), np.array([[2.4]]))
+
+        test_points = np.array([[0.9, 0.1], [3., 2]])
+        gpfun = GaussianProcess(gp)
+        mean_function = gpfun.to_mean_function()
+
+        with tf.Session() as sess:
+            mean_1, _ = sess.run(gpfun(test_points), feed_dict=gpfun.feed_dict)
+            mean_2 = sess.run(mean_function(test_points[:, [0]],
+                                            test_points[:, [1]]),
+                              feed_dict=gpfun.feed_dict)
+
+        assert_allclose(mean_1, mean_2)
+
     def test_predict_f(self, gps):
         """Make sure predictions is same as in uncached case."""
         # Note that this messes things up terribly due to caching. So this
@@ -199,6 +344,257 @@ class TestGPRCached(object):
         assert_allclose(b1, b2)
 
 
+@pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
+class TestSGPRCached(object):
+    """Test the SGPRCached class."""
+
+    def test_predict_f(self):
+        """Make sure predictions are the same as in the uncached case."""
+        x = np.random.randn(20, 2)
+        y = np.random.randn(20, 1)
+        z = x[::4]
+        test_points = np.array([[0.9, 0.1], [3., 2]])
+
+        gp = gpflow.sgpr.SGPR(x, y, gpflow.kernels.RBF(2), z)
+        gp_cached = SGPRCached(x[:-3], y[:-3], gpflow.kernels.RBF(2), z)
+
+        gp_cached.add_data_point(x[-3:], y[-3:])
+        assert_allclose(gp_cached.X.value, x)
+
+        a1, b1 = gp_cached.predict_f(test_points)
+        a2, b2 = gp.predict_f(test_points)
+        assert_allclose(a1, a2)
+        assert_allclose(b1, b2)
+
+
+@pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
+class TestSparseGPRCached(object):
+    """Test the SparseGPRCached class."""
+
+    def test_predict_f(self):
+        """Make sure predictions match a dense GP with the same kernel."""
+        x = np.random.rand(30, 2) * 3
+        y = np.random.randn(30, 1)
+        test_points = np.array([[0.9, 0.1], [3., 2], [10., 10.]])
+
+        kernel = Wendland(2, lengthscales=0.8)
+        gp = gpflow.gpr.GPR(x, y, kernel)
+        gp_sparse = SparseGPRCached(x[:-3], y[:-3], kernel)
+
+        gp_sparse.add_data_point(x[-3:], y[-3:])
+        assert_allclose(gp_sparse.X.value, x)
+
+        a1, b1 = gp_sparse.predict_f(test_points)
+        a2, b2 = gp.predict_f(test_points)
+        assert_allclose(a1, a2)
+        assert_allclose(b1, b2)
+
+        # Outside of the support we recover the prior
+        assert_allclose(a1[-1], 0.)
+        assert_allclose(b1[-1], kernel.variance.value)
+
+    def test_block_update(self):
+        """Make sure block updates and chunked solves are exact."""
+        x = np.random.rand(40, 2) * 3
+        y = np.random.randn(40, 1)
+        test_points = np.random.rand(20, 2) * 3
+
+        kernel = Wendland(2, lengthscales=0.8)
+        gp = gpflow.gpr.GPR(x, y, kernel)
+        gp_sparse = SparseGPRCached(x[:20], y[:20], kernel, refactor_size=6)
+
+        for i in range(20, 40, 4):
+            gp_sparse.add_data_point(x[i:i + 4], y[i:i + 4])
+        assert gp_sparse._num_factorized == 36
+
+        memory_limit = config.gp_memory_limit
+        config.gp_memory_limit = 2 ** 12
+        try:
+            a1, b1 = gp_sparse.predict_f(test_points)
+        finally:
+            config.gp_memory_limit = memory_limit
+
+        a2, b2 = gp.predict_f(test_points)
+        assert_allclose(a1, a2)
+        assert_allclose(b1, b2)
+
+    def test_full_cov(self):
+        """Test the full covariance and sampling with cholesky."""
+        x = np.random.rand(20, 2) * 3
+        y = np.random.randn(20, 1)
+        test_points = np.random.rand(5, 2) * 3
+
+        kernel = Wendland(2, lengthscales=0.8)
+        gp = gpflow.gpr.GPR(x, y, kernel)
+        gp_sparse = SparseGPRCached(x[:-3], y[:-3], kernel)
+        gp_sparse.add_data_point(x[-3:], y[-3:])
+
+        a1, b1 = gp_sparse.predict_f_full_cov(test_points)
+        a2, b2 = gp.predict_f_full_cov(test_points)
+        assert_allclose(a1, a2)
+        assert_allclose(b1, b2)
+
+        gp_sparse.likelihood.variance = 1e-4
+        gp_sparse.update_cache()
+        with tf.Session():
+            values = sample_gp_function(x, GaussianProcess(gp_sparse),
+                                        number=2, return_function=False,
+                                        method='cholesky')
+        assert_allclose(values, np.tile(y.T, (2, 1)), atol=0.1)
+
+
+@pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
+class TestGPRConjugateGradient(object):
+    """Test the GPRConjugateGradient class."""
+
+    def test_predict_f(self):
+        """Make sure predictions match the exact GP."""
+        x = np.random.randn(30, 2)
+        y = np.random.randn(30, 2)
+        test_points = np.array([[0.9, 0.1], [3., 2]])
+
+        gp = gpflow.gpr.GPR(x, y, gpflow.kernels.RBF(2))
+        gp_cg = GPRConjugateGradient(x[:-3], y[:-3], gpflow.kernels.RBF(2),
+                                     tile_size=7, preconditioner_rank=5,
+                                     lanczos_steps=30, tolerance=1e-12)
+
+        gp_cg.add_data_point(x[-3:], y[-3:])
+        assert_allclose(gp_cg.X.value, x)
+
+        a1, b1 = gp_cg.predict_f(test_points)
+        a2, b2 = gp.predict_f(test_points)
+        assert_allclose(a1, a2)
+        assert_allclose(b1, b2)
+
+    def test_variance_bound(self):
+        """Make sure that few Lanczos steps overestimate the variance."""
+        x = np.random.randn(30, 2)
+        y = np.random.randn(30, 1)
+        test_points = np.random.randn(10, 2)
+
+        gp = gpflow.gpr.GPR(x, y, gpflow.kernels.RBF(2))
+        gp_cg = GPRConjugateGradient(x, y, gpflow.kernels.RBF(2),
+                                     preconditioner_rank=2, lanczos_steps=2)
+
+        _, var_cg = gp_cg.predict_f(test_points)
+        _, var = gp.predict_f(test_points)
+        assert np.all(var_cg >= var - 1e-10)
+
+        # The predictions are deterministic
+        assert_equal(gp_cg.predict_f(test_points)[1], var_cg)
+
+        # More steps tighten the bound
+        gp_cg.lanczos_steps = 10
+        _, var_tight = gp_cg.predict_f(test_points)
+        assert np.all(var_tight <= var_cg + 1e-10)
+        assert_allclose(var_tight, var, atol=1e-6)
+
+    def test_full_cov(self):
+        """Test the full covariance and sampling with cholesky."""
+        x = np.random.randn(20, 2)
+        y = np.random.randn(20, 1)
+        test_points = np.random.randn(5, 2)
+
+        gp = gpflow.gpr.GPR(x, y, gpflow.kernels.RBF(2))
+        gp_cg = GPRConjugateGradient(x, y, gpflow.kernels.RBF(2),
+                                     preconditioner_rank=5, tolerance=1e-12)
+
+        a1, b1 = gp_cg.predict_f_full_cov(test_points)
+        a2, b2 = gp.predict_f_full_cov(test_points)
+        assert_allclose(a1, a2)
+        assert_allclose(b1, b2, atol=1e-8)
+
+        gp_cg.likelihood.variance = 1e-4
+        gp_cg.update_cache()
+        with tf.Session():
+            values = sample_gp_function(x, GaussianProcess(gp_cg), number=2,
+                                        return_function=False,
+                                        method='cholesky')
+        assert_allclose(values, np.tile(y.T, (2, 1)), atol=0.1)
+
+
+@pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
+class TestGPRRandomFeatures(object):
+    """Test the GPRRandomFeatures class."""
+
+    def test_predict_f(self):
+        """Make sure predictions match Bayesian linear regression."""
+        x = np.random.randn(20, 2)
+        y = np.random.randn(20, 1)
+        test_points = np.array([[0.9, 0.1], [3., 2]])
+
+        gp = GPRRandomFeatures(x[:-3], y[:-3], gpflow.kernels.RBF(2),
+                               num_features=50)
+        gp.add_data_point(x[-3:], y[-3:])
+        assert_allclose(gp.X.value, x)
+
+        features = gp._compute_features(x)
+        test_features = gp._compute_features(test_points)
+        noise_var = gp.likelihood.variance.value
+
+        precision = features.T.dot(features) + noise_var * np.eye(50)
+        covariance = noise_var * np.linalg.inv(precision)
+        true_mean = test_features.dot(np.linalg.solve(precision,
+                                                      features.T.dot(y)))
+        true_var = np.sum(test_features.dot(covariance) * test_features,
+                          axis=1)
+
+        mean, var = gp.predict_f(test_points)
+        assert_allclose(mean, true_mean)
+        assert_allclose(var[:, 0], true_var)
+
+    def test_kernel_approximation(self):
+        """Make sure many features approximate the exact GP."""
+        x = np.random.randn(20, 2)
+        y = np.random.randn(20, 1)
+        test_points = np.random.randn(5, 2)
+
+        gp = gpflow.gpr.GPR(x, y, gpflow.kernels.RBF(2))
+        gp_rff = GPRRandomFeatures(x, y, gpflow.kernels.RBF(2),
+                                   num_features=10000)
+
+        a1, b1 = gp_rff.predict_f(test_points)
+        a2, b2 = gp.predict_f(test_points)
+        assert_allclose(a1, a2, atol=0.1)
+        assert_allclose(b1, b2, atol=0.1)
+
+
+@pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
+class TestGPRKronecker(object):
+    """Test the GPRKronecker class."""
+
+    def test_predict_f(self):
+        """Make sure predictions match the exact GP."""
+        grid = GridWorld([[0, 1], [-1, 1]], [5, 7])
+        x = grid.all_points
+        y = np.random.randn(grid.nindex, 2)
+        test_points = np.random.rand(10, 2)
+
+        kernel = gpflow.kernels.RBF(2, lengthscales=[0.3, 0.5], ARD=True)
+        gp = gpflow.gpr.GPR(x, y, kernel)
+        gp.likelihood.variance = 0.05
+
+        kernel = gpflow.kernels.RBF(2, lengthscales=[0.3, 0.5], ARD=True)
+        gp_kron = GPRKronecker(grid, y, kernel)
+        gp_kron.likelihood.variance = 0.05
+        gp_kron.update_cache()
+
+        a1, b1 = gp_kron.predict_f(test_points)
+        a2, b2 = gp.predict_f(test_points)
+        assert_allclose(a1, a2)
+        assert_allclose(b1, b2)
+
+        a1, b1 = gp_kron.predict_grid()
+        a2, b2 = gp.predict_f(x)
+        assert_allclose(a1, a2)
+        assert_allclose(b1, b2, atol=1e-10)
+
+        # The data has to stay on the grid
+        gp_kron.X = x[:-1]
+        gp_kron.Y = y[:-1]
+        pytest.raises(ValueError, gp_kron.update_cache)
+
+
 @pytest.mark.skipIf(gpflow is None, 'gpflow module not installed')
 class Testgpflow(object):
     """Test the GaussianProcess function class."""
@@ -234,6 +630,149 @@ class Testgpflow(object):
         assert_allclose(mean_1, mean_2)
         assert_allclose(error_1, error_2)
 
+    def test_chunked_evaluation(self, setup):
+        """Test the prediction in chunks under a memory budget."""
+        test_points = np.random.randn(7, 2)
+        sess, gp = setup
+
+        ufun = GaussianProcess(gp)
+        memory_limit = config.gp_memory_limit
+
+        try:
+            config.gp_memory_limit = None
+            mean_1, error_1 = ufun(test_points)
+
+            # Two points at a time
+            config.gp_memory_limit = 2 * 3 * 8 * len(gp.X.value)
+            mean_2, error_2 = ufun(test_points)
+
+            # All points fit into the budget
+            config.gp_memory_limit = 2 ** 20
+            mean_3, error_3 = ufun(test_points)
+        finally:
+            config.gp_memory_limit = memory_limit
+
+        mean_1, error_1, mean_2, error_2, mean_3, error_3 = sess.run(
+            [mean_1, error_1, mean_2, error_2, mean_3, error_3],
+            feed_dict=ufun.feed_dict)
+
+        assert_allclose(mean_1, mean_2)
+        assert_allclose(error_1, error_2)
+        assert_allclose(mean_1, mean_3)
+        assert_allclose(error_1, error_3)
+
+    def test_local_gaussian_process(self, setup):
+        """Test the mixture of local GP experts."""
+        sess, _ = setup
+        partition = GridWorld([[-1, 1], [-1, 1]], 3)
+        x = np.random.uniform(-1, 1, (40, 2))
+        y = np.random.randn(40, 1)
+
+        def create_gp(x, y):
+            return GPRCached(x, y, gpflow.kernels.RBF(2))
+
+        ufun = LocalGaussianProcess(partition, create_gp, x[:-5], y[:-5])
+        ufun.add_data_point(x[-5:], y[-5:])
+
+        # Every data point is used by at least one expert
+        num_data = sum(len(expert.X) for expert in ufun.experts)
+        assert num_data >= len(x)
+
+        test_points = np.array([[-0.5, -0.5], [0.5, 0.5], [0.9, -0.9],
+                                [3., 3.]])
+        mean, error = ufun(test_points)
+        mean_only = ufun.to_mean_function()(test_points)
+        mean, error, mean_only = sess.run([mean, error, mean_only],
+                                          feed_dict=ufun.feed_dict)
+        assert_allclose(mean_only, mean)
+
+        # Each point is predicted by the expert of its rectangle
+        experts = partition.state_to_rectangle(test_points)
+        for i, expert in enumerate(experts):
+            gp = ufun.experts[expert].gaussian_process
+            local_mean, local_var = gp.predict_f(test_points[[i]])
+            assert_allclose(mean[i], local_mean[0])
+            assert_allclose(error[i], ufun.beta * np.sqrt(local_var[0]))
+
+    def test_merge_gaussian_processes(self, setup):
+        """Test merging GPs with shared inputs into a multi-output GP."""
+        sess, _ = setup
+        x = np.random.randn(10, 2)
+        y = np.random.randn(10, 2)
+        test_points = np.random.randn(5, 2)
+
+        functions = [GaussianProcess(GPRCached(x, y[:, [i]],
+                                               gpflow.kernels.RBF(2)))
+                     for i in range(2)]
+        stack = FunctionStack(functions)
+        merged = merge_gaussian_processes(stack)
+        assert merged.output_dim == 2
+
+        mean_1, error_1 = stack(test_points)
+        mean_2, error_2 = merged(test_points)
+
+        feed_dict = stack.feed_dict
+        mean_1, error_1, mean_2, error_2 = sess.run(
+            [mean_1, error_1, mean_2, error_2], feed_dict=feed_dict)
+        assert_allclose(mean_1, mean_2)
+        assert_allclose(error_1, error_2)
+
+        # Different kernels can not be merged
+        functions[1].gaussian_process.kern.lengthscales = 2.
+        with pytest.raises(ValueError):
+            merge_gaussian_processes(functions)
+
+    @pytest.mark.parametrize('method', ['cholesky', 'rff'])
+    def test_sample_gp_function(self, setup, method):
+        """Test sampling functions from the GP posterior."""
+        sess, _ = setup
+        x = np.array([[1, 0], [0, 1], [0.5, 0.5]], dtype=float)
+        y = np.array([[0], [1], [0.3]], dtype=float)
+        gp = gpflow.gpr.GPR(x, y, gpflow.kernels.RBF(2))
+        gp.likelihood.variance = 1e-4
+        gpfun = GaussianProcess(gp)
+
+        # Samples are close to the data for low noise
+        values = sample_gp_function(x, gpfun, number=2,
+                                    return_function=False, method=method)
+        assert values.shape == (2, 3)
+        assert_allclose(values, np.tile(y.T, (2, 1)), atol=0.1)
+
+        functions = sample_gp_function(x, gpfun, number=2, method=method)
+        assert len(functions) == 2
+        res = sess.run(functions[0](x[:, [0]], x[:, [1]], noise=False),
+                       feed_dict=functions[0].feed_dict)
+        assert_allclose(res, y, atol=0.1)
+
+        pytest.raises(ValueError, sample_gp_function, x, gpfun,
+                      method='unknown')
+
+    def test_sample_gp_function_kronecker(self, setup):
+        """Test sampling on a grid with the Kronecker structure."""
+        sess, _ = setup
+        grid = GridWorld([[0, 1], [0, 1]], [3, 4])
+        x = grid.all_points[[0, 5, 11]]
+        y = np.array([[0], [1], [0.3]], dtype=float)
+        gp = gpflow.gpr.GPR(x, y, gpflow.kernels.RBF(2, ARD=True))
+        gp.likelihood.variance = 1e-4
+        gpfun = GaussianProcess(gp)
+
+        values = sample_gp_function(grid, gpfun, number=2,
+                                    return_function=False, method='kronecker')
+        assert values.shape == (2, grid.nindex)
+        assert_allclose(values[:, [0, 5, 11]], np.tile(y.T, (2, 1)),
+                        atol=0.1)
+
+        functions = sample_gp_function(grid, gpfun, number=1,
+                                       method='kronecker')
+        res = sess.run(functions[0](x, noise=False), feed_dict=gpfun.feed_dict)
+        assert_allclose(res, y, atol=0.1)
+
+        # Data has to be on the grid
+        gp.X = x + 0.1
+        pytest.raises(ValueError, sample_gp_function, grid, gpfun,
+                      method='kronecker')
+
     def test_new_data(self, setup):
         """Test adding data points to the GP."""
         test_points = np.array([[0.9, 0.1], [3., 2]])
@@ -349,6 +888,39 @@ class TestGridworld(object):
         index = grid.state_to_index(test_point)
         assert_equal(index, 0)
 
+    def test_vertex_indices(self):
+        """Test the detection of states on the grid vertices."""
+        grid = GridWorld([[-1.1, 1.5], [2.2, 2.4]], [7, 8])
+
+        indices = grid.vertex_indices(grid.all_points)
+        assert_equal(indices, np.arange(grid.nindex))
+
+        states = grid.index_to_state([3, 0, 17])
+        assert_equal(grid.vertex_indices(states), np.array([3, 0, 17]))
+
+        # States off the grid or outside the limits
+        assert grid.vertex_indices(states + grid.unit_maxes / 3) is None
+        assert grid.vertex_indices(states - grid.unit_maxes) is None
+        assert grid.vertex_indices(np.array([[1., 2., 3.]])) is None
+
+    def test_boundary_indices(self):
+        """Test the enumeration of boundary points."""
+        grid = GridWorld([[-1, 1], [-1, 1], [0, 2]], [4, 5, 3])
+
+        multi_index = np.vstack(np.unravel_index(np.arange(grid.nindex),
+                                                 grid.num_points)).T
+        on_boundary = np.any((multi_index == 0)
+                             | (multi_index == grid.num_points - 1), axis=1)
+        true_indices = np.nonzero(on_boundary)[0]
+
+        for chunk_size in [None, 1, 7]:
+            chunks = list(grid.boundary_indices(chunk_size))
+            if chunk_size is not None:
+                assert max(len(chunk) for chunk in chunks) <= chunk_size
+
+            indices = np.concatenate(chunks)
+            assert_equal(np.sort(indices), true_indices)
+
     def test_integer_numpoints(self):
         """Check integer numpoints argument."""
         grid = GridWorld([[1, 2], [3, 4]], 2)
@@ -579,6 +1151,77 @@ class TestTriangulationNumpy(object):
         result = delaunay(test_points)
         assert_allclose(result, true_values[:, None], atol=1e-5)
 
+    def test_kuhn(self):
+        """Test the sort-based Kuhn triangulation."""
+        limits = [[-1, 1], [0, 2], [-1, 0], [0, 1]]
+        discretization = GridWorld(limits, [3, 4, 2, 3])
+        kuhn = _Triangulation(discretization, method='kuhn')
+        delaunay = _Triangulation(discretization)
+
+        assert_equal(kuhn.triangulation.nsimplex, np.math.factorial(4))
+        assert_equal(kuhn.nsimplex, np.math.factorial(4) *
+                     discretization.nrectangles)
+
+        # Linear functions are represented exactly by both triangulations
+        weights = np.array([[1., -2., 0.5, 3.]]).T
+        kuhn.parameters = discretization.all_points.dot(weights)
+        delaunay.parameters = kuhn.parameters
+
+        test_points = discretization.sample_continuous(50)
+        true_values = test_points.dot(weights)
+        assert_allclose(kuhn(test_points), true_values)
+        assert_allclose(delaunay(test_points), true_values)
+        assert_allclose(kuhn.gradient(test_points), weights.T.repeat(50, 0))
+
+        # Each point lies inside its simplex
+        H = kuhn.parameter_derivative(test_points)
+        assert np.all(H.data > -1e-10)
+        assert_allclose(H.sum(axis=1), 1)
+
+        # Points on the upper faces of the hyperrectangles
+        limit_points = discretization.sample_continuous(50)
+        limit_points[::2, 1] = discretization.limits[1, 1]
+        limit_points[1::2, 2] = discretization.limits[2, 1]
+        limit_points = np.vstack((limit_points, discretization.all_points))
+        assert np.all(kuhn.find_simplex(limit_points) >= 0)
+        assert_allclose(kuhn(limit_points), delaunay(limit_points))
+
+        # Round-off on the upper faces stays within the basic hyperrectangle
+        corners = kuhn.triangulation.points
+        simplex_ids = kuhn._find_unit_simplex(corners * (1 + 1e-12))
+        simplices = kuhn.triangulation.simplices[simplex_ids]
+        contained = simplices == np.arange(len(corners))[:, None]
+        assert np.all(np.any(contained, axis=1))
+
+        # Both triangulations agree on the vertices
+        values = np.random.randn(discretization.nindex, 1)
+        kuhn.parameters = values
+        delaunay.parameters = values
+        assert_allclose(kuhn(discretization.all_points), values)
+        assert_allclose(delaunay(discretization.all_points), values)
+
+        pytest.raises(ValueError, _Triangulation, discretization,
+                      method='unknown')
+
+    def test_vertices(self):
+        """Test the evaluation on the vertices of the grid."""
+        discretization = GridWorld([[-1, 1], [-1, 2]], [3, 4])
+        values = np.random.rand(discretization.nindex, 2)
+        delaunay = _Triangulation(discretization, vertex_values=values)
+
+        indices = np.array([0, 5, 11, 7])
+        states = discretization.index_to_state(indices)
+        assert_allclose(delaunay(states), values[indices])
+        assert_allclose(delaunay(indices=indices), values[indices])
+        assert_allclose(delaunay(discretization.all_points), values)
+        pytest.raises(ValueError, delaunay.build_evaluation)
+
+        H = delaunay.parameter_derivative(states).toarray()
+        assert_allclose(H.dot(values), values[indices])
+
+        # Compare to the interpolation of nearby points
+        assert_allclose(delaunay(states + 1e-12), values[indices], atol=1e-9)
+
     def test_gradient(self):
         """Test the gradient_at function."""
         discretization = GridWorld([[0, 1], [0, 1]], [2, 2])
@@ -689,6 +1332,21 @@ class TestTriangulation(object):
         res = sess.run(tri(test_points))
         assert_allclose(res, trinp(test_points))
 
+    def test_vertices(self, setup):
+        """Test the evaluation on the vertices of the grid."""
+        sess, tri, trinp, test_points = setup
+        points = tri.discretization.all_points
+        indices = np.array([0, 4, 8])
+
+        res = sess.run(tri(points))
+        assert_allclose(res, trinp.parameters)
+
+        res = sess.run(tri(tf.constant(points[indices])))
+        assert_allclose(res, trinp.parameters[indices])
+
+        res = sess.run(tri(indices=indices))
+        assert_allclose(res, trinp.parameters[indices])
+
     def test_projected_evaluate(self, setup):
         """Test evaluations with enabled projection."""
         sess, tri, trinp, test_points = setup
@@ -760,6 +1418,32 @@ class TestTriangulation(object):
             dense_gradient[gradient.indices] = gradient.values[:, 0]
             assert_allclose(dense_gradient, true_gradient[i])
 
+    @pytest.mark.parametrize('method', ['delaunay', 'kuhn'])
+    def test_native(self, method):
+        """Test the tensorflow simplex lookup against the numpy one."""
+        discretization = GridWorld([[-1, 1], [0, 2], [0, 1]], [4, 3, 5])
+        parameters = np.random.randn(discretization.nindex, 2)
+        trinp = _Triangulation(discretization, vertex_values=parameters,
+                               method=method)
+
+        test_points = np.random.uniform(-1.2, 2.2, size=(50, 3))
+        test_points = np.vstack((test_points, discretization.all_points))
+
+        with tf.Session(graph=tf.Graph()) as sess:
+            tri = Triangulation(discretization, vertex_values=parameters,
+                                method=method)
+            points = tf.placeholder(tf.float64, [None, 3])
+            sess.run(tf.global_variables_initializer())
+
+            _, _, simplices = tri._get_hyperplanes(points)
+            res = sess.run([tri(points), tri.gradient(points), simplices],
+                           feed_dict={points: test_points})
+
+        simplex_ids = trinp.find_simplex(test_points)
+        assert_allclose(res[0], trinp(test_points))
+        assert_allclose(res[1], trinp.gradient(test_points))
+        assert_equal(res[2], trinp.simplices(simplex_ids))
+
 
 def test_neural_network():
     """Test the NeuralNetwork class init."""
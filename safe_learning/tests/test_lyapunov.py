@@ -8,15 +8,27 @@ import unittest
 import numpy as np
 import tensorflow as tf
 import sys
+import gc
+import weakref
 
-from safe_learning.functions import (LinearSystem, GridWorld)
-from safe_learning.lyapunov import (Lyapunov, smallest_boundary_value)
+from safe_learning.functions import (LinearSystem, GridWorld, GPRCached,
+                                     GaussianProcess)
+from safe_learning.lyapunov import (Lyapunov, smallest_boundary_value,
+                                    get_lyapunov_region, VerificationPool,
+                                    _flood_region)
+from safe_learning import config
+from safe_learning.tests.helpers import lyapunov_factory
 
 if sys.version_info.major <= 2:
     import mock
 else:
     from unittest import mock
 
+try:
+    import gpflow
+except ImportError:
+    gpflow = None
+
 
 class TestLyapunov(object):
     """Test the Lyapunov base class."""
@@ -73,6 +85,154 @@ class TestLyapunov(object):
             lyap.update_safe_set()
             assert_equal(lyap.safe_set, np.ones(3, dtype=np.bool))
 
+    def test_adaptive_update(self):
+        """Test the update step with adaptive discretization."""
+        with tf.Session():
+            discretization = GridWorld([[-1, 1]], 21)
+            lyap_fun = lambda x: tf.reduce_sum(tf.abs(x), axis=1,
+                                               keep_dims=True)
+            policy = lambda x: -.5 * x
+            dynamics = LinearSystem(np.array([[1, 1.]]))
+
+            # Without refinement only the origin is safe, the states next to
+            # it require a refinement of 6 and the ones after that of 3
+            lyap = Lyapunov(discretization, lyap_fun, dynamics, 0.5, 1., 0.09,
+                            policy, initial_set=[10], adaptive=True)
+
+            lyap.update_safe_set(max_refinement=5, safety_factor=2.)
+            assert_equal(np.nonzero(lyap.safe_set)[0], [10])
+
+            lyap.update_safe_set(max_refinement=6, safety_factor=2.)
+            assert np.all(lyap.safe_set)
+            assert_equal(lyap._refinement[8:13], [3, 6, 1, 6, 3])
+
+            # The deprecated argument is accepted, but has no effect
+            with pytest.warns(DeprecationWarning):
+                lyap.update_safe_set(max_refinement=6, safety_factor=2.,
+                                     parallel_iterations=4)
+            assert np.all(lyap.safe_set)
+
+    def test_value_order(self):
+        """Test the lazily sorted order of the values."""
+        with tf.Session():
+            lyap = lyapunov_factory()
+            values = lyap.values
+            sorted_values = np.sort(values)
+
+            order = lyap._value_order(10)
+            assert_equal(values[order], sorted_values[:10])
+
+            order = lyap._value_order(30)
+            assert_equal(values[order], sorted_values[:30])
+
+            order = lyap._value_order(len(values) + 1)
+            assert_equal(values[order], sorted_values)
+            assert_equal(np.sort(order), np.arange(len(values)))
+
+            # The cache is reset when the values change
+            lyap.update_values()
+            assert lyap._order is None
+
+
+def test_verification_pool():
+    """Make sure parallel verification finds the same safe set."""
+    batch_size = config.gp_batch_size
+    config.gp_batch_size = 4
+
+    def check_safe_set(lyap, pool):
+        lyap.update_safe_set()
+        safe_set = lyap.safe_set.copy()
+        c_max = lyap.feed_dict[lyap.c_max]
+
+        lyap.update_safe_set(pool=pool)
+        assert_equal(lyap.safe_set, safe_set)
+        assert lyap.feed_dict[lyap.c_max] == c_max
+        return safe_set
+
+    try:
+        with tf.Session() as sess:
+            lyap = lyapunov_factory()
+            with VerificationPool(lyapunov_factory, processes=2) as pool:
+                safe_set = check_safe_set(lyap, pool)
+
+                # The workers are synchronized with the current model
+                lyap.gain.load(-.3, sess)
+                new_safe_set = check_safe_set(lyap, pool)
+    finally:
+        config.gp_batch_size = batch_size
+
+    assert np.any(safe_set[:25]) and not np.all(safe_set)
+    assert np.count_nonzero(new_safe_set) > np.count_nonzero(safe_set)
+
+
+def test_warm_start():
+    """Test that states below c_max are not verified again."""
+    batch_size = config.gp_batch_size
+    config.gp_batch_size = 4
+
+    try:
+        with tf.Session():
+            lyap = lyapunov_factory()
+            lyap.update_safe_set()
+            safe_set = lyap.safe_set.copy()
+            c_max = lyap.feed_dict[lyap.c_max]
+
+            discretization = lyap.discretization
+            with mock.patch.object(discretization, 'index_to_state',
+                                   wraps=discretization.index_to_state) as m:
+                lyap.update_safe_set(can_shrink=False)
+    finally:
+        config.gp_batch_size = batch_size
+
+    assert_equal(lyap.safe_set, safe_set)
+    assert lyap.feed_dict[lyap.c_max] == c_max
+
+    indices = np.concatenate([args[0] for args, _ in m.call_args_list])
+    assert np.all(lyap.values[indices] > c_max)
+    assert len(indices) < np.count_nonzero(safe_set)
+
+
+@pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
+def test_cache_dynamics():
+    """Test the verification with the dynamics cached on the grid."""
+    with tf.Session():
+        discretization = GridWorld([[-1, 1]], 51)
+        lyap_fun = lambda x: tf.reduce_sum(tf.square(x), axis=1,
+                                           keep_dims=True)
+        policy = lambda x: -.1 * x + .3 * x ** 3
+
+        x = np.array([[0.5, -0.01], [-0.3, 0.02], [0.1, 0.]])
+        y = 0.9 * x[:, :1] + x[:, 1:]
+        kernel = gpflow.kernels.Linear(2, variance=1.)
+        gp = GPRCached(x, y, kernel)
+        gp.likelihood.variance = 1e-4
+        gp.update_cache()
+        dynamics = GaussianProcess(gp, beta=2.)
+
+        lyap = Lyapunov(discretization, lyap_fun, dynamics, 1., 2., 1e-6,
+                        policy, initial_set=[25])
+        lyap.cache_dynamics()
+
+        def check_safe_set():
+            lyap._cached_dynamics = False
+            lyap.update_safe_set()
+            safe_set = lyap.safe_set.copy()
+
+            lyap._cached_dynamics = True
+            lyap.update_safe_set()
+            assert_equal(lyap.safe_set, safe_set)
+            return safe_set
+
+        safe_set = check_safe_set()
+        assert np.count_nonzero(safe_set) > 1
+
+        # The cache is updated with the data
+        dynamics.add_data_point(np.array([[0.8, 0.1]]), np.array([[0.9]]))
+        check_safe_set()
+
+    lyap.dynamics = LinearSystem(np.array([[1, 1.]]))
+    pytest.raises(ValueError, lyap.cache_dynamics)
+
 
 def test_smallest_boundary_value():
     """Test the boundary value function."""
@@ -82,6 +242,78 @@ def test_smallest_boundary_value():
         min_value = smallest_boundary_value(fun, discretization)
         assert min_value == 2.5
 
+        # The graph is only built once
+        num_ops = len(tf.get_default_graph().get_operations())
+        min_value = smallest_boundary_value(fun, discretization)
+        assert min_value == 2.5
+        assert len(tf.get_default_graph().get_operations()) == num_ops
+
+    # The storage does not keep the graph or the function alive
+    graph = tf.Graph()
+    with graph.as_default(), tf.Session(graph=graph):
+        fun = lambda x: 2 * tf.reduce_sum(tf.abs(x), axis=1)
+        assert smallest_boundary_value(fun, discretization) == 2.5
+
+    references = [weakref.ref(graph), weakref.ref(fun)]
+    del graph, fun
+    gc.collect()
+    assert all(reference() is None for reference in references)
+
+
+def test_get_lyapunov_region():
+    """Test the flooded region of Lyapunov functions."""
+    discretization = GridWorld([[-1, 1], [-1, 1]], [21, 21])
+    points = discretization.all_points
+
+    with tf.Session():
+        # Flood until the boundary, nodes with value one are tied with it
+        fun = lambda x: tf.reduce_sum(tf.square(x), axis=1, keep_dims=True)
+        region = get_lyapunov_region(fun, discretization, (10, 10)).ravel()
+        values = np.sum(points ** 2, axis=1)
+        assert np.all(region[values < 1])
+        assert not np.any(region[values > 1])
+
+        # The flood stops at the first descent
+        region = get_lyapunov_region(fun, discretization, (13, 10))
+        true_region = np.zeros((21, 21), dtype=bool)
+        true_region[[12, 13], 10] = True
+        assert_equal(region, true_region)
+
+        # Two minima that merge at the saddle point at the origin
+        def fun(x):
+            return (tf.square(tf.square(x[:, :1]) - 0.25)
+                    + tf.square(x[:, 1:]))
+        region = get_lyapunov_region(fun, discretization, (15, 10))
+
+        values = (points[:, 0] ** 2 - 0.25) ** 2 + points[:, 1] ** 2
+        true_region = (values < 0.0625) & (points[:, 0] > 0)
+
+        # The saddle point and its lowest neighbor across are visited too
+        true_region = true_region.reshape(21, 21)
+        true_region[[9, 10], 10] = True
+        assert_equal(region, true_region)
+
+
+def test_get_lyapunov_region_flood():
+    """Compare the region to a node-by-node flood fill."""
+    discretization = GridWorld([[-1, 1], [-1, 1], [-1, 1]], [9, 11, 10])
+    points = discretization.all_points
+
+    for _ in range(20):
+        values = np.sum(points ** 2, axis=1, keepdims=True)
+        values += 0.05 * np.random.rand(*values.shape)
+        grid_values = values.reshape(discretization.num_points)
+        init_node = np.unravel_index(np.argmin(grid_values),
+                                     discretization.num_points)
+
+        with tf.Session():
+            region = get_lyapunov_region(lambda x: tf.constant(values),
+                                         discretization, init_node)
+
+        empty = np.zeros(discretization.num_points, dtype=bool)
+        true_region = _flood_region(grid_values, empty, init_node)
+        assert_equal(region, true_region)
+
 
 if __name__ == '__main__':
     unittest.main()
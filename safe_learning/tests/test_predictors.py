@@ -0,0 +1,159 @@
+"""Unit tests for the numpy predictors."""
+
+from __future__ import absolute_import, print_function, division
+
+from numpy.testing import assert_allclose, assert_equal
+import os
+import subprocess
+import sys
+import pytest
+import numpy as np
+import scipy.linalg
+import tensorflow as tf
+
+import safe_learning
+from safe_learning.predictors import (GaussianProcessPredictor,
+                                      export_predictor, load_predictor)
+from safe_learning import GaussianProcess
+from safe_learning.functions import GPRCached, GPRRandomFeatures
+
+if sys.version_info.major <= 2:
+    import mock
+else:
+    from unittest import mock
+
+try:
+    import gpflow
+except ImportError:
+    gpflow = None
+
+
+class TestGaussianProcessPredictor(object):
+    """Test the numpy GP predictor."""
+
+    def test_predict(self):
+        """Compare the predictions to the GP equations."""
+        x = np.random.randn(10, 2)
+        y = np.random.randn(10, 1)
+        test_points = np.random.randn(5, 2)
+
+        predictor = GaussianProcessPredictor(x, y, 'RBF', variance=2.,
+                                             lengthscales=[0.5, 1.],
+                                             noise_variance=0.1, beta=3.)
+
+        def kernel(a, b):
+            a = a / [0.5, 1.]
+            b = b / [0.5, 1.]
+            distance = np.sum((a[:, None, :] - b[None, :, :]) ** 2, axis=2)
+            return 2. * np.exp(-0.5 * distance)
+
+        kernel_inverse = np.linalg.inv(kernel(x, x) + 0.1 * np.eye(10))
+        cross = kernel(test_points, x)
+        true_mean = cross.dot(kernel_inverse).dot(y)
+        true_var = 2. - np.sum(cross.dot(kernel_inverse) * cross, axis=1)
+
+        mean, std = predictor(test_points[:, :1], test_points[:, 1:])
+        assert_allclose(mean, true_mean)
+        assert_allclose(std, 3. * np.sqrt(true_var)[:, None])
+
+    def test_save_load(self, tmpdir):
+        """Test saving and loading predictors."""
+        x = np.random.randn(10, 2)
+        y = np.random.randn(10, 2)
+        test_points = np.random.randn(5, 2)
+
+        predictor = GaussianProcessPredictor(x, y, 'Matern32', variance=1.,
+                                             lengthscales=1.,
+                                             noise_variance=0.1,
+                                             active_dims=[1],
+                                             mean_offset=[1., 2.])
+        filename = str(tmpdir.join('predictor.npz'))
+        predictor.save(filename)
+
+        # The cached factorization is loaded instead of recomputed
+        with mock.patch.object(scipy.linalg, 'cholesky') as cholesky:
+            loaded = load_predictor(filename)
+        assert not cholesky.called
+        assert_equal(loaded.cholesky, predictor.cholesky)
+        assert_equal(loaded.mean_weights, predictor.mean_weights)
+
+        for output, loaded_output in zip(predictor(test_points),
+                                         loaded(test_points)):
+            assert_allclose(output, loaded_output)
+
+    def test_import_without_tensorflow(self):
+        """Make sure the predictors can be used without tensorflow."""
+        code = ("import sys; sys.modules['tensorflow'] = None; "
+                "from safe_learning.predictors import load_predictor; "
+                "import safe_learning; "
+                "assert not hasattr(safe_learning, 'Lyapunov')")
+        path = os.path.dirname(os.path.dirname(safe_learning.__file__))
+        subprocess.check_call([sys.executable, '-c', code], cwd=path)
+
+    def test_errors(self):
+        """Test unsupported kernels."""
+        with pytest.raises(ValueError):
+            GaussianProcessPredictor(np.zeros((1, 1)), np.zeros((1, 1)),
+                                     'Linear', 1., 1., 1.)
+
+
+@pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
+@pytest.mark.parametrize('kernel', ['RBF', 'Matern12', 'Matern32',
+                                    'Matern52', 'Exponential'])
+def test_export_predictor(kernel):
+    """Make sure the exported predictor matches the GaussianProcess."""
+    x = np.random.randn(10, 2)
+    y = np.random.randn(10, 1)
+    test_points = np.random.randn(5, 2)
+
+    kern = getattr(gpflow.kernels, kernel)(2, lengthscales=[0.5, 1.],
+                                           ARD=True)
+    mean_function = gpflow.mean_functions.Constant(0.5)
+
+    with tf.Session() as sess:
+        gp = GaussianProcess(gpflow.gpr.GPR(x, y, kern, mean_function))
+        mean, std = sess.run(gp(test_points), feed_dict=gp.feed_dict)
+
+    predictor = export_predictor(gp)
+    mean_np, std_np = predictor(test_points)
+    assert_allclose(mean_np, mean)
+    assert_allclose(std_np, std)
+
+
+@pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
+def test_export_scaled_predictor():
+    """Make sure the internal scaling of GPRCached is exported."""
+    x = np.random.randn(10, 2)
+    y = np.random.randn(10, 1)
+    test_points = np.random.randn(5, 2)
+
+    kern = gpflow.kernels.RBF(2, lengthscales=[0.5, 1.], ARD=True)
+    mean_function = gpflow.mean_functions.Linear(np.ones((2, 1)),
+                                                 np.ones(1))
+
+    with tf.Session() as sess:
+        model = GPRCached(x, y, kern, mean_function, scale=3.)
+        model.likelihood.variance = 0.1
+        model.update_cache()
+        gp = GaussianProcess(model)
+        mean, std = sess.run(gp(test_points), feed_dict=gp.feed_dict)
+
+    predictor = export_predictor(gp)
+    mean_np, std_np = predictor(test_points)
+    assert_allclose(mean_np, mean)
+    assert_allclose(std_np, std)
+
+
+@pytest.mark.skipif(gpflow is None, reason='gpflow module not installed')
+def test_export_errors():
+    """Test that approximate GP models are not exported."""
+    x = np.random.randn(10, 2)
+    y = np.random.randn(10, 1)
+
+    with tf.Session():
+        model = GPRRandomFeatures(x, y, gpflow.kernels.RBF(2),
+                                  num_features=10)
+        gp = GaussianProcess(model)
+
+    with pytest.raises(ValueError):
+        export_predictor(gp)